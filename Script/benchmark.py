@@ -0,0 +1,322 @@
+"""
+性能基准测试：用固定随机种子生成的语料测量换行、Markdown解析与渲染和端到端批量转换的耗时，
+并与保存的基准结果比较，超过阈值的变慢视为性能回退
+
+语料（每次生成的内容完全相同，摘要值会写入结果用于核对）：
+    - 中文长文：标点密集，大量触发避头尾规则
+    - 英文文本
+    - 混合格式的Markdown：标题、列表、代码块、引用、链接、粗体斜体
+    - 10MB的TXT压力测试文件
+
+用法：python benchmark.py [--save-baseline] [--full] [--threshold=0.1] [--repeat=5] [--baseline=路径]
+    --save-baseline  把本次结果保存为基准（默认为 benchmark_results/benchmark_baseline.json，该目录不纳入版本控制）
+    --baseline=路径  指定基准文件（保存和比较都使用该文件）
+    --full           压力测试文件也做完整的渲染和编码（默认只排版，约需数分钟）
+有性能回退时以退出码1结束，便于在定时任务中检查。
+"""
+import contextlib
+import hashlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import PIL
+from PIL import Image, ImageDraw
+
+from build_manifest import font_identity
+import md_to_jpg
+import txt_to_jpg
+
+BENCHMARK_CONFIG = {
+    'seed': 20240601,             # 语料随机种子（修改后与旧基准不可比）
+    'repeat': 5,                  # 每项测试重复次数，取最短时间
+    'regression_threshold': 0.10,  # 比基准慢超过该比例视为回退
+    'font_size': 20,
+    'max_lines_per_page': 50,
+    'stress_bytes': 10 * 1024 * 1024,
+    'baseline_file': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_results',
+                                  'benchmark_baseline.json'),
+}
+
+# 语料用字：常用汉字和密集的标点（含大量行首、行尾禁则字符）
+CJK_CHARS = '的一是不了在人有我他这个们中来上大为和国地到以说时要就出会可也你对生能而子那得于着下自之年过发后作里用道行所然家种事成方多经么去法学如都同现当没动面起看定天分还进好小部其些主样理心她本前开但因只从想实日'
+CJK_CLOSING = '，。、！？；：”’）》」』…'
+CJK_OPENING = '“‘（《「『'
+ENGLISH_WORDS = ('the quick brown fox jumps over lazy dog layout engine renders pages with kerning width '
+                 'measurement cache paragraph indentation typography benchmark deterministic corpus').split()
+
+
+def make_cjk_prose(char_count, rng):
+    """中文长文：短句密集，引号括号成对出现，句末常有连续的标点"""
+    parts = []
+    length = 0
+    while length < char_count:
+        sentence = ''.join(rng.choice(CJK_CHARS) for _ in range(rng.randint(3, 18)))
+        if rng.random() < 0.3:
+            opening = rng.randrange(len(CJK_OPENING))
+            sentence = CJK_OPENING[opening] + sentence + '”’）》」』'[opening]
+        sentence += ''.join(rng.choice(CJK_CLOSING) for _ in range(rng.choice((1, 1, 1, 2, 3))))
+        if rng.random() < 0.08:
+            sentence += '\n'
+        parts.append(sentence)
+        length += len(sentence)
+    return ''.join(parts)
+
+
+def make_english_text(char_count, rng):
+    """英文文本：句子和段落长度随机"""
+    parts = []
+    length = 0
+    while length < char_count:
+        words = [rng.choice(ENGLISH_WORDS) for _ in range(rng.randint(5, 25))]
+        sentence = ' '.join(words).capitalize() + rng.choice('..,;!?') + ' '
+        if rng.random() < 0.1:
+            sentence += '\n'
+        parts.append(sentence)
+        length += len(sentence)
+    return ''.join(parts)
+
+
+def make_markdown(section_count, rng):
+    """混合格式的Markdown文档"""
+    blocks = []
+    for section in range(section_count):
+        blocks.append(f"{'#' * rng.randint(1, 3)} 第{section + 1}节 {make_cjk_prose(8, rng).strip()}")
+        for _ in range(rng.randint(1, 3)):
+            prose = make_cjk_prose(rng.randint(80, 300), rng).replace('\n', '')
+            words = [rng.choice(ENGLISH_WORDS) for _ in range(4)]
+            blocks.append(f"{prose[:40]}**{words[0]}**{prose[40:80]}*{words[1]}*{prose[80:]}"
+                          f"`{words[2]}()` [{words[3]}](https://example.com/{section})")
+        kind = rng.choice(('list', 'ordered', 'code', 'quote', 'rule'))
+        if kind == 'list':
+            blocks.append('\n'.join(f"- {make_cjk_prose(rng.randint(10, 80), rng).strip()}" for _ in range(rng.randint(2, 6))))
+        elif kind == 'ordered':
+            blocks.append('\n'.join(f"{i}. {make_english_text(rng.randint(20, 120), rng).strip()}" for i in range(1, rng.randint(3, 7))))
+        elif kind == 'code':
+            code = '\n'.join(f"    {' ' * rng.randint(0, 3) * 4}{rng.choice(ENGLISH_WORDS)} = {rng.randint(0, 999)}" for _ in range(rng.randint(3, 10)))
+            blocks.append(code)
+        elif kind == 'quote':
+            blocks.append(f"> {make_cjk_prose(rng.randint(40, 160), rng).strip()}")
+        else:
+            blocks.append('---')
+    return '\n\n'.join(blocks) + '\n'
+
+
+def write_stress_file(path, byte_count, rng):
+    """逐块写出压力测试用的TXT文件（UTF-8），不在内存中保存整篇文本"""
+    written = 0
+    with open(path, 'w', encoding='utf-8', newline='\n') as file:
+        while written < byte_count:
+            chunk = make_cjk_prose(20000, rng)
+            if rng.random() < 0.3:
+                chunk += make_english_text(5000, rng)
+            file.write(chunk)
+            written += len(chunk.encode('utf-8'))
+
+
+def build_corpora(work_dir, config):
+    """
+    生成全部语料，返回 (语料字典, 摘要值)；摘要值用于确认与基准使用的是同一份语料
+    """
+    rng = random.Random(config['seed'])
+    corpora = {
+        'cjk': make_cjk_prose(100000, rng),
+        'english': make_english_text(100000, rng),
+        'markdown': make_markdown(40, rng),
+    }
+
+    # 端到端批量转换用的小目录：几篇中文、英文和Markdown
+    batch_dir = os.path.join(work_dir, 'batch')
+    os.makedirs(batch_dir)
+    for index in range(3):
+        with open(os.path.join(batch_dir, f"中文{index + 1}.txt"), 'w', encoding='utf-8') as file:
+            file.write(make_cjk_prose(15000, rng))
+    with open(os.path.join(batch_dir, 'english.txt'), 'w', encoding='utf-8') as file:
+        file.write(make_english_text(30000, rng))
+    with open(os.path.join(batch_dir, 'mixed.md'), 'w', encoding='utf-8') as file:
+        file.write(make_markdown(30, rng))
+
+    stress_dir = os.path.join(work_dir, 'stress')
+    os.makedirs(stress_dir)
+    write_stress_file(os.path.join(stress_dir, 'stress.txt'), config['stress_bytes'], rng)
+
+    digest = hashlib.sha256()
+    for name in sorted(corpora):
+        digest.update(corpora[name].encode('utf-8'))
+    for directory in (batch_dir, stress_dir):
+        for name in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, name), 'rb') as file:
+                digest.update(file.read())
+    corpora['batch_dir'] = batch_dir
+    corpora['stress_dir'] = stress_dir
+    return corpora, digest.hexdigest()[:16]
+
+
+def time_call(func, repeat):
+    """
+    重复调用 func，返回 (最短耗时, 中位耗时)；func 的输出被丢弃
+    """
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times)
+
+
+def define_benchmarks(corpora, work_dir, config, full):
+    """返回 [(名称, 函数, 重复次数), ...]"""
+    font_size = config['font_size']
+    hd_font_size = font_size * 2
+    repeat = config['repeat']
+
+    font = txt_to_jpg.load_font(hd_font_size)
+    txt_width = txt_to_jpg.calculate_optimal_width(font_size)
+    txt_usable_width = txt_width - 2 * int(txt_width * 0.08)
+
+    md_font, bold_font, italic_font = md_to_jpg.load_fonts(hd_font_size)
+    md_width = md_to_jpg.calculate_optimal_width(font_size)
+    md_margin = int(md_width * 0.08)
+    md_usable_width = md_width - 2 * md_margin
+    line_height = int(hd_font_size * 1.6)
+    parsed = md_to_jpg.parse_markdown(corpora['markdown'])
+    _, md_height = md_to_jpg.layout_markdown(parsed, md_font, md_usable_width, line_height, 40, bold_font, italic_font)
+
+    def render_markdown():
+        image = Image.new('RGB', (md_width, md_height + 80), color=(255, 255, 255))
+        md_to_jpg.render_markdown_content(ImageDraw.Draw(image), parsed, md_font, bold_font, italic_font,
+                                          md_margin, 40, line_height, md_usable_width, (0, 0, 0))
+
+    def run_batch(module, input_dir, output_name, **options):
+        output_dir = os.path.join(work_dir, output_name)
+        shutil.rmtree(output_dir, ignore_errors=True)
+        module.txt_to_jpg_batch(input_dir, output_dir, os.path.join(work_dir, 'backup'), font_size=font_size,
+                                move_to_backup=False, **options)
+
+    benchmarks = [
+        ('wrap_cjk', lambda: txt_to_jpg.wrap_text_with_indent(corpora['cjk'], font, txt_usable_width), repeat),
+        ('wrap_english', lambda: txt_to_jpg.wrap_text_with_indent(corpora['english'], font, txt_usable_width), repeat),
+        ('parse_markdown', lambda: md_to_jpg.parse_markdown(corpora['markdown']), repeat),
+        ('render_markdown_content', render_markdown, repeat),
+        ('batch_txt', lambda: run_batch(txt_to_jpg, corpora['batch_dir'], 'out_txt',
+                                        max_lines_per_page=config['max_lines_per_page']), max(1, repeat // 2)),
+        ('batch_md', lambda: run_batch(md_to_jpg, corpora['batch_dir'], 'out_md'), max(1, repeat // 2)),
+        ('stress_10mb_layout', lambda: run_batch(txt_to_jpg, corpora['stress_dir'], 'out_stress',
+                                                 max_lines_per_page=config['max_lines_per_page'], dry_run=True), 1),
+    ]
+    if full:
+        benchmarks.append(('stress_10mb_batch', lambda: run_batch(txt_to_jpg, corpora['stress_dir'], 'out_stress',
+                                                                  max_lines_per_page=config['max_lines_per_page']), 1))
+    return benchmarks
+
+
+def environment_info():
+    """运行环境（不同环境的结果不可直接比较）"""
+    font = txt_to_jpg.load_font(BENCHMARK_CONFIG['font_size'] * 2)
+    return {
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'font': font_identity(font),
+    }
+
+
+def compare_with_baseline(results, baseline, threshold):
+    """
+    与基准比较，打印对比表，返回变慢超过阈值的测试名称列表
+    """
+    regressions = []
+    print(f"\n{'测试':<26}{'基准':>10}{'本次':>10}{'变化':>9}")
+    for name, result in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print(f"{name:<26}{'-':>10}{result['best']:>9.3f}s{'新增':>8}")
+            continue
+        change = result['best'] / base['best'] - 1
+        mark = ''
+        if change > threshold:
+            regressions.append(name)
+            mark = '  ✗ 回退'
+        print(f"{name:<26}{base['best']:>9.3f}s{result['best']:>9.3f}s{change:>+9.1%}{mark}")
+    return regressions
+
+
+def run_benchmarks(full=False, save_baseline=False, config=None):
+    """
+    生成语料、运行全部测试并与基准比较
+
+    Returns:
+        变慢超过阈值的测试名称列表（没有基准或保存基准时为空）
+    """
+    config = dict(BENCHMARK_CONFIG, **(config or {}))
+    work_dir = tempfile.mkdtemp(prefix='txt_to_jpg_bench_')
+    try:
+        print("生成语料...")
+        corpora, corpus_digest = build_corpora(work_dir, config)
+        print(f"语料摘要: {corpus_digest}")
+
+        results = {}
+        for name, func, repeat in define_benchmarks(corpora, work_dir, config, full):
+            best, median = time_call(func, repeat)
+            results[name] = {'best': round(best, 6), 'median': round(median, 6), 'repeat': repeat}
+            print(f"  ✓ {name:<24} 最短 {best:8.3f}s  中位 {median:8.3f}s  ({repeat} 次)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'corpus_digest': corpus_digest,
+        'environment': environment_info(),
+        'config': {key: config[key] for key in ('seed', 'font_size', 'max_lines_per_page', 'stress_bytes')},
+        'results': results,
+    }
+
+    baseline_file = config['baseline_file']
+    if save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(baseline_file)), exist_ok=True)
+        with open(baseline_file, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=1)
+        print(f"\n基准已保存: {baseline_file}")
+        return []
+
+    if not os.path.exists(baseline_file):
+        print("\n还没有基准结果，可用 --save-baseline 保存本次结果作为基准")
+        return []
+
+    with open(baseline_file, 'r', encoding='utf-8') as file:
+        baseline = json.load(file)
+    if baseline.get('corpus_digest') != corpus_digest:
+        print("\n警告: 语料与基准不同（种子或生成代码有变化），比较结果仅供参考")
+    if baseline.get('environment') != report['environment']:
+        print("警告: 运行环境与基准不同，比较结果仅供参考")
+
+    threshold = config['regression_threshold']
+    regressions = compare_with_baseline(results, baseline, threshold)
+    if regressions:
+        print(f"\n✗ 性能回退（慢于基准 {threshold:.0%} 以上）: {', '.join(regressions)}")
+    else:
+        print(f"\n✓ 没有超过 {threshold:.0%} 的性能回退")
+    return regressions
+
+
+if __name__ == "__main__":
+    options = {}
+    for arg in sys.argv[1:]:
+        if arg.startswith('--threshold='):
+            options['regression_threshold'] = float(arg.split('=', 1)[1])
+        elif arg.startswith('--repeat='):
+            options['repeat'] = int(arg.split('=', 1)[1])
+        elif arg.startswith('--baseline='):
+            options['baseline_file'] = arg.split('=', 1)[1]
+
+    regressions = run_benchmarks(full='--full' in sys.argv, save_baseline='--save-baseline' in sys.argv,
+                                 config=options)
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,176 @@
+"""
+增量构建清单：记录每个输入文件的内容哈希、渲染参数哈希和生成的图片
+
+内容和参数都没有变化、且输出文件都还在的输入会被跳过；
+重新生成后不再需要的旧输出（例如文章变短后多出来的页）会被删除。
+还可以记录每页的哈希，文件修改后只重新生成内容有变化的页面。
+输出图片和清单都先写临时文件再替换（write_file_atomic），中断时不会留下不完整的文件。
+"""
+import hashlib
+import json
+import os
+
+MANIFEST_VERSION = 1
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    计算文件内容的SHA-256（分块读取）
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def font_identity(font):
+    """
+    字体的稳定标识，用于渲染参数的哈希：有文件路径时为路径，
+    从内存加载的字体（如Pillow默认字体）为字体名和样式，每次运行结果相同
+    """
+    path = getattr(font, 'path', None)
+    if isinstance(path, str):
+        return path
+    if hasattr(font, 'getname'):
+        return ' '.join(name for name in font.getname() if name)
+    return type(font).__name__
+
+
+def config_hash(config):
+    """
+    计算渲染参数的哈希（参数字典按键排序后序列化；只能包含JSON类型，
+    其他对象直接报错，避免把内存地址之类每次运行都不同的内容计入哈希）
+    """
+    data = json.dumps(config, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def page_hash(page_lines, render_params):
+    """
+    计算单页的哈希：排版后的文本行 + 渲染参数（与 config_hash 相同，只能包含JSON类型）
+    """
+    data = json.dumps([render_params, page_lines], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class BuildManifest:
+    """
+    保存在输出目录中的构建清单
+
+    files: 输入文件名 -> {'input_hash', 'config_hash', 'outputs', 'pages'（可选，输出文件名 -> 页面哈希）}
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.load()
+
+    def load(self):
+        """读取清单；文件不存在、损坏或版本不同时从空清单开始"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+
+        if isinstance(data, dict) and data.get('version') == MANIFEST_VERSION:
+            self.files = data.get('files', {})
+
+    def save(self):
+        """先写临时文件再替换，避免中断时留下半个清单"""
+        data = json.dumps({'version': MANIFEST_VERSION, 'files': self.files}, ensure_ascii=False, indent=1)
+        write_file_atomic(data.encode('utf-8'), self.path)
+
+    def is_up_to_date(self, name, input_hash, render_hash, output_dir):
+        """
+        输入内容和渲染参数都未变化，且记录的输出文件都存在时返回True
+        """
+        entry = self.files.get(name)
+        if entry is None:
+            return False
+        if entry['input_hash'] != input_hash or entry['config_hash'] != render_hash:
+            return False
+        return all(os.path.exists(os.path.join(output_dir, output)) for output in entry['outputs'])
+
+    def outputs(self, name):
+        """返回输入文件上次生成的输出文件名列表"""
+        entry = self.files.get(name)
+        return list(entry['outputs']) if entry else []
+
+    def page_hashes(self, name):
+        """返回输入文件上次记录的 输出文件名 -> 页面哈希"""
+        entry = self.files.get(name)
+        return dict(entry.get('pages', {})) if entry else {}
+
+    def record(self, name, input_hash, render_hash, outputs, output_dir, page_hashes=None):
+        """
+        记录一次成功的转换，并删除上次生成但这次不再产生的输出文件
+
+        Returns:
+            被删除的旧输出文件名列表
+        """
+        new_outputs = set(outputs)
+        stale = [output for output in self.outputs(name) if output not in new_outputs]
+        remove_outputs(output_dir, stale)
+        entry = {
+            'input_hash': input_hash,
+            'config_hash': render_hash,
+            'outputs': list(outputs),
+        }
+        if page_hashes:
+            entry['pages'] = dict(page_hashes)
+        self.files[name] = entry
+        return stale
+
+    def forget_missing(self, existing_names, output_dir):
+        """
+        输入文件已被删除时，清理它的输出并从清单中移除
+
+        Returns:
+            被移除的输入文件名列表
+        """
+        existing_names = set(existing_names)
+        missing = [name for name in self.files if name not in existing_names]
+        for name in missing:
+            remove_outputs(output_dir, self.files.pop(name)['outputs'])
+        return missing
+
+
+def remove_outputs(output_dir, outputs):
+    """
+    删除输出目录中的指定文件（已不存在的忽略）；
+    输出在子目录中（如按章节拆分的输出）时，删除后变空的子目录也一并删除
+    """
+    subdirs = set()
+    for output in outputs:
+        try:
+            os.remove(os.path.join(output_dir, output))
+        except FileNotFoundError:
+            pass
+        subdir = os.path.dirname(output)
+        while subdir:
+            subdirs.add(subdir)
+            subdir = os.path.dirname(subdir)
+
+    # 先删除最深的目录；目录中还有其他文件时保留
+    for subdir in sorted(subdirs, key=len, reverse=True):
+        try:
+            os.rmdir(os.path.join(output_dir, subdir))
+        except OSError:
+            pass
+
+
+def write_file_atomic(data, output_path):
+    """
+    先写入临时文件再重命名，保证输出文件要么完整要么不存在
+    """
+    temp_path = output_path + '.tmp'
+    try:
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, output_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
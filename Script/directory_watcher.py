@@ -0,0 +1,126 @@
+"""
+目录监视：常驻进程中发现输入目录里新出现（或被修改）且已经写完的文件
+
+安装了 watchdog 时用系统的文件通知（Linux 为 inotify）唤醒，否则定时轮询。
+两种方式都通过比较目录快照（文件大小、修改时间）判断变化：
+文件在 settle_time 秒内大小和修改时间都不再变化，才认为已经写完。
+"""
+import os
+import threading
+import time
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+# 使用文件通知时，没有事件的情况下最长等待这么久也重新扫描一次（防止漏掉事件）
+MAX_EVENT_WAIT = 30.0
+
+
+def snapshot(input_dir, extensions):
+    """
+    返回目录中指定扩展名文件的 文件名 -> (大小, 修改时间)
+    """
+    files = {}
+    with os.scandir(input_dir) as entries:
+        for entry in entries:
+            if not any(entry.name.lower().endswith(ext) for ext in extensions):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.is_file():
+                files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+class _WakeHandler(FileSystemEventHandler):
+    """收到任何文件事件时唤醒等待的线程"""
+
+    def __init__(self, wake):
+        super().__init__()
+        self.wake = wake
+
+    def on_any_event(self, event):
+        self.wake.set()
+
+
+class DirectoryWatcher:
+    """
+    监视输入目录，wait_for_files() 阻塞到有文件写完为止
+
+    start() 时目录中已有的文件视为已处理过（由调用方先做一次批量转换），
+    之后只报告新出现或内容有变化的文件；被移走或删除的文件会被遗忘，再次出现时重新报告。
+    """
+
+    def __init__(self, input_dir, extensions, poll_interval=1.0, settle_time=0.5, use_watchdog=True):
+        self.input_dir = input_dir
+        self.extensions = [ext.lower() for ext in extensions]
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.backend = 'watchdog' if use_watchdog and Observer is not None else 'polling'
+        self._seen = {}     # 已报告过的文件 -> 快照
+        self._pending = {}  # 正在等待写完的文件 -> (快照, 首次看到该快照的时间)
+        self._wake = threading.Event()
+        self._observer = None
+
+    def start(self):
+        """记录当前目录状态，并启动文件通知（如果可用）"""
+        self._seen = snapshot(self.input_dir, self.extensions)
+        if self.backend == 'watchdog':
+            self._observer = Observer()
+            self._observer.schedule(_WakeHandler(self._wake), self.input_dir, recursive=False)
+            self._observer.start()
+
+    def stop(self):
+        """停止文件通知"""
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+
+    def _scan(self):
+        """扫描目录，返回已经写完、需要处理的文件名"""
+        current = snapshot(self.input_dir, self.extensions)
+        now = time.monotonic()
+        ready = []
+        for name, state in current.items():
+            if self._seen.get(name) == state:
+                continue
+            pending = self._pending.get(name)
+            if pending is None or pending[0] != state:
+                # 新文件或仍在写入：重新开始计时
+                self._pending[name] = (state, now)
+            elif now - pending[1] >= self.settle_time:
+                ready.append(name)
+
+        for name in ready:
+            self._seen[name] = self._pending.pop(name)[0]
+        for name in [name for name in self._seen if name not in current]:
+            del self._seen[name]
+        for name in [name for name in self._pending if name not in current]:
+            del self._pending[name]
+        return sorted(ready)
+
+    def wait_for_files(self):
+        """
+        阻塞到至少有一个文件写完，返回这些文件名（按名称排序）
+        """
+        while True:
+            if self._pending:
+                # 有文件正在写入：等它稳定下来再确认
+                timeout = self.settle_time
+            elif self.backend == 'polling':
+                timeout = self.poll_interval
+            else:
+                timeout = MAX_EVENT_WAIT
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+            ready = self._scan()
+            if ready:
+                return ready
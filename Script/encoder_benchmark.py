@@ -0,0 +1,134 @@
+"""
+输出格式基准测试：用真实文章渲染页面，比较各编码器每页的编码耗时、文件大小和画质（PSNR）
+
+用法：python encoder_benchmark.py [文章目录] [最多页数]
+"""
+import io
+import math
+import os
+import sys
+import time
+
+from PIL import Image, ImageChops, ImageStat
+
+from page_encoders import encoder_available, get_encoder
+from text_encoding import read_text
+from txt_to_jpg import (CONFIG, calculate_optimal_width, calculate_page_height, create_image_from_lines,
+                        iter_pages, iter_wrapped_lines, load_font)
+
+# 参与比较的编码器及参数（当前Pillow不支持的格式会被跳过）
+BENCHMARK_ENCODERS = [
+    ('jpeg', {}),                      # 当前 txt_to_jpg 的输出
+    ('jpeg', {'quality': 95}),         # 当前 md_to_jpg 的输出
+    ('png', {}),
+    ('png', {'colors': 16}),
+    ('webp', {'lossless': True}),
+    ('webp', {'quality': 90}),
+    ('avif', {'quality': 60}),
+]
+
+
+def render_corpus_pages(input_dir, max_pages, font_size, bg_color, text_color):
+    """
+    按 txt_to_jpg 的排版把目录中的TXT文章渲染成页面图片（最多 max_pages 页）
+    """
+    scale_factor = 2
+    hd_font_size = font_size * scale_factor
+    font = load_font(hd_font_size)
+    img_width = calculate_optimal_width(font_size, scale_factor)
+    margin_px = int(img_width * 0.08)
+    line_height = int(hd_font_size * 1.6)
+
+    images = []
+    for txt_file in sorted(f for f in os.listdir(input_dir) if f.lower().endswith('.txt')):
+        input_path = os.path.join(input_dir, txt_file)
+        # 与 txt_to_jpg 一样按候选编码依次尝试解码（开头样本之后才出错的编码会换下一个）
+        try:
+            text, _ = read_text(input_path)
+        except Exception:
+            print(f"✗ 跳过无法解码的文件: {txt_file}")
+            continue
+
+        paragraphs = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        lines = iter_wrapped_lines(paragraphs, font, img_width - 2 * margin_px)
+        for page_lines in iter_pages(lines, CONFIG['max_lines_per_page']):
+            page_height = calculate_page_height(len(page_lines), line_height)
+            images.append(create_image_from_lines(
+                page_lines, font, img_width, page_height,
+                margin_px, bg_color, text_color, line_height
+            ))
+            if len(images) >= max_pages:
+                return images
+    return images
+
+
+def psnr(original, decoded):
+    """峰值信噪比（dB），完全相同时为无穷大"""
+    diff = ImageChops.difference(original, decoded.convert(original.mode))
+    stat = ImageStat.Stat(diff)
+    mse = sum(stat.sum2) / (len(stat.sum2) * original.width * original.height)
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def benchmark_encoder(encoder, images):
+    """
+    对每页编码一次，返回 (平均编码耗时ms, 平均字节数, 最低PSNR)
+    """
+    total_time = 0.0
+    total_bytes = 0
+    worst_psnr = math.inf
+    for image in images:
+        buffer = io.BytesIO()
+        start = time.perf_counter()
+        encoder.prepare(image).save(buffer, **encoder.save_args())
+        total_time += time.perf_counter() - start
+        total_bytes += buffer.tell()
+
+        buffer.seek(0)
+        with Image.open(buffer) as decoded:
+            worst_psnr = min(worst_psnr, psnr(image, decoded))
+
+    return total_time * 1000 / len(images), total_bytes / len(images), worst_psnr
+
+
+def run_benchmark(input_dir, max_pages=20, font_size=20, bg_color=(244, 238, 235), text_color=(59, 4, 0)):
+    """
+    渲染页面并依次测试各编码器，打印对比表
+    """
+    images = render_corpus_pages(input_dir, max_pages, font_size, bg_color, text_color)
+    if not images:
+        print(f"在目录 {input_dir} 中没有找到可用的TXT文件")
+        return []
+
+    print(f"测试页面: {len(images)} 页, 页面宽度: {images[0].width}px")
+    print(f"{'编码器':<70}{'耗时/页':>8}{'大小/页':>10}{'相对大小':>8}{'最低PSNR':>10}")
+
+    results = []
+    baseline_bytes = None
+    for output_format, options in BENCHMARK_ENCODERS:
+        if not encoder_available(output_format):
+            print(f"- {output_format}: 当前Pillow不支持，跳过")
+            continue
+
+        encoder = get_encoder(output_format, **options)
+        ms_per_page, bytes_per_page, worst_psnr = benchmark_encoder(encoder, images)
+        if baseline_bytes is None:
+            baseline_bytes = bytes_per_page
+        results.append((repr(encoder), ms_per_page, bytes_per_page, worst_psnr))
+
+        quality = '无损' if worst_psnr == math.inf else f"{worst_psnr:.1f}dB"
+        print(f"{repr(encoder):<73}{ms_per_page:>8.1f}ms{bytes_per_page / 1024:>10.1f}KB"
+              f"{bytes_per_page / baseline_bytes:>11.0%}{quality:>11}")
+
+    return results
+
+
+if __name__ == "__main__":
+    input_directory = sys.argv[1] if len(sys.argv) > 1 else "D:/Fanfic/Script/article"
+    max_pages = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    if not os.path.exists(input_directory):
+        print(f"错误: 输入目录不存在: {input_directory}")
+        print("请创建目录或修改脚本中的路径")
+    else:
+        run_benchmark(input_directory, max_pages, font_size=CONFIG['font_size'])
@@ -0,0 +1,157 @@
+"""
+字体注册表：系统字体只扫描一次，加载过的字体按(路径, 字号, 索引)缓存
+
+get_chinese_font / get_bold_font 每次调用都会探测候选路径并重新读取字体文件，
+Markdown中每个标题都会触发一次。注册表让这些调用变成字典查找。
+"""
+import glob
+import os
+import re
+import sys
+
+from PIL import ImageFont
+
+FONT_EXTENSIONS = ('.ttf', '.ttc', '.otf', '.otc')
+
+
+def _fontconfig_dirs():
+    """
+    从fontconfig配置文件中读取字体目录（Linux）
+    """
+    dirs = []
+    config_files = ['/etc/fonts/fonts.conf'] + sorted(glob.glob('/etc/fonts/conf.d/*.conf'))
+    xdg_data_home = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+
+    for config_file in config_files:
+        try:
+            with open(config_file, 'r', encoding='utf-8', errors='ignore') as file:
+                content = file.read()
+        except OSError:
+            continue
+
+        for attrs, path in re.findall(r'<dir([^>]*)>\s*([^<]+?)\s*</dir>', content):
+            if 'prefix="xdg"' in attrs:
+                path = os.path.join(xdg_data_home, path)
+            dirs.append(os.path.expanduser(path))
+
+    return dirs
+
+
+def system_font_dirs():
+    """
+    返回当前平台的系统字体目录列表
+    """
+    if sys.platform.startswith('win'):
+        windir = os.environ.get('WINDIR', 'C:/Windows')
+        dirs = [os.path.join(windir, 'Fonts')]
+        local_app_data = os.environ.get('LOCALAPPDATA')
+        if local_app_data:
+            dirs.append(os.path.join(local_app_data, 'Microsoft', 'Windows', 'Fonts'))
+    elif sys.platform == 'darwin':
+        dirs = ['/System/Library/Fonts', '/Library/Fonts', os.path.expanduser('~/Library/Fonts')]
+    else:
+        dirs = _fontconfig_dirs() + [
+            '/usr/share/fonts',
+            '/usr/local/share/fonts',
+            os.path.expanduser('~/.local/share/fonts'),
+            os.path.expanduser('~/.fonts'),
+        ]
+
+    # 去重并保持顺序
+    return list(dict.fromkeys(dirs))
+
+
+class FontRegistry:
+    """
+    字体注册表
+
+    - 首次使用时扫描一次系统字体目录，之后按文件名即可找到字体
+    - 已加载的 FreeTypeFont 按 (路径, 字号, 索引) 缓存，并统计命中/未命中次数
+    """
+
+    def __init__(self, font_dirs=None):
+        self.font_dirs = font_dirs
+        self._by_name = None   # 小写文件名 -> 路径
+        self._resolved = {}    # 候选路径 -> 实际路径（None表示不存在）
+        self._fonts = {}       # (路径, 字号, 索引) -> FreeTypeFont
+        self._failed = set()   # 加载失败的 (路径, 索引)
+        self._default_font = None
+        self.hits = 0
+        self.misses = 0
+
+    def scan(self):
+        """扫描系统字体目录（只执行一次）"""
+        if self._by_name is not None:
+            return
+
+        self._by_name = {}
+        for font_dir in self.font_dirs or system_font_dirs():
+            if not os.path.isdir(font_dir):
+                continue
+            for root, _, files in os.walk(font_dir):
+                for name in files:
+                    if name.lower().endswith(FONT_EXTENSIONS):
+                        self._by_name.setdefault(name.lower(), os.path.join(root, name))
+
+    def resolve(self, font_path):
+        """
+        解析字体路径：完整路径直接检查，纯文件名在扫描到的系统字体中查找；结果会被缓存
+        """
+        if font_path in self._resolved:
+            return self._resolved[font_path]
+
+        if os.path.dirname(font_path) and os.path.exists(font_path):
+            resolved = font_path
+        else:
+            self.scan()
+            resolved = self._by_name.get(os.path.basename(font_path).lower())
+        self._resolved[font_path] = resolved
+        return resolved
+
+    def truetype(self, font_path, font_size, index=0):
+        """
+        加载字体（带缓存），加载失败时抛出 OSError/ValueError
+        """
+        key = (font_path, font_size, index)
+        font = self._fonts.get(key)
+        if font is not None:
+            self.hits += 1
+            return font
+
+        self.misses += 1
+        font = ImageFont.truetype(font_path, font_size, index=index)
+        self._fonts[key] = font
+        return font
+
+    def load_first(self, font_paths, font_size, index=0):
+        """
+        按顺序尝试候选字体，返回第一个能加载的字体；都不可用时返回None
+        """
+        for font_path in font_paths:
+            resolved = self.resolve(font_path)
+            if resolved is None or (resolved, index) in self._failed:
+                continue
+            try:
+                return self.truetype(resolved, font_size, index)
+            except (OSError, ValueError):
+                self._failed.add((resolved, index))
+        return None
+
+    def load_default(self):
+        """获取Pillow默认字体（只加载一次）"""
+        if self._default_font is None:
+            self._default_font = ImageFont.load_default()
+        return self._default_font
+
+    def stats(self):
+        """返回缓存统计信息"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'loaded_fonts': len(self._fonts),
+            'system_fonts': len(self._by_name or ()),
+        }
+
+
+# 进程内共享的字体注册表
+FONT_REGISTRY = FontRegistry()
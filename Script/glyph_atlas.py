@@ -0,0 +1,245 @@
+"""
+字形位图缓存：每个 (字体, 字号, 字符, 亚像素位置) 只光栅化一次
+
+中文正文反复使用的只有几千个字形。draw.text 每次都让 FreeType 重新光栅化整行，
+这里改为从缓存中取出字形的灰度蒙版，按排版位置拼成整行后一次性着色，
+结果与 ImageDraw.text 逐像素一致（含字距调整和相邻字形重叠的混合方式）。
+缓存有容量上限（LRU），监视模式和渲染服务等常驻进程的内存不会无限增长。
+"""
+import math
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw, ImageFont
+
+from text_layout import font_key, get_advance_cache, text_length
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 可选的文字渲染后端
+RENDER_BACKENDS = ('draw', 'atlas')
+
+# 字形蒙版默认最多缓存的条目数；一个字形蒙版通常为几KB
+DEFAULT_GLYPH_CACHE_SIZE = 8192
+
+# 字距调整量默认最多缓存的字符对数（中文正文中不同的相邻字符对远多于字形数；每项约百余字节）
+DEFAULT_KERNING_CACHE_SIZE = 65536
+
+
+def _blend_overlap(region, mask):
+    """
+    按 FreeType 渲染整行时的方式叠加重叠的字形：dst + src * (255 - dst) / 255
+    """
+    if np is not None:
+        dst = np.asarray(region, dtype=np.uint32)
+        tmp = np.asarray(mask, dtype=np.uint32) * (255 - dst) + 128
+        return Image.fromarray((dst + (((tmp >> 8) + tmp) >> 8)).astype(np.uint8))
+
+    # 没有NumPy时逐像素计算
+    out = bytearray(region.tobytes())
+    for i, src in enumerate(mask.tobytes()):
+        if src:
+            dst = out[i]
+            tmp = src * (255 - dst) + 128
+            out[i] = dst + (((tmp >> 8) + tmp) >> 8)
+    return Image.frombytes('L', mask.size, bytes(out))
+
+
+class GlyphAtlas:
+    """
+    字形蒙版缓存
+
+    缓存键为 (字体键, 字符, 1/64像素的水平亚像素偏移)，值为 (蒙版, x偏移, y偏移)，
+    偏移相对于字符的笔位置（左上对齐）。
+    字形蒙版最多保存 max_glyphs 项，字符对的字距调整量最多保存 max_kerning_pairs 项，
+    各自超过容量时淘汰最久未使用的条目，并分别统计命中和淘汰次数；线程安全。
+    """
+
+    def __init__(self, max_glyphs=DEFAULT_GLYPH_CACHE_SIZE, max_kerning_pairs=DEFAULT_KERNING_CACHE_SIZE):
+        self.max_glyphs = max_glyphs
+        self.max_kerning_pairs = max_kerning_pairs
+        self._glyphs = OrderedDict()
+        self._kerning = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.kerning_hits = 0
+        self.kerning_misses = 0
+        self.kerning_evictions = 0
+
+    def _lookup(self, cache, key):
+        # 取出缓存的值并标记为最近使用；未缓存时返回None
+        with self._lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+
+    def _store(self, cache, key, value):
+        with self._lock:
+            cache[key] = value
+            self._trim()
+
+    def _trim(self):
+        # 两个缓存各自按容量淘汰，淘汰次数分开统计
+        while len(self._glyphs) > self.max_glyphs:
+            self._glyphs.popitem(last=False)
+            self.evictions += 1
+        while len(self._kerning) > self.max_kerning_pairs:
+            self._kerning.popitem(last=False)
+            self.kerning_evictions += 1
+
+    def resize(self, max_glyphs=None, max_kerning_pairs=None):
+        """修改容量（None 表示不变），多出的条目按最久未使用的顺序淘汰"""
+        with self._lock:
+            if max_glyphs is not None:
+                self.max_glyphs = max_glyphs
+            if max_kerning_pairs is not None:
+                self.max_kerning_pairs = max_kerning_pairs
+            self._trim()
+
+    def supports(self, font):
+        """Raqm布局会做字形整形，不能按单字拼接，此时回退到 draw.text"""
+        return (isinstance(font, ImageFont.FreeTypeFont)
+                and font.layout_engine == ImageFont.Layout.BASIC)
+
+    def glyph(self, font, char, subpixel=0):
+        """
+        获取字符的蒙版，subpixel 为笔位置小数部分（单位1/64像素）
+        """
+        key = (font_key(font), char, subpixel)
+        glyph = self._lookup(self._glyphs, key)
+        if glyph is not None:
+            self.hits += 1
+            return glyph
+
+        self.misses += 1
+        left, top, right, bottom = font.getbbox(char)
+        origin_x = 2 + max(0, -left)
+        origin_y = 2 + max(0, -top)
+        canvas = Image.new('L', (origin_x + max(right, 0) + 4, origin_y + max(bottom, 0) + 4), 0)
+        ImageDraw.Draw(canvas).text((origin_x + subpixel / 64, origin_y), char, font=font, fill=255)
+
+        bbox = canvas.getbbox()
+        if bbox is None:
+            glyph = (None, 0, 0)
+        else:
+            glyph = (canvas.crop(bbox), bbox[0] - origin_x, bbox[1] - origin_y)
+        self._store(self._glyphs, key, glyph)
+        return glyph
+
+    def kerning(self, font, advance_cache, left, right):
+        """字符对的字距调整量（基础布局下 getlength 等于单字宽度与字距之和）"""
+        key = (font_key(font), left, right)
+        value = self._lookup(self._kerning, key)
+        if value is not None:
+            self.kerning_hits += 1
+            return value
+
+        self.kerning_misses += 1
+        value = text_length(font, left + right) - advance_cache.advance(left) - advance_cache.advance(right)
+        self._store(self._kerning, key, value)
+        return value
+
+    def draw_text(self, draw, xy, text, font, fill):
+        """
+        与 draw.text(xy, text, font=font, fill=fill) 效果相同的单行文字绘制
+        """
+        if '\n' in text or not self.supports(font):
+            draw.text(xy, text, font=font, fill=fill)
+            return
+
+        advance_cache = get_advance_cache(font)
+        x, y = xy
+        y = int(y)
+        pen = x
+        prev_char = None
+        placed = []
+
+        # 计算每个字形的位置并取出蒙版
+        for char in text:
+            if prev_char is not None and advance_cache.has_kerning:
+                pen += self.kerning(font, advance_cache, prev_char, char)
+            pen_int = math.floor(pen)
+            subpixel = round((pen - pen_int) * 64)
+            if subpixel == 64:
+                pen_int += 1
+                subpixel = 0
+
+            mask, offset_x, offset_y = self.glyph(font, char, subpixel)
+            if mask is not None:
+                placed.append((mask, pen_int + offset_x, y + offset_y))
+
+            pen += advance_cache.advance(char)
+            prev_char = char
+
+        if not placed:
+            return
+
+        # 拼成整行蒙版，再一次性着色
+        left = min(px for _, px, _ in placed)
+        top = min(py for _, _, py in placed)
+        right = max(px + mask.width for mask, px, _ in placed)
+        bottom = max(py + mask.height for mask, _, py in placed)
+        line_mask = Image.new('L', (right - left, bottom - top), 0)
+
+        for mask, px, py in placed:
+            box = (px - left, py - top, px - left + mask.width, py - top + mask.height)
+            region = line_mask.crop(box)
+            if region.getbbox() is None:
+                line_mask.paste(mask, box)
+            else:
+                line_mask.paste(_blend_overlap(region, mask), box)
+
+        draw.bitmap((left, top), line_mask, fill=fill)
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            return {
+                'glyphs': len(self._glyphs),
+                'max_glyphs': self.max_glyphs,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'kerning_pairs': len(self._kerning),
+                'max_kerning_pairs': self.max_kerning_pairs,
+                'kerning_hits': self.kerning_hits,
+                'kerning_misses': self.kerning_misses,
+                'kerning_evictions': self.kerning_evictions,
+            }
+
+
+def format_atlas_stats(stats):
+    """字形缓存统计的单行描述（字体没有字距调整时不查字距，不显示字距对）"""
+    text = (f"字形缓存: {stats['glyphs']} 个字形, 命中 {stats['hits']} 次, 光栅化 {stats['misses']} 次, "
+            f"淘汰 {stats['evictions']} 次")
+    if stats['kerning_hits'] or stats['kerning_misses']:
+        text += (f"; 字距对: {stats['kerning_pairs']} 个, 命中 {stats['kerning_hits']} 次, "
+                 f"测量 {stats['kerning_misses']} 次, 淘汰 {stats['kerning_evictions']} 次")
+    return text
+
+
+# 进程内共享的字形缓存
+GLYPH_ATLAS = GlyphAtlas()
+
+
+def _draw_text_with_imagedraw(draw, xy, text, font, fill):
+    draw.text(xy, text, font=font, fill=fill)
+
+
+def get_text_drawer(render_backend='draw'):
+    """
+    根据渲染后端返回文字绘制函数 draw_text(draw, xy, text, font, fill)
+
+    'draw' 为 ImageDraw.text（默认），'atlas' 为字形位图缓存拼接
+    """
+    if render_backend == 'atlas':
+        return GLYPH_ATLAS.draw_text
+    if render_backend == 'draw':
+        return _draw_text_with_imagedraw
+    raise ValueError(f"未知的渲染后端: {render_backend}")
@@ -0,0 +1,74 @@
+"""
+排版报告（预演模式）：只解码、换行和分页，不渲染也不编码，统计每个文件的行数、页数和每页尺寸
+
+用于估算一批文件的输出规模，快速找出过大的文档。
+"""
+import json
+import os
+
+# JPEG 图片宽高上限
+JPEG_MAX_DIMENSION = 65535
+
+
+def estimated_bytes(width, height):
+    """页面未压缩时的大小（RGB，每像素3字节）"""
+    return width * height * 3
+
+
+def file_report(input_file, encoding, line_count, page_sizes):
+    """
+    单个文件的排版结果
+
+    page_sizes: 每页的 (宽度, 高度)
+    """
+    return {
+        'file': input_file,
+        'encoding': encoding,
+        'lines': line_count,
+        'pages': len(page_sizes),
+        'page_sizes': [list(size) for size in page_sizes],
+        'estimated_bytes': sum(estimated_bytes(width, height) for width, height in page_sizes),
+        'max_page_height': max((height for _, height in page_sizes), default=0),
+        'oversize_pages': [page_num for page_num, (width, height) in enumerate(page_sizes, 1)
+                           if max(width, height) > JPEG_MAX_DIMENSION],
+    }
+
+
+def write_layout_report(path, settings, reports, failures):
+    """
+    写出JSON报告（先写临时文件再替换）
+
+    settings: 排版参数；reports: file_report() 的列表；failures: 文件名 -> 错误信息
+    """
+    report = {
+        'settings': settings,
+        'summary': {
+            'files': len(reports),
+            'failed': len(failures),
+            'lines': sum(item['lines'] for item in reports),
+            'pages': sum(item['pages'] for item in reports),
+            'estimated_bytes': sum(item['estimated_bytes'] for item in reports),
+        },
+        'files': reports,
+        'failures': failures,
+    }
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=1)
+    os.replace(temp_path, path)
+    return report
+
+
+def print_layout_summary(report, largest=5):
+    """打印报告摘要和页数最多的几个文件"""
+    summary = report['summary']
+    print(f"\n排版预演完成！文件: {summary['files']}, 失败: {summary['failed']}, "
+          f"总行数: {summary['lines']}, 总页数: {summary['pages']}, "
+          f"未压缩约 {summary['estimated_bytes'] / 1024 / 1024:.1f}MB")
+
+    for item in sorted(report['files'], key=lambda item: item['estimated_bytes'], reverse=True)[:largest]:
+        print(f"  {item['file']}: {item['pages']} 页, {item['lines']} 行, "
+              f"最高 {item['max_page_height']}px, 约 {item['estimated_bytes'] / 1024 / 1024:.1f}MB")
+    for item in report['files']:
+        if item['oversize_pages']:
+            print(f"  ✗ {item['file']}: 第 {', '.join(map(str, item['oversize_pages']))} 页超过JPEG尺寸上限")
@@ -1,14 +1,44 @@
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 import textwrap
 import os
 import shutil
 import re
+import sys
+import time
 from html import unescape
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+
+from build_manifest import BuildManifest, config_hash, file_hash, font_identity, write_file_atomic
+from directory_watcher import DirectoryWatcher
+from font_registry import FONT_REGISTRY
+from glyph_atlas import GLYPH_ATLAS, format_atlas_stats, get_text_drawer
+from layout_report import file_report, print_layout_summary, write_layout_report
+from page_encoders import JpegEncoder, format_encode_stats, get_encoder
+from pipeline_metrics import BatchMetrics, FileMetrics, run_profiled
+from text_encoding import read_text
+from text_layout import (MEASURE_CACHE, break_opportunities, break_text, format_measure_stats, get_advance_cache,
+                         init_worker, prefix_breaks, set_measure_cache_size, text_length)
 
 # 避头尾字符定义（更精确的集合）
 FORBIDDEN_START_CHARS = set('，,。.、！!？?：:；;")）〕］】》」』】〗〞〟〉》›»}])')
 FORBIDDEN_END_CHARS = set('‘"（([{《‹「『【〖〝〝〈《‹「『【〖')
 
+# 行内样式编号：格式化文本表示为样式段 (样式编号, 文本) 的元组
+STYLE_NORMAL, STYLE_BOLD, STYLE_ITALIC, STYLE_CODE, STYLE_LINK = range(5)
+STYLE_IDS = {'bold': STYLE_BOLD, 'italic': STYLE_ITALIC, 'code': STYLE_CODE, 'link': STYLE_LINK}
+
+# 行内代码底色框的左右内边距
+CODE_PADDING = 4
+
+# Markdown解析用的预编译模式
+HR_PATTERN = re.compile(r'[-*_]{3,}')
+ORDERED_ITEM_PATTERN = re.compile(r'\d+\. ')
+ORDERED_MARKER_PATTERN = re.compile(r'\d+\.\s*')
+INLINE_MARK_PATTERN = re.compile(r'[\[`*_]')
+LINK_PATTERN = re.compile(r'\[([^\[\]\n]*)\]\([^)\n]*\)')
+CJK_PATTERN = re.compile('[\u4e00-\u9fff]')
+
 def get_chinese_font(font_size=20):
     """
     获取中文字体，尝试多个可能的字体路径
@@ -21,17 +51,17 @@ def get_chinese_font(font_size=20):
         "/System/Library/Fonts/PingFang.ttc",
         "/System/Library/Fonts/STHeiti Light.ttc",
         "/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf",
+        "NotoSansCJK-Regular.ttc",          # 以下按文件名在系统字体目录中查找
+        "wqy-microhei.ttc",
     ]
     
-    for font_path in font_paths:
-        if os.path.exists(font_path):
-            try:
-                return ImageFont.truetype(font_path, font_size)
-            except:
-                continue
+    # 字体注册表只探测一次路径，已加载的字体直接复用
+    font = FONT_REGISTRY.load_first(font_paths, font_size)
+    if font is not None:
+        return font
     
     try:
-        return ImageFont.load_default()
+        return FONT_REGISTRY.load_default()
     except:
         raise Exception("无法找到支持中文的字体")
 
@@ -44,14 +74,12 @@ def get_bold_font(font_size=20):
         "C:/Windows/Fonts/msyhbd.ttc",      # 微软雅黑粗体
         "C:/Windows/Fonts/simkai.ttf",      # 楷体
         "/System/Library/Fonts/PingFang.ttc",
+        "NotoSansCJK-Bold.ttc",
     ]
     
-    for font_path in font_paths:
-        if os.path.exists(font_path):
-            try:
-                return ImageFont.truetype(font_path, font_size)
-            except:
-                continue
+    font = FONT_REGISTRY.load_first(font_paths, font_size)
+    if font is not None:
+        return font
     
     # 如果找不到粗体字体，返回普通字体
     return get_chinese_font(font_size)
@@ -68,239 +96,401 @@ def get_italic_font(font_size=20):
     except:
         return get_chinese_font(font_size)
 
+def iter_markdown_blocks(lines):
+    """
+    把行序列按空行分组为块（段落），产出每块的行列表
+    
+    逐行进行，分组结果与 text.split('\\n\\n') 相同：连续的空行中只有第一个作为分隔符
+    """
+    block = []
+    pending_blank = False  # 块后的空行：后面还有行时才是分隔符
+    for line in lines:
+        if pending_blank:
+            yield block
+            block = [line]
+            pending_blank = False
+        elif line == '' and block:
+            pending_blank = True
+        else:
+            block.append(line)
+    
+    if pending_blank:
+        block.append('')
+    yield block
+
 def parse_markdown(text):
     """
     解析Markdown文本，返回格式化后的行列表
+    
+    逐块、逐行一次扫描完成，耗时和内存与文本长度成正比
     """
     lines = []
-    in_list = False
-    list_type = None
-    list_counter = 1
-    
-    # 分割段落
-    paragraphs = text.split('\n\n')
     
-    for paragraph in paragraphs:
-        if not paragraph.strip():
+    for block in iter_markdown_blocks(text.split('\n')):
+        first = block[0]
+        paragraph = '\n'.join(block)
+        stripped = paragraph.strip()
+        
+        if not stripped:
             lines.append(('empty', ''))
             continue
             
         # 处理标题
-        if paragraph.startswith('# '):
+        if first.startswith('# '):
             lines.append(('h1', paragraph[2:].strip()))
-        elif paragraph.startswith('## '):
+        elif first.startswith('## '):
             lines.append(('h2', paragraph[3:].strip()))
-        elif paragraph.startswith('### '):
+        elif first.startswith('### '):
             lines.append(('h3', paragraph[4:].strip()))
-        elif paragraph.startswith('#### '):
+        elif first.startswith('#### '):
             lines.append(('h4', paragraph[5:].strip()))
             
         # 处理水平线
-        elif re.match(r'^[-*_]{3,}$', paragraph.strip()):
+        elif HR_PATTERN.fullmatch(stripped):
             lines.append(('hr', ''))
             
         # 处理代码块
-        elif paragraph.startswith('    ') or paragraph.startswith('\t'):
-            code_lines = paragraph.split('\n')
-            for code_line in code_lines:
+        elif first.startswith(('    ', '\t')):
+            for code_line in block:
                 lines.append(('code', code_line.strip()))
                 
-        # 处理列表
-        elif paragraph.startswith('- ') or paragraph.startswith('* ') or re.match(r'^\d+\. ', paragraph):
-            if not in_list:
-                in_list = True
-                if re.match(r'^\d+\. ', paragraph):
-                    list_type = 'ol'
-                else:
-                    list_type = 'ul'
+        # 处理列表（每个列表块之后有一个 list_end）
+        elif first.startswith(('- ', '* ')) or ORDERED_ITEM_PATTERN.match(first):
+            list_type = 'ol' if ORDERED_ITEM_PATTERN.match(first) else 'ul'
+            list_counter = 1
             
-            # 处理列表项
-            list_items = paragraph.split('\n')
-            for item in list_items:
+            for item in block:
                 if item.strip():
                     # 移除列表标记
-                    if item.startswith('- ') or item.startswith('* '):
-                        clean_item = item[2:].strip()
-                        lines.append(('li', clean_item, list_type, list_counter))
+                    if item.startswith(('- ', '* ')):
+                        lines.append(('li', item[2:].strip(), list_type, list_counter))
                     else:
-                        clean_item = re.sub(r'^\d+\.\s*', '', item).strip()
+                        clean_item = ORDERED_MARKER_PATTERN.sub('', item, count=1).strip()
                         lines.append(('li', clean_item, list_type, list_counter))
                         list_counter += 1
+            lines.append(('list_end', ''))
         else:
             # 处理普通段落中的格式
-            formatted_lines = process_inline_formatting(paragraph)
-            for line_type, line_text in formatted_lines:
-                lines.append((line_type, line_text))
-            
-        # 结束列表
-        if in_list:
-            in_list = False
-            list_counter = 1
-            lines.append(('list_end', ''))
+            lines.extend(process_inline_formatting(paragraph))
     
     return lines
 
 def process_inline_formatting(text):
     """
     处理行内Markdown格式：粗体、斜体、链接等
+    
+    每行解析为样式段元组 ((样式编号, 文本), ...)，换行和绘制直接使用样式段
     """
     lines = []
-    current_text = text
-    
-    # 先处理代码块，避免干扰其他格式
-    code_pattern = r'`(.*?)`'
-    current_text = re.sub(code_pattern, lambda m: f"[code]{m.group(1)}[/code]", current_text)
-    
-    # 处理粗体 (**text** 或 __text__)
-    bold_pattern = r'(\*\*|__)(.*?)\1'
-    current_text = re.sub(bold_pattern, lambda m: f"[bold]{m.group(2)}[/bold]", current_text)
-    
-    # 处理斜体 (*text* 或 _text_)
-    italic_pattern = r'(\*|_)(.*?)\1'
-    current_text = re.sub(italic_pattern, lambda m: f"[italic]{m.group(2)}[/italic]", current_text)
-    
-    # 处理链接 ([text](url))
-    link_pattern = r'\[(.*?)\]\((.*?)\)'
-    current_text = re.sub(link_pattern, lambda m: f"[link]{m.group(1)}[/link]", current_text)
-    
-    # 分割回行
-    paragraph_lines = current_text.split('\n')
-    for line in paragraph_lines:
+    for line in text.split('\n'):
         if line.strip():
+            runs = []
             # 添加段落缩进（仅对中文段落）
-            if any('\u4e00' <= c <= '\u9fff' for c in line):
-                lines.append(('p', "　　" + line))
-            else:
-                lines.append(('p', line))
+            if CJK_PATTERN.search(line):
+                append_run(runs, STYLE_NORMAL, "　　")
+            for style, run_text in styled_runs(line):
+                append_run(runs, style, run_text)
+            lines.append(('p', tuple(runs)))
         else:
             lines.append(('empty', ''))
     
     return lines
 
-def is_forbidden_start_char(char):
-    """检查字符是否为避头字符"""
-    return char in FORBIDDEN_START_CHARS
+def find_italic_end(line, mark, pos):
+    """
+    查找从 pos 开始的斜体的结束标记位置，成对的粗体标记（** 或 __）整体跳过；找不到时返回-1
+    """
+    double = mark * 2
+    while True:
+        end = line.find(mark, pos)
+        if end < 0 or not line.startswith(double, end):
+            return end
+        # 成对的粗体标记属于斜体内容；落单的双标记按单个标记处理
+        bold_end = line.find(double, end + 2)
+        if bold_end < 0:
+            return end
+        pos = bold_end + 2
 
-def is_forbidden_end_char(char):
-    """检查字符是否为避尾字符"""
-    return char in FORBIDDEN_END_CHARS
+def visible_text(text, italic=True):
+    """嵌套格式的内部文字：去掉格式标记后并入外层样式"""
+    if not INLINE_MARK_PATTERN.search(text):
+        return text
+    return ''.join(run_text for _, run_text in styled_runs(text, italic))
 
-def wrap_text_simple(text, font, max_width):
+def styled_runs(line, italic=True):
     """
-    简单的文本换行函数，不使用避头尾规则
-    """
-    if not text:
-        return [""]
+    单遍扫描一行文本，解析行内格式为样式段元组
     
-    lines = []
-    current_line = ""
+    支持 [链接](url)、`代码`、**粗体**/__粗体__、*斜体*/_斜体_；
+    嵌套的格式只保留最外层样式，无法配对的标记按普通文字处理。
+    斜体内部不再识别斜体（italic=False），与先处理链接、代码、粗体，最后处理斜体的顺序一致
+    """
+    runs = []
+    pos = 0      # 下一个待查找标记的位置
+    literal = 0  # 尚未输出的普通文字起点
     
-    for char in text:
-        test_line = current_line + char
-        if font.getlength(test_line) <= max_width:
-            current_line = test_line
+    while True:
+        match = INLINE_MARK_PATTERN.search(line, pos)
+        if match is None:
+            break
+        start = match.start()
+        mark = line[start]
+        style = None
+        
+        if mark == '[':
+            link = LINK_PATTERN.match(line, start)
+            if link:
+                style, inner, end = STYLE_LINK, link.group(1), link.end()
+        elif mark == '`':
+            close = line.find('`', start + 1)
+            if close >= 0:
+                style, inner, end = STYLE_CODE, line[start + 1:close], close + 1
         else:
-            if current_line:
-                lines.append(current_line)
-            current_line = char
-    
-    if current_line:
-        lines.append(current_line)
+            close = line.find(mark * 2, start + 2) if line.startswith(mark * 2, start) else -1
+            if close >= 0:
+                style, inner, end = STYLE_BOLD, line[start + 2:close], close + 2
+            elif italic:
+                close = find_italic_end(line, mark, start + 1)
+                if close >= 0:
+                    style, inner, end = STYLE_ITALIC, line[start + 1:close], close + 1
+        
+        if style is None:
+            pos = start + 1
+            continue
+        
+        append_run(runs, STYLE_NORMAL, line[literal:start])
+        append_run(runs, style, visible_text(inner, style != STYLE_ITALIC))
+        pos = literal = end
     
-    return lines
+    append_run(runs, STYLE_NORMAL, line[literal:])
+    return tuple(runs)
+
+def append_run(runs, style, text):
+    """追加样式段，与前一段样式相同时合并，忽略空文本"""
+    if not text:
+        return
+    if runs and runs[-1][0] == style:
+        runs[-1] = (style, runs[-1][1] + text)
+    else:
+        runs.append((style, text))
+
+def plain_runs(text):
+    """无格式文本的样式段"""
+    return ((STYLE_NORMAL, text),) if text else ()
 
-def wrap_text_with_formatting(text, font, max_width):
+def wrap_text_simple(text, font, max_width):
     """
-    包装包含格式标签的文本，遵守中文避头尾规则
+    简单的文本换行函数，不使用避头尾规则
     """
     if not text:
         return [""]
     
-    # 移除格式标签来计算纯文本长度
-    clean_text = re.sub(r'\[.*?\]', '', text)
-    if not clean_text.strip():
-        return [""]
+    # 整段一次性计算断点
+    return break_text(text, font, max_width)
+
+def style_fonts(font, bold_font=None, italic_font=None):
+    """按样式编号排列的字体（缺少粗体、斜体时使用正文字体）"""
+    bold_font = bold_font or font
+    italic_font = italic_font or font
+    return (font, bold_font, italic_font, font, font)
+
+def styled_run_width(style, text, fonts):
+    """单个样式段的绘制宽度（行内代码含底色框的左右内边距），与 draw_formatted_line 的前进距离一致"""
+    width = text_length(fonts[style], text)
+    return width + CODE_PADDING * 2 if style == STYLE_CODE else width
+
+def styled_line_width(runs, fonts):
+    """一行样式段的绘制宽度"""
+    return sum(styled_run_width(style, run_text, fonts) for style, run_text in runs)
+
+def styled_prefix_widths(runs, fonts):
+    """
+    样式段拼接后可见文本的前缀宽度，每段用对应样式的字形宽度缓存测量
     
-    # 首先进行简单的换行
-    lines = wrap_text_simple(text, font, max_width)
+    行内代码的内边距计入该段第一个字符（代码段被拆到下一行时，续行的内边距由 wrap_styled_runs 复核）
+    """
+    prefix = [0.0]
+    for style, run_text in runs:
+        widths = get_advance_cache(fonts[style]).prefix_widths(run_text)
+        base = prefix[-1] + (CODE_PADDING * 2 if style == STYLE_CODE else 0)
+        prefix.extend([base + width for width in widths[1:]])
+    return prefix
+
+def slice_runs(runs, start, end):
+    """可见文本 [start, end) 范围内的样式段"""
+    pieces = []
+    run_start = 0
+    for style, run_text in runs:
+        run_end = run_start + len(run_text)
+        if run_end > start:
+            pieces.append((style, run_text[max(start - run_start, 0):min(end, run_end) - run_start]))
+        if run_end >= end:
+            break
+        run_start = run_end
+    return pieces
+
+def split_runs(runs, breaks):
+    """按可见文本中的断点把样式段切分成行，返回每行的样式段元组"""
+    lines = []
+    run_index = 0
+    run_start = 0  # 当前样式段在可见文本中的起点
+    for start, end in zip(breaks, breaks[1:]):
+        line = []
+        while start < end:
+            style, run_text = runs[run_index]
+            run_end = run_start + len(run_text)
+            piece_end = min(end, run_end)
+            line.append((style, run_text[start - run_start:piece_end - run_start]))
+            start = piece_end
+            if piece_end == run_end:
+                run_index += 1
+                run_start = run_end
+        lines.append(tuple(line))
+    return lines
+
+def wrap_styled_runs(runs, fonts, max_width):
+    """
+    样式段换行，遵守中文避头尾规则
     
-    # 然后应用避头尾规则进行调整
-    adjusted_lines = []
+    Args:
+        runs: 样式段元组
+        fonts: style_fonts() 的结果
+        max_width: 可用宽度
     
-    for i, line in enumerate(lines):
-        clean_line = re.sub(r'\[.*?\]', '', line)
-        
-        # 检查行首避头字符
-        if clean_line and is_forbidden_start_char(clean_line[0]):
-            if i > 0 and adjusted_lines:
-                # 尝试将避头字符移到上一行
-                prev_line = adjusted_lines[-1]
-                prev_clean = re.sub(r'\[.*?\]', '', prev_line)
-                
-                if prev_clean and not is_forbidden_end_char(prev_clean[-1]):
-                    # 将避头字符移到上一行
-                    first_char = line[0]
-                    adjusted_lines[-1] = prev_line + first_char
-                    line = line[1:]
-                    clean_line = clean_line[1:]
-        
-        # 检查行尾避尾字符
-        if clean_line and is_forbidden_end_char(clean_line[-1]):
-            if i < len(lines) - 1:
-                # 尝试将避尾字符移到下一行
-                next_line = lines[i + 1]
-                next_clean = re.sub(r'\[.*?\]', '', next_line)
-                
-                if next_clean and not is_forbidden_start_char(next_clean[0]):
-                    # 将避尾字符移到下一行
-                    last_char = line[-1]
-                    line = line[:-1]
-                    lines[i + 1] = last_char + next_line
-        
-        if line:
-            adjusted_lines.append(line)
+    Returns:
+        每行的样式段元组列表（至少一行）
+    """
+    text = ''.join(run_text for _, run_text in runs)
+    if not text.strip():
+        return [()]
+    
+    # 前缀和只能表示逐字累加的宽度：字体带字距调整，或行内代码可能被拆到下一行（续行同样绘制内边距）时，
+    # 每行再按绘制宽度复核断点，保证绘制出的行不超过 max_width
+    line_width = None
+    if any(style == STYLE_CODE or get_advance_cache(fonts[style]).has_kerning for style, _ in runs):
+        line_width = lambda start, end: styled_line_width(slice_runs(runs, start, end), fonts)
     
-    return adjusted_lines
+    # 断行与避头尾处理一次完成
+    allowed = break_opportunities(text, FORBIDDEN_START_CHARS, FORBIDDEN_END_CHARS)
+    breaks = prefix_breaks(styled_prefix_widths(runs, fonts), max_width, allowed, line_width)
+    return split_runs(runs, breaks)
 
-def calculate_text_height(lines, font, bold_font, max_width, line_height):
+def layout_markdown(lines, font, max_width, line_height, y=0, bold_font=None, italic_font=None):
     """
-    计算文本渲染所需的总高度
+    Markdown排版：每个段落/列表项只换行一次，生成带纵坐标的行盒
+    
+    Args:
+        lines: parse_markdown 的结果
+        font: 正文字体（用于换行测量）
+        max_width: 可用宽度
+        line_height: 行高
+        y: 起始纵坐标
+        bold_font, italic_font: 粗体、斜体字体（用于测量对应样式的文字，缺省时使用正文字体）
+    
+    Returns:
+        (行盒列表, 结束纵坐标)，行盒为 (类型, y, 高度, 内容, 块序号)：
+        ('hr', y, h, None)、('h', y, h, (标题文本, 字号))、('code', y, h, 代码文本)、('text', y, h, 样式段元组)
+        块序号相同的行盒属于同一个不可拆分的块（如一个列表项的多行），分页时不会被拆开
     """
-    total_height = 0
+    boxes = []
+    current_y = y
     list_counter = 1
+    text_line_height = int(font.size * 1.6)
+    fonts = style_fonts(font, bold_font, italic_font)
     
     for line_type, *line_content in lines:
         if line_type == 'empty':
-            total_height += line_height
+            current_y += line_height
             continue
             
         elif line_type == 'hr':
-            total_height += line_height
+            boxes.append(('hr', current_y, line_height, None, len(boxes)))
+            current_y += line_height
             continue
             
         elif line_type.startswith('h'):
-            total_height += int(line_height * 1.5)
+            header_level = int(line_type[1])
+            header_font_size = font.size * (1.8 - 0.2 * header_level)
+            header_height = int(line_height * 1.5)
+            boxes.append(('h', current_y, header_height, (line_content[0], header_font_size), len(boxes)))
+            current_y += header_height
             
         elif line_type == 'li':
             list_type = line_content[1] if len(line_content) > 1 else 'ul'
-            bullet = "• " if list_type == 'ul' else f"{list_counter}. "
+            item_number = line_content[2] if len(line_content) > 2 else list_counter
+            bullet = "• " if list_type == 'ul' else f"{item_number}. "
             list_text = bullet + line_content[0]
             
             if list_type == 'ol':
                 list_counter += 1
             
-            # 计算列表项高度
-            wrapped_lines = wrap_text_with_formatting(list_text, font, max_width)
-            total_height += len(wrapped_lines) * line_height
+            # 列表项的所有行属于同一个块
+            block = len(boxes)
+            for wrapped_line in wrap_styled_runs(plain_runs(list_text), fonts, max_width):
+                boxes.append(('text', current_y, text_line_height, wrapped_line, block))
+                current_y += text_line_height
                 
         elif line_type == 'code':
-            total_height += line_height
+            boxes.append(('code', current_y, line_height, line_content[0], len(boxes)))
+            current_y += line_height
             
         elif line_type == 'p':
-            # 计算段落高度
-            wrapped_lines = wrap_text_with_formatting(line_content[0], font, max_width)
-            total_height += len(wrapped_lines) * line_height
+            # 段落可以在任意行之间分页，每行单独成块
+            for wrapped_line in wrap_styled_runs(line_content[0], fonts, max_width):
+                boxes.append(('text', current_y, text_line_height, wrapped_line, len(boxes)))
+                current_y += text_line_height
     
+    return boxes, current_y
+
+def split_boxes_into_pages(boxes, start_y, end_y, max_content_height):
+    """
+    按块将行盒分页，每页内容高度不超过 max_content_height（单个块超高时独占一页）
+    
+    Args:
+        boxes: layout_markdown 生成的行盒
+        start_y: 排版起始纵坐标（第一页包含开头的空行）
+        end_y: 排版结束纵坐标（最后一页包含末尾的空行）
+        max_content_height: 每页最大内容高度
+    
+    Returns:
+        页面列表，每页为 (行盒列表, 内容起始纵坐标, 内容结束纵坐标)
+    """
+    # 按块序号合并相邻行盒
+    blocks = []
+    for box in boxes:
+        if blocks and blocks[-1][-1][4] == box[4]:
+            blocks[-1].append(box)
+        else:
+            blocks.append([box])
+    
+    pages = []
+    page_boxes = []
+    page_top = start_y
+    page_bottom = start_y
+    
+    for block in blocks:
+        block_top = block[0][1]
+        block_bottom = block[-1][1] + block[-1][2]
+        
+        # 放不下时另起一页，页面从该块的顶部开始（跳过块之间的空白）
+        if page_boxes and block_bottom - page_top > max_content_height:
+            pages.append((page_boxes, page_top, page_bottom))
+            page_boxes = []
+            page_top = block_top
+        
+        page_boxes.extend(block)
+        page_bottom = block_bottom
+    
+    # 最后一页延伸到排版结束位置
+    pages.append((page_boxes, page_top, max(page_bottom, end_y)))
+    
+    return pages
+
+def calculate_text_height(lines, font, bold_font, max_width, line_height):
+    """
+    计算文本渲染所需的总高度
+    """
+    _, total_height = layout_markdown(lines, font, max_width, line_height, 0, bold_font)
     return total_height
 
 def calculate_optimal_width(font_size, scale_factor=2):
@@ -323,147 +513,404 @@ def calculate_optimal_width(font_size, scale_factor=2):
     
     return int(base_width * scale_factor)
 
-def render_formatted_text(draw, text, x, y, font, bold_font, italic_font, max_width, text_color):
+def draw_formatted_line(draw, runs, x, y, font, bold_font, italic_font, text_color, render_backend='draw'):
     """
-    渲染格式化的文本，支持自动换行
+    绘制一行已换行的格式化文本
+    
+    runs: 该行的样式段元组
+    render_backend: 文字渲染方式，'draw'（ImageDraw.text）或 'atlas'（字形缓存拼接，结果逐像素相同）
+    
+    Returns:
+        绘制结束处的横坐标（x 加上 styled_line_width 的结果）
+    """
+    draw_text = get_text_drawer(render_backend)
+    fonts = style_fonts(font, bold_font, italic_font)
+    current_x = x
+    
+    # 渲染分段文本
+    for style, seg_text in runs:
+        seg_width = styled_run_width(style, seg_text, fonts)
+        if style == STYLE_NORMAL:
+            draw_text(draw, (current_x, y), seg_text, font, text_color)
+        elif style == STYLE_BOLD:
+            draw_text(draw, (current_x, y), seg_text, bold_font, text_color)
+        elif style == STYLE_ITALIC:
+            # 斜体效果：轻微偏移
+            draw_text(draw, (current_x + 1, y), seg_text, italic_font, text_color)
+        elif style == STYLE_CODE:
+            code_bg_color = (240, 240, 240)
+            code_text_color = (100, 100, 100)
+            code_height = font.size + 4
+            
+            draw.rectangle([(current_x, y), 
+                          (current_x + seg_width, y + code_height)], 
+                          fill=code_bg_color, outline=(200, 200, 200))
+            draw_text(draw, (current_x + CODE_PADDING, y), seg_text, font, code_text_color)
+        elif style == STYLE_LINK:
+            link_color = (0, 0, 255)
+            draw_text(draw, (current_x, y), seg_text, font, link_color)
+            # 添加下划线
+            draw.line([(current_x, y + font.size + 2), 
+                      (current_x + seg_width, y + font.size + 2)], 
+                     fill=link_color, width=1)
+        current_x += seg_width
+    
+    return current_x
+
+def render_formatted_text(draw, runs, x, y, font, bold_font, italic_font, max_width, text_color, render_backend='draw'):
+    """
+    渲染格式化的文本（样式段元组），支持自动换行
     """
     current_y = y
     
     # 包装文本
-    wrapped_lines = wrap_text_with_formatting(text, font, max_width)
+    wrapped_lines = wrap_styled_runs(runs, style_fonts(font, bold_font, italic_font), max_width)
     
     for line in wrapped_lines:
-        current_x = x
-        
-        # 解析格式标签
-        format_pattern = r'\[(bold|italic|code|link)\](.*?)\[/\1\]'
-        segments = []
-        last_pos = 0
-        
-        for match in re.finditer(format_pattern, line):
-            if match.start() > last_pos:
-                segments.append(('normal', line[last_pos:match.start()]))
-            
-            segments.append((match.group(1), match.group(2)))
-            last_pos = match.end()
-        
-        if last_pos < len(line):
-            segments.append(('normal', line[last_pos:]))
-        
-        # 渲染分段文本
-        for seg_type, seg_text in segments:
-            if seg_type == 'normal':
-                draw.text((current_x, current_y), seg_text, font=font, fill=text_color)
-                current_x += font.getlength(seg_text)
-            elif seg_type == 'bold':
-                draw.text((current_x, current_y), seg_text, font=bold_font, fill=text_color)
-                current_x += bold_font.getlength(seg_text)
-            elif seg_type == 'italic':
-                # 斜体效果：轻微偏移
-                draw.text((current_x + 1, current_y), seg_text, font=italic_font, fill=text_color)
-                current_x += italic_font.getlength(seg_text)
-            elif seg_type == 'code':
-                code_bg_color = (240, 240, 240)
-                code_text_color = (100, 100, 100)
-                code_width = font.getlength(seg_text) + 8
-                code_height = font.size + 4
-                
-                draw.rectangle([(current_x, current_y), 
-                              (current_x + code_width, current_y + code_height)], 
-                              fill=code_bg_color, outline=(200, 200, 200))
-                draw.text((current_x + 4, current_y), seg_text, font=font, fill=code_text_color)
-                current_x += code_width
-            elif seg_type == 'link':
-                link_color = (0, 0, 255)
-                draw.text((current_x, current_y), seg_text, font=font, fill=link_color)
-                # 添加下划线
-                text_width = font.getlength(seg_text)
-                draw.line([(current_x, current_y + font.size + 2), 
-                          (current_x + text_width, current_y + font.size + 2)], 
-                         fill=link_color, width=1)
-                current_x += text_width
-        
+        draw_formatted_line(draw, line, x, current_y, font, bold_font, italic_font, text_color, render_backend)
         current_y += int(font.size * 1.6)
     
     return current_y
 
-def render_markdown_content(draw, lines, font, bold_font, italic_font, x, y, line_height, max_width, text_color):
+def draw_markdown_layout(draw, boxes, font, bold_font, italic_font, x, max_width, text_color, y_offset=0, render_backend='draw'):
     """
-    渲染Markdown内容到图片
+    按 layout_markdown 生成的行盒绘制内容（不再换行）
+    
+    y_offset: 行盒纵坐标的偏移量（绘制到分页画布时使用）
+    render_backend: 文字渲染方式，'draw' 或 'atlas'
     """
-    current_y = y
-    list_counter = 1
+    draw_text = get_text_drawer(render_backend)
     
-    for line_type, *line_content in lines:
-        if line_type == 'empty':
-            current_y += line_height
-            continue
-            
-        elif line_type == 'hr':
-            draw.line([(x, current_y + line_height//2), 
-                      (x + max_width, current_y + line_height//2)], 
+    for box_type, box_y, box_height, content, _ in boxes:
+        y = box_y + y_offset
+        
+        if box_type == 'hr':
+            draw.line([(x, y + box_height//2), 
+                      (x + max_width, y + box_height//2)], 
                      fill=(200, 200, 200), width=2)
-            current_y += line_height
-            continue
             
-        elif line_type.startswith('h'):
-            header_level = int(line_type[1])
-            header_font_size = font.size * (1.8 - 0.2 * header_level)
-            header_font = get_chinese_font(header_font_size)
+        elif box_type == 'h':
+            header_text, header_font_size = content
             header_bold_font = get_bold_font(header_font_size)
+            draw_text(draw, (x, y), header_text, header_bold_font, text_color)
             
-            draw.text((x, current_y), line_content[0], font=header_bold_font, fill=text_color)
-            current_y += int(line_height * 1.5)
-            
-        elif line_type == 'li':
-            list_type = line_content[1] if len(line_content) > 1 else 'ul'
-            item_number = line_content[2] if len(line_content) > 2 else list_counter
-            bullet = "• " if list_type == 'ul' else f"{item_number}. "
-            list_text = bullet + line_content[0]
-            
-            if list_type == 'ol':
-                list_counter += 1
-            
-            current_y = render_formatted_text(
-                draw, list_text, x, current_y, 
-                font, bold_font, italic_font, max_width, text_color
-            )
-                
-        elif line_type == 'code':
+        elif box_type == 'code':
             code_bg_color = (240, 240, 240)
             code_text_color = (100, 100, 100)
             code_padding = 4
             
-            code_text = line_content[0]
-            code_width = font.getlength(code_text) + code_padding * 2
+            code_width = text_length(font, content) + code_padding * 2
             
-            draw.rectangle([(x, current_y), (x + code_width, current_y + line_height)], 
+            draw.rectangle([(x, y), (x + code_width, y + box_height)], 
                           fill=code_bg_color, outline=(200, 200, 200))
-            draw.text((x + code_padding, current_y), code_text, font=font, fill=code_text_color)
-            current_y += line_height
+            draw_text(draw, (x + code_padding, y), content, font, code_text_color)
             
-        elif line_type == 'p':
-            current_y = render_formatted_text(
-                draw, line_content[0], x, current_y, 
-                font, bold_font, italic_font, max_width, text_color
-            )
+        elif box_type == 'text':
+            draw_formatted_line(draw, content, x, y, font, bold_font, italic_font, text_color, render_backend)
+
+def render_markdown_content(draw, lines, font, bold_font, italic_font, x, y, line_height, max_width, text_color, render_backend='draw'):
+    """
+    渲染Markdown内容到图片（先排版再绘制）
+    """
+    boxes, end_y = layout_markdown(lines, font, max_width, line_height, y, bold_font, italic_font)
+    draw_markdown_layout(draw, boxes, font, bold_font, italic_font, x, max_width, text_color, 0, render_backend)
+    return end_y
+
+def load_fonts(hd_font_size):
+    """
+    获取指定字号的普通、粗体、斜体字体（由字体注册表缓存，每个进程只加载一次）
+    """
+    return (
+        get_chinese_font(hd_font_size),
+        get_bold_font(hd_font_size),
+        get_italic_font(hd_font_size),
+    )
+
+def is_markdown_document(input_file, text):
+    """.md 文件，或文本中出现Markdown标记字符时按Markdown解析"""
+    return input_file.lower().endswith('.md') or any(c in text for c in '#*_-`[]()')
+
+def layout_document(text, input_file, font, usable_width, line_height, max_page_height=8000, bold_font=None, italic_font=None):
+    """
+    排版并分页（不渲染）
     
-    return current_y
+    bold_font, italic_font: 粗体、斜体字体（用于测量Markdown中对应样式的文字）
+    
+    Returns:
+        (分页列表 [(行盒列表, 页顶y, 页底y), ...], 最小页高, 内容底部y)
+    """
+    # 解析Markdown
+    if is_markdown_document(input_file, text):
+        parsed_lines = parse_markdown(text)
+        
+        # 排版只进行一次：得到所有行盒的位置和准确的内容高度
+        boxes, final_y = layout_markdown(parsed_lines, font, usable_width, line_height, 40, bold_font, italic_font)
+        min_height = 1000
+        
+    else:
+        # 普通文本处理：简单换行，每行一个行盒
+        boxes = []
+        final_y = 40
+        for current_line in wrap_text_simple(text, font, usable_width):
+            boxes.append(('text', final_y, line_height, plain_runs(current_line), len(boxes)))
+            final_y += line_height
+        min_height = 800
+    
+    pages = split_boxes_into_pages(boxes, 40, final_y, max_page_height - 80)
+    return pages, min_height, final_y
+
+def calculate_page_height(page_top, page_bottom, min_height):
+    """页面图片高度：内容高度加上下边距，且不小于最小高度"""
+    return max(min_height, page_bottom - page_top + 80)
+
+def layout_file(input_path, font_size=26, max_page_height=8000):
+    """
+    只排版不渲染：解码、解析Markdown、排版和分页，返回行数、页数和每页尺寸
+    
+    Returns:
+        layout_report.file_report() 的结果
+    """
+    input_file = os.path.basename(input_path)
+    text, guess = read_text(input_path)
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    
+    hd_font_size = font_size * 2
+    font, bold_font, italic_font = load_fonts(hd_font_size)
+    img_width = calculate_optimal_width(font_size, 2)
+    usable_width = img_width - 2 * int(img_width * 0.08)
+    line_height = int(hd_font_size * 1.6)
+    
+    pages, min_height, _ = layout_document(text, input_file, font, usable_width, line_height, max_page_height, bold_font, italic_font)
+    line_count = sum(len(page_boxes) for page_boxes, _, _ in pages)
+    page_sizes = [(img_width, calculate_page_height(page_top, page_bottom, min_height))
+                  for _, page_top, page_bottom in pages]
+    return file_report(input_file, guess.encoding, line_count, page_sizes)
+
+def convert_file(input_path, output_dir, font_size=26, bg_color=(255, 255, 255), text_color=(0, 0, 0), verbose=True, max_page_height=8000, render_backend='draw', encoder=None, metrics=None):
+    """
+    将单个TXT/Markdown文件转换为高清JPG图片
+    
+    超过 max_page_height 的文档按块自动分页（标题、列表项、代码行不会被拆开），
+    输出文件名与 txt_to_jpg 一致：单页为 文件名.jpg，多页为 文件名_页N.jpg；
+    render_backend 为文字渲染方式，'draw'（ImageDraw）或 'atlas'（字形缓存，输出相同）；
+    encoder 为输出图片编码器（默认为质量95的JPEG），文件扩展名随编码器变化；
+    图片先在内存中编码，只把最终结果写入磁盘；
+    metrics 为记录各阶段耗时的 pipeline_metrics.FileMetrics（可选）
+    
+    Returns:
+        每页的 (输出文件名, 图片宽度, 图片高度) 列表
+    """
+    input_file = os.path.basename(input_path)
+    if metrics is None:
+        metrics = FileMetrics(input_file)
+    
+    if encoder is None:
+        encoder = JpegEncoder(quality=95)  # 稍微降低质量以减少文件大小
+    
+    # 读取文本文件：只读一次，检测编码后只解码一次（与文本模式读取一样统一换行符）
+    with metrics.stage('decode'):
+        text, guess = read_text(input_path)
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    
+    if verbose:
+        scale_factor = 2
+        print(f"处理文件: {input_file}, 图片宽度: {calculate_optimal_width(font_size, scale_factor)}px, 高清模式: {scale_factor}x")
+        print(f"  检测到编码: {guess.encoding} (置信度: {guess.confidence:.0%})")
+    
+    results = []
+    pages = iter_rendered_pages(text, input_file, font_size, bg_color, text_color, verbose, max_page_height,
+                                render_backend, encoder, metrics)
+    for page_num, (output_filename, data, stats, img_width, img_height) in enumerate(pages, 1):
+        with metrics.stage('write'):
+            write_file_atomic(data, os.path.join(output_dir, output_filename))
+        metrics.add_encode_stats(output_filename, stats)
+        
+        stats_text = format_encode_stats(stats)
+        if verbose and stats_text:
+            print(f"  ✓ 生成页面 {page_num}: {output_filename} ({stats_text})")
+        
+        results.append((output_filename, img_width, img_height))
+    
+    metrics.pages = metrics.rendered_pages = len(results)
+    return results
+
+def iter_rendered_pages(text, input_file, font_size=26, bg_color=(255, 255, 255), text_color=(0, 0, 0), verbose=False, max_page_height=8000, render_backend='draw', encoder=None, metrics=None):
+    """
+    排版、分页并在内存中渲染编码已解码的文本（不读写文件），逐页产出
+    
+    input_file 只用于判断是否按Markdown解析和生成输出文件名，参数含义同 convert_file
+    
+    Returns:
+        每页的 (输出文件名, 图片数据, 编码统计信息, 图片宽度, 图片高度) 的生成器
+    """
+    if metrics is None:
+        metrics = FileMetrics(input_file)
+    if encoder is None:
+        encoder = JpegEncoder(quality=95)
+    
+    scale_factor = 2
+    hd_font_size = font_size * scale_factor
+    
+    font, bold_font, italic_font = load_fonts(hd_font_size)
+    
+    img_width = calculate_optimal_width(font_size, scale_factor)
+    margin = int(img_width * 0.08)
+    usable_width = img_width - 2 * margin
+    line_height = int(hd_font_size * 1.6)
+    
+    if verbose and is_markdown_document(input_file, text):
+        print(f"  检测到Markdown格式，进行解析...")
+    
+    # 按块分页，每页画布单独分配，内存占用以一页为上限
+    with metrics.stage('layout'):
+        pages, min_height, final_y = layout_document(
+            text, input_file, font, usable_width, line_height, max_page_height, bold_font, italic_font
+        )
+    base_filename = os.path.splitext(input_file)[0]
+    
+    if verbose:
+        print(f"  内容高度: {final_y - 40}px, 分为 {len(pages)} 页")
+    
+    for page_num, (page_boxes, page_top, page_bottom) in enumerate(pages, 1):
+        img_height = calculate_page_height(page_top, page_bottom, min_height)
+        
+        with metrics.stage('rasterize'):
+            image = Image.new('RGB', (img_width, img_height), color=bg_color)
+            draw = ImageDraw.Draw(image)
+            
+            draw_markdown_layout(
+                draw, page_boxes, font, bold_font, italic_font, 
+                margin, usable_width, text_color, 40 - page_top, render_backend
+            )
+        
+        # 生成带页码的输出文件名
+        if len(pages) > 1:
+            output_filename = f"{base_filename}_页{page_num}{encoder.extension}"
+        else:
+            output_filename = f"{base_filename}{encoder.extension}"
+        
+        with metrics.stage('encode'):
+            data, stats = encoder.encode(image)
+        
+        yield output_filename, data, stats, img_width, img_height
 
-def txt_to_jpg_batch(input_dir, output_dir, backup_dir, font_size=26, bg_color=(255, 255, 255), text_color=(0, 0, 0)):
+def convert_file_with_metrics(input_path, *args):
+    """
+    转换单个文件并统计各阶段耗时（可在进程池中执行），返回 (convert_file 的结果, FileMetrics)
+    """
+    metrics = FileMetrics(os.path.basename(input_path))
+    metrics.start()
+    results = convert_file(input_path, *args, metrics=metrics)
+    metrics.finish()
+    return results, metrics
+
+def txt_to_jpg_batch(input_dir, output_dir, backup_dir, font_size=26, bg_color=(255, 255, 255), text_color=(0, 0, 0), workers=1, max_page_height=8000, render_backend='draw', incremental=False, move_to_backup=True, output_format='jpeg', encoder_options=None, selected_files=None, executor=None, dry_run=False, metrics_file=None, measure_cache_size=None):
     """
     批量将TXT文件转换为高清JPG图片（支持Markdown）
+    
+    workers 大于1时使用进程池并行转换，每个工作进程只加载一次字体；
+    max_page_height 为单页最大高度，超出时自动分页（JPEG高度上限为65535）；
+    render_backend 为文字渲染方式，'draw' 或 'atlas'；
+    incremental 为增量模式：跳过内容和参数都未变化的文件，并清理过期的输出图片；
+    move_to_backup 为转换成功后是否把原文件移到备份目录（关闭时原文件留在输入目录）；
+    output_format 为输出格式（'jpeg'、'png'、'webp'、'avif'），encoder_options 为编码器参数
+    （JPEG 可指定 {'target_size': 字节数}，每页自动搜索不超过该大小的最高质量）；
+    selected_files 为只转换输入目录中的这些文件（默认为全部支持的文件）；
+    executor 为复用的进程池（监视模式下常驻，字体和缓存保持加载），默认 workers 大于1时临时创建；
+    dry_run 为预演模式：只排版不渲染，把每个文件的行数、页数和页面尺寸写入输出目录中的JSON报告；
+    metrics_file 为性能统计文件（.json 或 .csv，相对路径保存在输出目录中），记录各阶段耗时、字宽测量次数和峰值内存；
+    measure_cache_size 为文本宽度缓存最多保存的条目数（默认65536，并行时每个进程各一份）
     """
     
+    if measure_cache_size is not None:
+        set_measure_cache_size(measure_cache_size)
+    
+    # 先创建编码器，格式不可用时在转换开始前报错（JPEG默认质量为95）
+    if output_format == 'jpeg':
+        encoder_options = {'quality': 95, **(encoder_options or {})}
+    encoder = get_encoder(output_format, **(encoder_options or {}))
+    if encoder.name == 'jpeg' and 'target_size' in encoder.options:
+        encoder_label = f"目标大小:{encoder.options['target_size'] / 1024:.0f}KB"
+    elif encoder.name == 'jpeg':
+        encoder_label = f"质量:{encoder.options['quality']}%"
+    else:
+        encoder_label = repr(encoder)
+    
     os.makedirs(output_dir, exist_ok=True)
-    os.makedirs(backup_dir, exist_ok=True)
+    if move_to_backup and not dry_run:
+        os.makedirs(backup_dir, exist_ok=True)
     
     supported_extensions = ['.txt', '.md']
-    input_files = [f for f in os.listdir(input_dir) 
-                  if any(f.lower().endswith(ext) for ext in supported_extensions)]
+    all_input_files = [f for f in os.listdir(input_dir) 
+                       if any(f.lower().endswith(ext) for ext in supported_extensions)]
+    if selected_files is None:
+        input_files = all_input_files
+    else:
+        input_files = [f for f in all_input_files if f in set(selected_files)]
+    
+    # 预演模式：只排版并输出报告，不生成图片、不移动原文件
+    if dry_run:
+        reports = []
+        failures = {}
+        for input_file in sorted(input_files):
+            try:
+                reports.append(layout_file(os.path.join(input_dir, input_file), font_size, max_page_height))
+            except Exception as e:
+                print(f"✗ 排版失败: {input_file} - 错误: {str(e)}")
+                failures[input_file] = str(e)
+        
+        report_path = os.path.join(output_dir, LAYOUT_REPORT_FILENAME)
+        report = write_layout_report(report_path, {
+            'script': 'md_to_jpg',
+            'font_size': font_size,
+            'max_page_height': max_page_height,
+        }, reports, failures)
+        print_layout_summary(report)
+        print(f"排版报告保存在: {report_path}")
+        return
+    
+    # 增量模式：对比构建清单，只转换内容或参数有变化的文件
+    batch_metrics = BatchMetrics('md_to_jpg')
+    manifest = None
+    input_hashes = {}
+    skip_count = 0
+    if incremental:
+        manifest = BuildManifest(os.path.join(output_dir, MANIFEST_FILENAME))
+        font, bold_font, italic_font = load_fonts(font_size * 2)
+        render_hash = config_hash({
+            'script': 'md_to_jpg',
+            'fonts': [font_identity(f) for f in (font, bold_font, italic_font)],
+            'font_size': font_size,
+            'bg_color': bg_color,
+            'text_color': text_color,
+            'max_page_height': max_page_height,
+            'encoder': encoder.describe(),
+        })
+        
+        # 原文件保留在输入目录时，输入目录中已删除的文件其输出也应删除
+        if not move_to_backup:
+            for input_file in manifest.forget_missing(all_input_files, output_dir):
+                print(f"- 源文件已删除，清理输出: {input_file}")
+        
+        for input_file in input_files:
+            with batch_metrics.batch.stage('hash'):
+                input_hash = file_hash(os.path.join(input_dir, input_file))
+            if manifest.is_up_to_date(input_file, input_hash, render_hash, output_dir):
+                skip_count += 1
+                if move_to_backup:
+                    shutil.move(os.path.join(input_dir, input_file), os.path.join(backup_dir, input_file))
+            else:
+                input_hashes[input_file] = input_hash
+        
+        print(f"增量模式: {skip_count} 个文件未变化，已跳过")
+        input_files = [input_file for input_file in input_files if input_file in input_hashes]
+        manifest.save()
     
     if not input_files:
-        print(f"在目录 {input_dir} 中没有找到支持的文件")
+        if skip_count:
+            print("所有文件均未变化，无需转换")
+        else:
+            print(f"在目录 {input_dir} 中没有找到支持的文件")
         return
     
     print(f"找到 {len(input_files)} 个文件，开始高清转换...")
@@ -471,138 +918,139 @@ def txt_to_jpg_batch(input_dir, output_dir, backup_dir, font_size=26, bg_color=(
     
     success_count = 0
     fail_count = 0
+    total_pages = 0
     
-    for input_file in input_files:
-        input_path = os.path.join(input_dir, input_file)
-        output_filename = os.path.splitext(input_file)[0] + '.jpg'
-        output_path = os.path.join(output_dir, output_filename)
-        backup_path = os.path.join(backup_dir, input_file)
-        
-        try:
-            # 读取文本文件
-            text = ""
-            encodings = ['utf-8', 'gbk', 'gb2312', 'big5', 'utf-16']
+    def finish(input_file, result):
+        # 输出已写入，再更新构建清单、移动原文件到备份目录
+        nonlocal success_count, total_pages
+        results, file_metrics = result
+        if manifest is not None:
+            outputs = [output_filename for output_filename, _, _ in results]
+            for stale_output in manifest.record(input_file, input_hashes[input_file], render_hash, outputs, output_dir):
+                print(f"  - 删除过期输出: {stale_output}")
+        if move_to_backup:
+            with file_metrics.stage('backup'):
+                shutil.move(os.path.join(input_dir, input_file), os.path.join(backup_dir, input_file))
+        batch_metrics.add_file(file_metrics)
+        if len(results) == 1:
+            output_filename, width, height = results[0]
+            print(f"✓ 成功转换: {input_file} -> {output_filename} ({width}x{height}, {encoder_label})")
+        else:
+            print(f"✓ 成功转换: {input_file} -> {len(results)} 张图片 ({encoder_label})")
+        if workers > 1:
+            # 并行转换时工作进程不打印每页的信息，按目标大小搜索质量的统计在这里打印
+            for output_filename, stats in file_metrics.encode_stats:
+                print(f"  ✓ {output_filename}: {format_encode_stats(stats)}")
+        success_count += 1
+        total_pages += len(results)
+    
+    def fail(input_file, e):
+        nonlocal fail_count
+        print(f"✗ 转换失败: {input_file} - 错误: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        fail_count += 1
+    
+    if workers > 1:
+        print(f"使用 {workers} 个进程并行转换")
+        if executor is None:
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                       initargs=((load_fonts,), font_size * 2, MEASURE_CACHE.max_entries))
+        else:
+            pool = nullcontext(executor)
+        with pool as executor:
+            futures = {
+                executor.submit(
+                    convert_file_with_metrics, os.path.join(input_dir, input_file), output_dir,
+                    font_size, bg_color, text_color, False, max_page_height, render_backend, encoder
+                ): input_file
+                for input_file in input_files
+            }
             
-            for encoding in encodings:
+            for done, future in enumerate(as_completed(futures), 1):
+                input_file = futures[future]
+                print(f"[{done}/{len(input_files)}] ", end="")
                 try:
-                    with open(input_path, 'r', encoding=encoding) as file:
-                        text = file.read()
-                    break
-                except UnicodeDecodeError:
-                    continue
-            
-            if not text:
-                raise Exception("无法解码文件")
-            
-            scale_factor = 2
-            hd_font_size = font_size * scale_factor
-            
-            font = get_chinese_font(hd_font_size)
-            bold_font = get_bold_font(hd_font_size)
-            italic_font = get_italic_font(hd_font_size)
-            
-            img_width = calculate_optimal_width(font_size, scale_factor)
-            margin = int(img_width * 0.08)
-            usable_width = img_width - 2 * margin
-            line_height = int(hd_font_size * 1.6)
-            
-            print(f"处理文件: {input_file}, 图片宽度: {img_width}px, 高清模式: {scale_factor}x")
-            
-            # 解析Markdown
-            if input_file.lower().endswith('.md') or any(c in text for c in '#*_-`[]()'):
-                print(f"  检测到Markdown格式，进行解析...")
-                parsed_lines = parse_markdown(text)
-                
-                # 准确计算所需高度
-                content_height = calculate_text_height(parsed_lines, font, bold_font, usable_width, line_height)
-                img_height = content_height + 80  # 上下边距
-                
-                # 确保最小高度
-                min_height = 1000
-                if img_height < min_height:
-                    img_height = min_height
-                
-                print(f"  计算高度: {img_height}px (内容高度: {content_height}px)")
-                
-                image = Image.new('RGB', (img_width, img_height), color=bg_color)
-                draw = ImageDraw.Draw(image)
-                
-                final_y = render_markdown_content(
-                    draw, parsed_lines, font, bold_font, italic_font, 
-                    margin, 40, line_height, usable_width, text_color
+                    finish(input_file, future.result())
+                except Exception as e:
+                    fail(input_file, e)
+    else:
+        for input_file in input_files:
+            try:
+                result = convert_file_with_metrics(
+                    os.path.join(input_dir, input_file), output_dir,
+                    font_size, bg_color, text_color, True, max_page_height, render_backend, encoder
                 )
-                
-                # 如果实际渲染高度超过预估高度，重新调整图片大小
-                if final_y + 40 > img_height:
-                    new_height = final_y + 40
-                    print(f"  调整图片高度: {img_height}px -> {new_height}px")
-                    new_image = Image.new('RGB', (img_width, new_height), color=bg_color)
-                    new_image.paste(image, (0, 0))
-                    image = new_image
-                    draw = ImageDraw.Draw(image)
-                    # 重新渲染到最后的位置
-                    render_markdown_content(
-                        draw, parsed_lines, font, bold_font, italic_font, 
-                        margin, 40, line_height, usable_width, text_color
-                    )
-                
-            else:
-                # 普通文本处理
-                is_chinese = any('\u4e00' <= c <= '\u9fff' for c in text)
-                
-                # 计算普通文本高度
-                avg_char_width = font.getlength("中")
-                chars_per_line = max(1, int(usable_width / avg_char_width))
-                lines_count = len(text) // chars_per_line + 2
-                img_height = lines_count * line_height + 80
-                
-                min_height = 800
-                if img_height < min_height:
-                    img_height = min_height
-                
-                image = Image.new('RGB', (img_width, img_height), color=bg_color)
-                draw = ImageDraw.Draw(image)
-                
-                # 简单换行渲染
-                y_pos = 40
-                current_line = ""
-                
-                for char in text:
-                    test_line = current_line + char
-                    if font.getlength(test_line) <= usable_width:
-                        current_line = test_line
-                    else:
-                        if current_line:
-                            draw.text((margin, y_pos), current_line, font=font, fill=text_color)
-                            y_pos += line_height
-                        current_line = char
-                
-                if current_line:
-                    draw.text((margin, y_pos), current_line, font=font, fill=text_color)
-            
-            image.save(
-                output_path, 
-                'JPEG', 
-                quality=95,  # 稍微降低质量以减少文件大小
-                optimize=True,
-                subsampling=0,
-                qtables='web_high'
-            )
-            
-            shutil.move(input_path, backup_path)
-            
-            print(f"✓ 成功转换: {input_file} -> {output_filename} ({image.width}x{image.height}, 质量:95%)")
-            success_count += 1
-            
-        except Exception as e:
-            print(f"✗ 转换失败: {input_file} - 错误: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            fail_count += 1
+                finish(input_file, result)
+            except Exception as e:
+                fail(input_file, e)
+    
+    if manifest is not None:
+        manifest.save()
     
-    print(f"\n高清转换完成！成功: {success_count}, 失败: {fail_count}")
+    print(f"\n高清转换完成！成功: {success_count}, 失败: {fail_count}, 总页数: {total_pages}")
+    if incremental:
+        print(f"未变化跳过: {skip_count}")
+    font_stats = FONT_REGISTRY.stats()
+    print(f"字体缓存: 命中 {font_stats['hits']} 次, 加载 {font_stats['misses']} 次")
+    if render_backend == 'atlas' and workers <= 1:
+        print(format_atlas_stats(GLYPH_ATLAS.stats()))
+    if workers <= 1:
+        print(format_measure_stats(MEASURE_CACHE.stats()))
+    if metrics_file:
+        metrics_path = os.path.join(output_dir, metrics_file)
+        batch_metrics.write(metrics_path)
+        batch_metrics.print_summary()
+        print(f"性能统计保存在: {metrics_path}")
     print(f"高清图片保存在: {output_dir}")
-    print(f"原文件备份在: {backup_dir}")
+    if move_to_backup:
+        print(f"原文件备份在: {backup_dir}")
+
+def txt_to_jpg_watch(input_dir, output_dir, backup_dir, poll_interval=0.5, settle_time=0.3, **batch_options):
+    """
+    监视模式：常驻进程，先转换目录中已有的文件，之后每当有新的（或修改过的）TXT/Markdown文件写完就立即转换
+    
+    字体注册表、字形缓存和进程池（workers 大于1时）在整个监视期间保持加载；
+    poll_interval 为没有安装 watchdog 时轮询目录的间隔，settle_time 为文件多久不再变化才认为已经写完（秒）；
+    batch_options 为传给 txt_to_jpg_batch 的其余参数。按 Ctrl+C 退出。
+    """
+    if not batch_options.get('move_to_backup', True) and not batch_options.get('incremental', False):
+        print("提示: 原文件不移走时建议同时开启增量模式，避免重复生成未变化的文件")
+    
+    workers = batch_options.get('workers', 1)
+    font_size = batch_options.get('font_size', 26)
+    set_measure_cache_size(batch_options.get('measure_cache_size'))
+    watcher = DirectoryWatcher(input_dir, ['.txt', '.md'], poll_interval, settle_time)
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                       initargs=((load_fonts,), font_size * 2, MEASURE_CACHE.max_entries))
+    else:
+        load_fonts(font_size * 2)  # 预先加载字体
+    
+    # 先记录目录状态再转换已有文件，转换期间新放入的文件不会漏掉
+    watcher.start()
+    try:
+        txt_to_jpg_batch(input_dir, output_dir, backup_dir, executor=executor, **batch_options)
+        print(f"\n监视模式: 正在监视 {input_dir}（{watcher.backend}），按 Ctrl+C 退出")
+        while True:
+            ready = watcher.wait_for_files()
+            start = time.perf_counter()
+            print(f"\n发现 {len(ready)} 个新文件: {', '.join(ready)}")
+            txt_to_jpg_batch(input_dir, output_dir, backup_dir, selected_files=ready, executor=executor, **batch_options)
+            print(f"用时 {time.perf_counter() - start:.2f} 秒，继续监视...")
+    except KeyboardInterrupt:
+        print("\n监视已停止")
+    finally:
+        watcher.stop()
+        if executor is not None:
+            executor.shutdown()
+
+# 增量构建清单文件名（保存在输出目录中）
+MANIFEST_FILENAME = '.md_to_jpg_manifest.json'
+
+# 预演模式的排版报告文件名（保存在输出目录中）
+LAYOUT_REPORT_FILENAME = 'md_to_jpg_layout.json'
 
 # 高清配置参数
 CONFIG = {
@@ -612,6 +1060,20 @@ CONFIG = {
     'margin_percent': 0.08,
     'jpeg_quality': 95,  # 调整为95%
     'indent_chars': "　　",
+    'workers': 1,  # 并行转换的进程数（1为单进程）
+    'max_page_height': 8000,  # 单页最大高度，超出自动分页（JPEG上限65535）
+    'render_backend': 'draw',  # 文字渲染方式：'draw'（ImageDraw）或 'atlas'（字形缓存，输出相同）
+    'measure_cache_size': 65536,  # 文本宽度缓存的条目上限（LRU淘汰），控制大批量转换时的内存
+    'output_format': 'jpeg',  # 输出格式：'jpeg'、'png'（调色板）、'webp'、'avif'
+    'encoder_options': {},  # 编码器参数，如 {'quality': 90} 或 {'lossless': True}；
+                            # JPEG按目标大小自动选质量：{'target_size': 500 * 1024, 'min_quality': 10}
+    'incremental': False,  # 增量模式：跳过未变化的文件，清理过期输出
+    'move_to_backup': True,  # 转换成功后是否把原文件移到备份目录
+    'watch': False,  # 监视模式：常驻运行，新文件放入输入目录后自动转换（也可用命令行参数 --watch）
+    'poll_interval': 0.5,  # 监视模式下没有 watchdog 时轮询目录的间隔（秒）
+    'dry_run': False,  # 预演模式：只排版，输出页数和页面尺寸报告（也可用命令行参数 --dry-run）
+    'metrics_file': None,  # 性能统计文件，如 'metrics.json' 或 'metrics.csv'（保存在输出目录中）
+    'profile': False,  # 是否用 cProfile 分析整个批量转换，结果保存为输出目录中的 md_to_jpg.prof
 }
 
 if __name__ == "__main__":
@@ -623,11 +1085,28 @@ if __name__ == "__main__":
         print(f"错误: 输入目录不存在: {input_directory}")
         print("请创建目录或修改脚本中的路径")
     else:
-        txt_to_jpg_batch(
-            input_dir=input_directory,
-            output_dir=output_directory,
-            backup_dir=backup_directory,
+        batch_options = dict(
             font_size=CONFIG['font_size'],
             bg_color=(244, 238, 235),
-            text_color=(59, 4, 0)
-        )
\ No newline at end of file
+            text_color=(59, 4, 0),
+            workers=CONFIG['workers'],
+            max_page_height=CONFIG['max_page_height'],
+            render_backend=CONFIG['render_backend'],
+            measure_cache_size=CONFIG['measure_cache_size'],
+            output_format=CONFIG['output_format'],
+            encoder_options=CONFIG['encoder_options'],
+            incremental=CONFIG['incremental'],
+            move_to_backup=CONFIG['move_to_backup'],
+            dry_run=CONFIG['dry_run'] or '--dry-run' in sys.argv,
+            metrics_file=CONFIG['metrics_file']
+        )
+        
+        if CONFIG['watch'] or '--watch' in sys.argv:
+            txt_to_jpg_watch(input_directory, output_directory, backup_directory,
+                             poll_interval=CONFIG['poll_interval'], **batch_options)
+        elif CONFIG['profile'] or '--profile' in sys.argv:
+            os.makedirs(output_directory, exist_ok=True)
+            run_profiled(os.path.join(output_directory, 'md_to_jpg.prof'), txt_to_jpg_batch,
+                         input_directory, output_directory, backup_directory, **batch_options)
+        else:
+            txt_to_jpg_batch(input_directory, output_directory, backup_directory, **batch_options)
\ No newline at end of file
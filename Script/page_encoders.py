@@ -0,0 +1,242 @@
+"""
+页面图片编码器：把 image.save 的格式和参数封装成可替换的编码器
+
+- JPEG：原有行为（默认）；指定 target_size 时按目标文件大小逐页搜索质量
+- 调色板PNG：文字页面颜色很少，量化为调色板后无损或近似无损，文件小
+- WebP：有损或无损
+- AVIF：当前Pillow支持时可用
+
+编码器对象只保存参数，可以传给进程池中的工作进程。
+"""
+import io
+
+from PIL import Image, features
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class PageEncoder:
+    """
+    编码器基类：prepare() 在保存前转换图片，save_args() 返回 image.save 的参数
+    """
+    name = ''
+    format = ''
+    extension = ''
+    mime_type = 'application/octet-stream'
+    palette_input = False  # 是否可以直接接收调色板图片（'P'模式）
+
+    def __init__(self, **options):
+        self.options = options
+
+    def prepare(self, image):
+        """保存前对图片做的转换（默认不转换）"""
+        return image
+
+    def save_args(self):
+        """image.save 的参数"""
+        return dict(format=self.format, **self.options)
+
+    def encode(self, image):
+        """
+        在内存中编码图片
+
+        Returns:
+            (编码后的字节, 统计信息)，统计信息至少包含 'size'（字节数）
+        """
+        buffer = io.BytesIO()
+        self.prepare(image).save(buffer, **self.save_args())
+        return buffer.getvalue(), {'size': buffer.tell()}
+
+    def describe(self):
+        """编码器及参数（用于构建清单的哈希和日志）"""
+        return {'encoder': self.name, **self.options}
+
+    def __repr__(self):
+        options = ', '.join(f"{key}={value!r}" for key, value in self.options.items())
+        return f"{self.name}({options})"
+
+
+class JpegEncoder(PageEncoder):
+    """
+    JPEG（原有的输出格式）
+
+    指定 target_size（字节）时，每页在 min_quality 到 quality 之间二分搜索，
+    取文件不超过 target_size 的最高质量；最低质量仍超出时使用最低质量。
+    """
+    name = 'jpeg'
+    format = 'JPEG'
+    extension = '.jpg'
+    mime_type = 'image/jpeg'
+
+    def __init__(self, quality=100, optimize=True, subsampling=0, qtables='web_high', target_size=None, min_quality=10):
+        super().__init__(quality=quality, optimize=optimize, subsampling=subsampling, qtables=qtables)
+        if target_size is not None:
+            if not 1 <= min_quality <= quality:
+                raise ValueError(f"min_quality 应在 1 到 quality（{quality}）之间: {min_quality}")
+            self.options['target_size'] = target_size
+            self.options['min_quality'] = min_quality
+
+    def save_args(self, quality=None):
+        args = dict(format=self.format, **self.options)
+        args.pop('target_size', None)
+        args.pop('min_quality', None)
+        if quality is not None:
+            args['quality'] = quality
+        return args
+
+    def encode(self, image):
+        target_size = self.options.get('target_size')
+        if target_size is None:
+            return super().encode(image)
+
+        attempts = 0
+
+        def encode_at(quality):
+            nonlocal attempts
+            attempts += 1
+            buffer = io.BytesIO()
+            image.save(buffer, **self.save_args(quality))
+            return buffer.getvalue()
+
+        # 先试最高质量，大多数页面不超出预算时只编码一次；质量范围只有一个值时不再搜索
+        low, high = self.options['min_quality'], self.options['quality']
+        best_quality, best = high, encode_at(high)
+        if len(best) > target_size and low < high:
+            # 二分搜索：low 以下的质量都还没确定满足，best 始终是当前已知满足预算（或最低质量）的结果
+            best_quality, best = low, encode_at(low)
+            if len(best) <= target_size:
+                low, high = low + 1, high - 1
+                while low <= high:
+                    quality = (low + high) // 2
+                    data = encode_at(quality)
+                    if len(data) <= target_size:
+                        best_quality, best = quality, data
+                        low = quality + 1
+                    else:
+                        high = quality - 1
+
+        return best, {
+            'size': len(best),
+            'quality': best_quality,
+            'attempts': attempts,
+            'over_budget': len(best) > target_size,
+        }
+
+
+class PalettePngEncoder(PageEncoder):
+    """
+    调色板PNG：颜色数不超过 colors 时按原色建立调色板（无损），否则量化到 colors 种颜色
+    """
+    name = 'png'
+    format = 'PNG'
+    extension = '.png'
+    mime_type = 'image/png'
+    palette_input = True
+
+    def __init__(self, colors=256, dither=False, compress_level=6):
+        super().__init__(colors=colors, dither=dither, compress_level=compress_level)
+
+    def prepare(self, image):
+        colors = self.options['colors']
+        if image.mode == 'P':
+            # 已经是调色板图片（文字页面按覆盖度直接上色得到），颜色数不超限时直接使用
+            if image.getcolors(colors) is not None:
+                return image
+            image = image.convert('RGB')
+
+        image_colors = image.getcolors(colors)
+        if image_colors is not None:
+            # 颜色数足够少：每种颜色单独占一个调色板项，结果无损
+            if np is not None and image.mode == 'RGB':
+                return _exact_palette_image(image, image_colors)
+            return image.quantize(colors, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+
+        dither = Image.Dither.FLOYDSTEINBERG if self.options['dither'] else Image.Dither.NONE
+        return image.quantize(colors, method=Image.Quantize.MEDIANCUT, dither=dither)
+
+    def save_args(self):
+        return dict(format=self.format, compress_level=self.options['compress_level'])
+
+
+def _exact_palette_image(image, image_colors):
+    """
+    按图片中实际出现的颜色建立调色板（NumPy按颜色值查表，比中位切分快）
+    """
+    palette = np.array(sorted((r << 16) | (g << 8) | b for _, (r, g, b) in image_colors), dtype=np.uint32)
+    pixels = np.asarray(image).astype(np.uint32)
+    codes = (pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]
+    indices = np.searchsorted(palette, codes).astype(np.uint8)
+
+    paletted = Image.frombytes('P', image.size, indices.tobytes())
+    paletted.putpalette(np.stack([palette >> 16, (palette >> 8) & 255, palette & 255], axis=1).astype(np.uint8).tobytes())
+    return paletted
+
+
+class WebpEncoder(PageEncoder):
+    """
+    WebP：lossless=True 时 quality 表示压缩力度（越大越慢、越小）
+    """
+    name = 'webp'
+    format = 'WEBP'
+    extension = '.webp'
+    mime_type = 'image/webp'
+
+    def __init__(self, lossless=False, quality=90, method=4):
+        super().__init__(lossless=lossless, quality=quality, method=method)
+
+
+class AvifEncoder(PageEncoder):
+    """AVIF：speed 越小压缩越慢、文件越小"""
+    name = 'avif'
+    format = 'AVIF'
+    extension = '.avif'
+    mime_type = 'image/avif'
+
+    def __init__(self, quality=60, speed=6, subsampling='4:4:4'):
+        super().__init__(quality=quality, speed=speed, subsampling=subsampling)
+
+
+ENCODERS = {
+    'jpeg': JpegEncoder,
+    'png': PalettePngEncoder,
+    'webp': WebpEncoder,
+    'avif': AvifEncoder,
+}
+
+
+def format_encode_stats(stats):
+    """
+    把 encode() 的统计信息格式化为日志文字（只有按目标大小搜索质量时才有内容）
+    """
+    if 'attempts' not in stats:
+        return ''
+    text = f"质量:{stats['quality']}, 编码{stats['attempts']}次, {stats['size'] / 1024:.1f}KB"
+    if stats['over_budget']:
+        text += "，最低质量仍超出目标大小"
+    return text
+
+
+def encoder_available(name):
+    """检查当前Pillow是否支持该编码器"""
+    if name in ('webp', 'avif'):
+        return bool(features.check(name))
+    return name in ENCODERS
+
+
+def available_encoders():
+    """返回当前环境可用的编码器名称"""
+    return [name for name in ENCODERS if encoder_available(name)]
+
+
+def get_encoder(output_format='jpeg', **options):
+    """
+    按名称创建编码器，options 为该编码器的参数
+    """
+    if output_format not in ENCODERS:
+        raise ValueError(f"未知的输出格式: {output_format}（可选: {', '.join(ENCODERS)}）")
+    if not encoder_available(output_format):
+        raise ValueError(f"当前Pillow不支持输出格式: {output_format}")
+    return ENCODERS[output_format](**options)
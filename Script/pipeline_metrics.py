@@ -0,0 +1,275 @@
+"""
+流水线性能统计：记录每个文件各阶段的耗时、字宽测量次数和峰值内存，汇总后写成JSON或CSV
+
+JSON 中每个文件带有逐页的编码统计（encode_stats）；CSV 每个文件一行，只有编码统计的汇总列
+（encode_attempts、min_quality、over_budget_pages，不按目标大小编码时为空）。
+
+阶段：
+    hash      增量模式下计算文件哈希
+    decode    检测编码、读取和解码
+    wrap      换行及避头尾处理（txt）
+    paginate  分页及页面哈希（txt）
+    layout    Markdown解析、换行和分页（md）
+    rasterize 绘制页面图片
+    encode    编码图片
+    write     写入磁盘
+    backup    移动原文件到备份目录
+
+各阶段为累计耗时：页面并行渲染时 rasterize/encode/write 的合计可能超过实际经过的时间。
+嵌套的阶段互不重复计时（如 wrap 不包含从文件读取段落的时间）。
+"""
+import cProfile
+import csv
+import json
+import os
+import pstats
+import sys
+import time
+from contextlib import contextmanager
+
+from text_layout import measure_count
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+STAGES = ('hash', 'decode', 'wrap', 'paginate', 'layout', 'rasterize', 'encode', 'write', 'backup')
+CSV_COLUMNS = ('file', 'pages', 'rendered_pages', 'wall_seconds', 'measure_calls', 'peak_rss_bytes',
+               'encode_attempts', 'min_quality', 'over_budget_pages')
+
+
+def peak_rss_bytes():
+    """
+    当前进程的峰值常驻内存（字节）；无法获取时返回None
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [
+                ('cb', wintypes.DWORD),
+                ('PageFaultCount', wintypes.DWORD),
+                ('PeakWorkingSetSize', ctypes.c_size_t),
+                ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t),
+                ('PeakPagefileUsage', ctypes.c_size_t),
+            ]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    return None
+
+
+class FileMetrics:
+    """
+    单个文件的统计；只在转换该文件的线程中计时，渲染线程/进程的页面耗时通过 add() 汇入，
+    渲染进程中的字宽测量次数通过 add_measure_calls() 汇入
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = {}
+        self.pages = 0
+        self.rendered_pages = 0
+        self.measure_calls = 0
+        self.encode_stats = []  # 按目标大小搜索质量的页面：(输出文件名, 统计)
+        self.wall_seconds = 0.0
+        self.peak_rss = None
+        self._stack = []
+        self._mark = 0.0
+        self._start = None
+        self._start_measures = 0
+
+    def start(self):
+        """开始计时"""
+        self._start = time.perf_counter()
+        self._start_measures = measure_count()
+
+    def finish(self):
+        """结束计时，记录经过时间、测量次数和峰值内存"""
+        if self._start is not None:
+            self.wall_seconds += time.perf_counter() - self._start
+            self.add_measure_calls(measure_count() - self._start_measures)
+            self._start = None
+        self.peak_rss = peak_rss_bytes()
+
+    def add(self, stage, seconds):
+        """累加某阶段的耗时"""
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_measure_calls(self, count):
+        """累加字宽测量次数"""
+        self.measure_calls += count
+
+    def _switch(self):
+        # 把上次切换以来的时间记到当前（最内层）阶段上
+        now = time.perf_counter()
+        if self._stack:
+            self.add(self._stack[-1], now - self._mark)
+        self._mark = now
+
+    def enter(self, stage):
+        """进入阶段（外层阶段暂停计时）"""
+        self._switch()
+        self._stack.append(stage)
+
+    def exit(self):
+        """离开当前阶段"""
+        self._switch()
+        self._stack.pop()
+
+    def add_encode_stats(self, output_filename, stats):
+        """
+        记录页面的编码统计（只保留按目标大小搜索质量时的质量、编码次数和大小），
+        并行转换时随 FileMetrics 返回主进程打印
+        """
+        if 'attempts' in stats:
+            self.encode_stats.append((output_filename, {
+                key: stats[key] for key in ('quality', 'attempts', 'size', 'over_budget')
+            }))
+
+    def encode_summary(self):
+        """
+        编码统计的汇总：编码总次数、最低质量和超出目标大小的页数
+        """
+        stats = [stats for _, stats in self.encode_stats]
+        return {
+            'encode_attempts': sum(page['attempts'] for page in stats),
+            'min_quality': min(page['quality'] for page in stats),
+            'over_budget_pages': sum(1 for page in stats if page['over_budget']),
+        }
+
+    @contextmanager
+    def stage(self, stage):
+        """计时一段代码"""
+        self.enter(stage)
+        try:
+            yield
+        finally:
+            self.exit()
+
+    def timed_iter(self, iterable, stage):
+        """
+        包装流式处理的生成器：每次取下一个元素所用的时间记到该阶段
+        """
+        iterator = iter(iterable)
+        while True:
+            self.enter(stage)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.exit()
+            yield item
+
+    def to_dict(self):
+        data = {
+            'file': self.name,
+            'pages': self.pages,
+            'rendered_pages': self.rendered_pages,
+            'wall_seconds': round(self.wall_seconds, 6),
+            'measure_calls': self.measure_calls,
+            'peak_rss_bytes': self.peak_rss,
+            'stages': {stage: round(self.stages.get(stage, 0.0), 6) for stage in STAGES if stage in self.stages},
+        }
+        if self.encode_stats:
+            data.update(self.encode_summary())
+            data['encode_stats'] = [dict(stats, output=output_filename) for output_filename, stats in self.encode_stats]
+        return data
+
+
+class BatchMetrics:
+    """
+    一次批量转换的统计：每个文件的 FileMetrics 加上批次级别的阶段（如增量模式的哈希）
+    """
+
+    def __init__(self, script):
+        self.script = script
+        self.files = []
+        self.batch = FileMetrics('(batch)')
+        self._start = time.perf_counter()
+
+    def add_file(self, file_metrics):
+        self.files.append(file_metrics)
+
+    def summary(self):
+        """汇总所有文件的阶段耗时、页数、测量次数和峰值内存"""
+        stages = dict(self.batch.stages)
+        for file_metrics in self.files:
+            for stage, seconds in file_metrics.stages.items():
+                stages[stage] = stages.get(stage, 0.0) + seconds
+
+        peaks = [file_metrics.peak_rss for file_metrics in self.files] + [peak_rss_bytes()]
+        peaks = [peak for peak in peaks if peak is not None]
+        encoded = [file_metrics.encode_summary() for file_metrics in self.files if file_metrics.encode_stats]
+        summary = {
+            'script': self.script,
+            'files': len(self.files),
+            'pages': sum(file_metrics.pages for file_metrics in self.files),
+            'rendered_pages': sum(file_metrics.rendered_pages for file_metrics in self.files),
+            'wall_seconds': round(time.perf_counter() - self._start, 6),
+            'measure_calls': sum(file_metrics.measure_calls for file_metrics in self.files),
+            'peak_rss_bytes': max(peaks) if peaks else None,
+            'stages': {stage: round(stages[stage], 6) for stage in STAGES if stage in stages},
+        }
+        if encoded:
+            summary['encode_attempts'] = sum(file_summary['encode_attempts'] for file_summary in encoded)
+            summary['min_quality'] = min(file_summary['min_quality'] for file_summary in encoded)
+            summary['over_budget_pages'] = sum(file_summary['over_budget_pages'] for file_summary in encoded)
+        return summary
+
+    def write(self, path):
+        """
+        写出统计文件：扩展名为 .csv 时每个文件一行（最后一行为合计，编码统计只有汇总列），否则写JSON
+        """
+        summary = self.summary()
+        temp_path = path + '.tmp'
+        if path.lower().endswith('.csv'):
+            with open(temp_path, 'w', encoding='utf-8-sig', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(CSV_COLUMNS + STAGES)
+                for row in [file_metrics.to_dict() for file_metrics in self.files] + [dict(summary, file='(合计)')]:
+                    writer.writerow([row.get(column, '') for column in CSV_COLUMNS] +
+                                    [row['stages'].get(stage, 0.0) for stage in STAGES])
+        else:
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump({
+                    'summary': summary,
+                    'files': [file_metrics.to_dict() for file_metrics in self.files],
+                }, file, ensure_ascii=False, indent=1)
+        os.replace(temp_path, path)
+
+    def print_summary(self):
+        summary = self.summary()
+        stages = ', '.join(f"{stage} {seconds:.2f}s" for stage, seconds in summary['stages'].items())
+        print(f"各阶段耗时: {stages}")
+        peak = summary['peak_rss_bytes']
+        peak_text = f"{peak / 1024 / 1024:.0f}MB" if peak else '未知'
+        print(f"字宽测量: {summary['measure_calls']} 次, 峰值内存: {peak_text}")
+
+
+def run_profiled(profile_path, func, *args, **kwargs):
+    """
+    在 cProfile 下运行函数，把结果保存到 profile_path 并打印累计耗时最多的函数（只统计主进程）
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(profile_path)
+        print(f"\n性能分析结果保存在: {profile_path}（可用 python -m pstats 或 snakeviz 查看）")
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
@@ -0,0 +1,98 @@
+"""
+渲染服务压力测试：用多个并发连接向本地渲染服务提交同一篇文章，统计延迟、吞吐量和被拒绝（503）的请求
+
+用法：python render_load_test.py [文章路径] [请求数] [并发数] [服务地址]
+"""
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from render_server import CONFIG
+
+# 没有指定文章时使用的测试文本
+SAMPLE_TEXT = '　　这是一段用于压力测试的文字，包含中文标点，以及「引号」和（括号）。\n' * 200
+
+
+def post_render(url, body, params, timeout=300):
+    """
+    提交一次渲染请求
+
+    Returns:
+        (状态码, 响应头字典, 响应字节数, 耗时秒数)
+    """
+    request = urllib.request.Request(
+        f"{url}/render?{urlencode(params)}", data=body, method='POST',
+        headers={'Content-Type': 'text/plain; charset=utf-8'}
+    )
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            data = response.read()
+            return response.status, dict(response.headers), len(data), time.perf_counter() - start
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code, dict(e.headers), 0, time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    """按比例取排序后的值（不插值）"""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_load_test(url, text, total_requests=40, concurrency=8, params=None):
+    """
+    并发提交 total_requests 个请求，打印延迟分布、吞吐量和服务端计时
+
+    Returns:
+        {状态码: 请求数}
+    """
+    body = text.encode('utf-8')
+    params = params or {'kind': 'txt'}
+    print(f"压力测试: {url}，{total_requests} 个请求，并发 {concurrency}，每个请求 {len(body) / 1024:.1f}KB")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: post_render(url, body, params), range(total_requests)))
+    elapsed = time.perf_counter() - start
+
+    status_counts = {}
+    for status, _, _, _ in results:
+        status_counts[status] = status_counts.get(status, 0) + 1
+    succeeded = [result for result in results if result[0] == 200]
+
+    print(f"总耗时: {elapsed:.2f} 秒, 吞吐量: {len(succeeded) / elapsed:.2f} 请求/秒")
+    print("状态码: " + ", ".join(f"{status}: {count}" for status, count in sorted(status_counts.items())))
+    if succeeded:
+        latencies = [seconds * 1000 for _, _, _, seconds in succeeded]
+        queue_times = [float(headers['X-Queue-Time-Ms']) for _, headers, _, _ in succeeded]
+        render_times = [float(headers['X-Render-Time-Ms']) for _, headers, _, _ in succeeded]
+        print(f"延迟(ms): p50 {percentile(latencies, 0.5):.0f}, p95 {percentile(latencies, 0.95):.0f}, "
+              f"最大 {max(latencies):.0f}")
+        print(f"服务端平均: 排队 {sum(queue_times) / len(queue_times):.0f}ms, "
+              f"渲染 {sum(render_times) / len(render_times):.0f}ms, "
+              f"页数 {succeeded[0][1]['X-Page-Count']}, 响应 {succeeded[0][2] / 1024:.1f}KB")
+    return status_counts
+
+
+if __name__ == "__main__":
+    article_path = sys.argv[1] if len(sys.argv) > 1 else None
+    total_requests = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    server_url = sys.argv[4] if len(sys.argv) > 4 else f"http://{CONFIG['host']}:{CONFIG['port']}"
+
+    if article_path and not os.path.exists(article_path):
+        print(f"错误: 文章不存在: {article_path}")
+    else:
+        text = SAMPLE_TEXT
+        params = {'kind': 'txt'}
+        if article_path:
+            with open(article_path, 'r', encoding='utf-8') as file:
+                text = file.read()
+            if article_path.lower().endswith('.md'):
+                params = {'kind': 'md'}
+        run_load_test(server_url, text, total_requests, concurrency, params)
@@ -0,0 +1,344 @@
+"""
+本地HTTP渲染服务：其他工具直接提交文本或Markdown，返回页面图片（zip）或指定的单页图片
+
+- POST /render：请求体为文本内容，参数放在查询字符串中：
+    kind=txt|md、font_size、bg_color、text_color（如 f4eeeb 或 244,238,235）、
+    max_lines_per_page（txt）、output_format（jpeg/png/webp/avif）、quality、name、page（只返回第N页）
+- GET /health：当前排队和处理中的请求数
+
+渲染在常驻的进程池中进行（字体预先加载），同时接受的请求数有上限，
+超出时立即返回503并带 Retry-After，不会无限排队。
+响应头中带有每个请求的排队、渲染和总耗时（X-Queue-Time-Ms 等，及 Server-Timing）。
+只监听本机地址，完全离线运行。
+
+用法：python render_server.py [端口]
+"""
+import io
+import json
+import re
+import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlparse
+
+from PIL import ImageColor
+
+import md_to_jpg
+import txt_to_jpg
+from page_encoders import get_encoder
+from text_encoding import detect_encoding
+from text_layout import init_worker
+
+# 服务配置
+CONFIG = {
+    'host': '127.0.0.1',         # 只监听本机
+    'port': 8765,
+    'workers': 2,                # 渲染进程数
+    'max_queue': 8,              # 除正在渲染的请求外，最多排队的请求数（超出返回503）
+    'request_timeout': 120,      # 单个请求最长等待时间（秒），超时返回504
+    'max_body_bytes': 8 * 1024 * 1024,  # 请求体上限
+    'font_size': 20,             # 默认渲染参数（与脚本 __main__ 中一致）
+    'bg_color': (244, 238, 235),
+    'text_color': (59, 4, 0),
+    'max_lines_per_page': 50,
+    'max_page_height': 8000,
+    'render_backend': 'atlas',   # 常驻进程中字形缓存一直有效
+    'measure_cache_size': 65536, # 每个渲染进程的文本宽度缓存条目上限（LRU淘汰，内存不随请求数增长）
+    'access_log': True,          # 是否打印每个请求的日志
+}
+
+
+def render_document(text, kind, options):
+    """
+    在渲染进程中把文本直接在内存中渲染成页面图片（与两个脚本转换同样内容的文件输出相同）
+
+    Returns:
+        ([(文件名, 图片数据), ...], 渲染耗时秒数)
+    """
+    start = time.perf_counter()
+    encoder = get_encoder(options['output_format'], **options['encoder_options'])
+    if kind == 'md':
+        # 与按文本模式读取文件一样统一换行符
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+        pages = [
+            (output_filename, data) for output_filename, data, _, _, _ in md_to_jpg.iter_rendered_pages(
+                text, options['name'] + '.md', options['font_size'], options['bg_color'], options['text_color'],
+                False, CONFIG['max_page_height'], CONFIG['render_backend'], encoder
+            )
+        ]
+    else:
+        pages = txt_to_jpg.render_text_pages(
+            text, options['name'], options['font_size'], options['bg_color'], options['text_color'],
+            options['max_lines_per_page'], CONFIG['render_backend'], encoder
+        )
+    return pages, time.perf_counter() - start
+
+
+class RequestError(Exception):
+    """请求参数错误，带HTTP状态码"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _parse_color(value):
+    """解析颜色：f4eeeb、#f4eeeb、244,238,235 或颜色名"""
+    value = value.strip()
+    if re.fullmatch(r'\d{1,3},\d{1,3},\d{1,3}', value):
+        color = tuple(int(part) for part in value.split(','))
+        if all(part <= 255 for part in color):
+            return color
+    elif re.fullmatch(r'[0-9a-fA-F]{6}', value):
+        value = '#' + value
+    try:
+        return ImageColor.getrgb(value)[:3]
+    except ValueError:
+        raise RequestError(400, f"无法识别的颜色: {value}")
+
+
+def _parse_int(params, key, default, low, high):
+    """解析整数参数并检查范围"""
+    if key not in params:
+        return default
+    try:
+        value = int(params[key])
+    except ValueError:
+        raise RequestError(400, f"参数 {key} 应为整数: {params[key]}")
+    if not low <= value <= high:
+        raise RequestError(400, f"参数 {key} 应在 {low} 到 {high} 之间: {value}")
+    return value
+
+
+def parse_render_options(query):
+    """
+    把查询字符串解析为 (文本类型, 渲染参数, 页码)；页码为None时返回所有页
+    """
+    params = {key: values[-1] for key, values in parse_qs(query).items()}
+
+    kind = params.get('kind', 'txt')
+    if kind not in ('txt', 'md'):
+        raise RequestError(400, f"参数 kind 应为 txt 或 md: {kind}")
+
+    output_format = params.get('output_format', 'jpeg')
+    encoder_options = {}
+    if 'quality' in params:
+        encoder_options['quality'] = _parse_int(params, 'quality', None, 1, 100)
+    elif kind == 'md' and output_format == 'jpeg':
+        encoder_options['quality'] = 95  # 与 md_to_jpg 的默认质量一致
+    try:
+        get_encoder(output_format, **encoder_options)
+    except (TypeError, ValueError) as e:
+        raise RequestError(400, str(e))
+
+    # 文件名只用于输出的图片名，去掉路径和不安全的字符
+    name = re.sub(r'[\\/:*?"<>|\s]+', '_', params.get('name', 'page')).strip('._') or 'page'
+
+    options = {
+        'name': name[:100],
+        'font_size': _parse_int(params, 'font_size', CONFIG['font_size'], 8, 96),
+        'bg_color': _parse_color(params['bg_color']) if 'bg_color' in params else CONFIG['bg_color'],
+        'text_color': _parse_color(params['text_color']) if 'text_color' in params else CONFIG['text_color'],
+        'max_lines_per_page': _parse_int(params, 'max_lines_per_page', CONFIG['max_lines_per_page'], 1, 1000),
+        'output_format': output_format,
+        'encoder_options': encoder_options,
+    }
+    page = _parse_int(params, 'page', None, 1, 100000)
+    return kind, options, page
+
+
+def decode_body(body, content_type):
+    """按 Content-Type 中的 charset 解码请求体，没有时自动检测编码"""
+    match = re.search(r'charset=([\w-]+)', content_type or '')
+    encodings = [match.group(1)] if match else detect_encoding(body).candidates
+    for encoding in encodings:
+        try:
+            return body.decode(encoding)
+        except (LookupError, UnicodeDecodeError):
+            continue
+    raise RequestError(400, "无法解码请求内容")
+
+
+class RenderServer(ThreadingHTTPServer):
+    """
+    HTTP服务：每个连接一个线程，渲染交给常驻进程池；
+    slots 限制同时接受的请求数（渲染中 + 排队中），满了直接拒绝
+    """
+    daemon_threads = True
+
+    def __init__(self, address, workers, max_queue):
+        super().__init__(address, RenderRequestHandler)
+        self.workers = workers
+        self.capacity = workers + max_queue
+        # 渲染进程预先加载默认字号的字体
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker,
+            initargs=((txt_to_jpg.load_font, md_to_jpg.load_fonts), CONFIG['font_size'] * 2, CONFIG['measure_cache_size'])
+        )
+        self.slots = threading.BoundedSemaphore(self.capacity)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, text, kind, options):
+        """
+        提交渲染任务；请求数已满时返回None（调用方返回503）
+        """
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            return None
+        with self.lock:
+            self.in_flight += 1
+        try:
+            future = self.executor.submit(render_document, text, kind, options)
+        except Exception:
+            with self.lock:
+                self.in_flight -= 1
+            self.slots.release()
+            raise
+        # 超时的请求在渲染真正结束后才释放名额，避免进程池中堆积
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future):
+        with self.lock:
+            self.in_flight -= 1
+            self.completed += 1
+        self.slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(cancel_futures=True)
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    """处理 /render 和 /health 请求"""
+    server_version = 'TxtToJpgRender/1.0'
+
+    def do_GET(self):
+        if urlparse(self.path).path != '/health':
+            self.send_json(404, {'error': '未知的路径'})
+            return
+        server = self.server
+        with server.lock:
+            status = {
+                'status': 'ok',
+                'workers': server.workers,
+                'capacity': server.capacity,
+                'in_flight': server.in_flight,
+                'completed': server.completed,
+                'rejected': server.rejected,
+            }
+        self.send_json(200, status)
+
+    def do_POST(self):
+        start = time.perf_counter()
+        url = urlparse(self.path)
+        if url.path != '/render':
+            self.send_json(404, {'error': '未知的路径'})
+            return
+
+        try:
+            kind, options, page = parse_render_options(url.query)
+            length = int(self.headers.get('Content-Length') or 0)
+            if length <= 0:
+                raise RequestError(400, "请求内容为空")
+            if length > CONFIG['max_body_bytes']:
+                raise RequestError(413, f"请求内容超过 {CONFIG['max_body_bytes']} 字节")
+            text = decode_body(self.rfile.read(length), self.headers.get('Content-Type'))
+        except RequestError as e:
+            self.send_json(e.status, {'error': str(e)})
+            return
+        except ValueError:
+            self.send_json(400, {'error': 'Content-Length 无效'})
+            return
+
+        future = self.server.submit(text, kind, options)
+        if future is None:
+            self.send_json(503, {'error': '服务繁忙，请稍后重试'}, {'Retry-After': '1'})
+            return
+
+        try:
+            pages, render_seconds = future.result(timeout=CONFIG['request_timeout'])
+        except TimeoutError:
+            self.send_json(504, {'error': '渲染超时'})
+            return
+        except Exception as e:
+            self.send_json(500, {'error': f"渲染失败: {e}"})
+            return
+
+        total_seconds = time.perf_counter() - start
+        timing = {
+            'X-Page-Count': str(len(pages)),
+            'X-Render-Time-Ms': f"{render_seconds * 1000:.1f}",
+            'X-Queue-Time-Ms': f"{max(0.0, total_seconds - render_seconds) * 1000:.1f}",
+            'X-Total-Time-Ms': f"{total_seconds * 1000:.1f}",
+            'Server-Timing': f"queue;dur={max(0.0, total_seconds - render_seconds) * 1000:.1f}, "
+                             f"render;dur={render_seconds * 1000:.1f}",
+        }
+
+        if page is not None:
+            if page > len(pages):
+                self.send_json(404, {'error': f"只有 {len(pages)} 页"}, timing)
+                return
+            output_filename, data = pages[page - 1]
+            content_type = get_encoder(options['output_format']).mime_type
+            self.send_bytes(200, data, content_type, output_filename, timing)
+            return
+
+        # 图片本身已经压缩，zip只打包不再压缩
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+            for output_filename, data in pages:
+                archive.writestr(output_filename, data)
+        self.send_bytes(200, buffer.getvalue(), 'application/zip', options['name'] + '.zip', timing)
+
+    def send_bytes(self, status, data, content_type, filename, headers):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Content-Disposition', f"attachment; filename*=UTF-8''{quote(filename)}")
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if CONFIG['access_log']:
+            super().log_message(format, *args)
+
+
+def run_server(host=None, port=None, workers=None, max_queue=None):
+    """
+    启动渲染服务，按 Ctrl+C 退出
+    """
+    server = RenderServer((host or CONFIG['host'], port or CONFIG['port']),
+                          workers or CONFIG['workers'], CONFIG['max_queue'] if max_queue is None else max_queue)
+    host, port = server.server_address[:2]
+    print(f"渲染服务已启动: http://{host}:{port}/render（{server.workers} 个渲染进程，最多 {server.capacity} 个请求）")
+    print("按 Ctrl+C 退出")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n渲染服务已停止")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    run_server(port=int(sys.argv[1]) if len(sys.argv) > 1 else None)
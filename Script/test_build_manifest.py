@@ -0,0 +1,45 @@
+"""
+build_manifest 的测试：渲染参数和页面的哈希在不同进程中保持不变
+
+用法：python -m pytest test_build_manifest.py
+"""
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+from PIL import ImageFont
+
+from build_manifest import config_hash, font_identity, page_hash
+
+HASH_SCRIPT = (
+    "from PIL import ImageFont\n"
+    "from build_manifest import config_hash, font_identity, page_hash\n"
+    "params = {'font': font_identity(ImageFont.load_default())}\n"
+    "print(config_hash(params), page_hash(['第一行', '第二行'], params))\n"
+)
+
+
+def test_font_identity_of_memory_font_is_stable():
+    font = ImageFont.load_default()
+    assert not isinstance(getattr(font, 'path', None), str)
+    assert font_identity(font) == font_identity(ImageFont.load_default())
+    assert isinstance(font_identity(font), str)
+
+
+def test_config_hash_is_stable_across_processes():
+    hashes = {
+        subprocess.run([sys.executable, '-c', HASH_SCRIPT], capture_output=True, text=True, check=True,
+                       cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        for _ in range(2)
+    }
+    params = {'font': font_identity(ImageFont.load_default())}
+    assert hashes == {f"{config_hash(params)} {page_hash(['第一行', '第二行'], params)}"}
+
+
+def test_hashes_reject_objects():
+    with pytest.raises(TypeError):
+        config_hash({'font': io.BytesIO()})
+    with pytest.raises(TypeError):
+        page_hash(['第一行'], {'font': io.BytesIO()})
@@ -0,0 +1,72 @@
+"""
+directory_watcher 的测试（轮询方式）：启动时已有的文件不报告，仍在写入的文件等写完
+（settle_time 内不再变化）才报告，被修改或删除后重新出现的文件再次报告
+
+用法：python -m pytest test_directory_watcher.py
+"""
+import os
+import threading
+import time
+
+from directory_watcher import DirectoryWatcher
+
+SETTLE_TIME = 0.3
+
+
+def make_watcher(directory):
+    watcher = DirectoryWatcher(str(directory), ['.txt', '.md'], poll_interval=0.05, settle_time=SETTLE_TIME,
+                               use_watchdog=False)
+    watcher.start()
+    return watcher
+
+
+def test_existing_files_are_not_reported(tmp_path):
+    (tmp_path / 'old.txt').write_text('已有的文件', encoding='utf-8')
+    watcher = make_watcher(tmp_path)
+    assert watcher.backend == 'polling'
+
+    (tmp_path / 'new.md').write_text('新文件', encoding='utf-8')
+    (tmp_path / 'ignored.jpg').write_bytes(b'not text')
+    assert watcher.wait_for_files() == ['new.md']
+
+
+def test_file_is_reported_after_writing_stops(tmp_path):
+    watcher = make_watcher(tmp_path)
+    path = tmp_path / 'growing.txt'
+    writes = 8
+    last_write = []
+
+    def write_slowly():
+        with open(path, 'w', encoding='utf-8') as file:
+            for _ in range(writes):
+                file.write('一行正在写入的文字\n')
+                file.flush()
+                last_write[:] = [time.monotonic()]
+                time.sleep(SETTLE_TIME / 3)
+
+    writer = threading.Thread(target=write_slowly)
+    writer.start()
+    try:
+        assert watcher.wait_for_files() == ['growing.txt']
+        reported = time.monotonic()
+    finally:
+        writer.join()
+
+    # 写入过程中从未报告；报告时文件已经写完，并且之后至少稳定了 settle_time
+    assert path.read_text(encoding='utf-8').count('\n') == writes
+    assert reported - last_write[0] >= SETTLE_TIME
+
+
+def test_modified_and_recreated_files_are_reported_again(tmp_path):
+    path = tmp_path / 'a.txt'
+    path.write_text('第一版', encoding='utf-8')
+    watcher = make_watcher(tmp_path)
+
+    path.write_text('第二版，内容变长了', encoding='utf-8')
+    assert watcher.wait_for_files() == ['a.txt']
+
+    # 移走（如转换后移到备份目录）后再放回同样的文件，仍然重新报告
+    os.replace(path, tmp_path / 'a.bak')
+    assert watcher._scan() == []
+    os.replace(tmp_path / 'a.bak', path)
+    assert watcher.wait_for_files() == ['a.txt']
@@ -0,0 +1,88 @@
+"""
+glyph_atlas 的测试：字形缓存拼接的结果与 ImageDraw.text 逐像素一致，字形和字距对的缓存各有容量上限
+
+用法：python -m pytest test_glyph_atlas.py
+"""
+import random
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+import glyph_atlas
+from benchmark import make_cjk_prose
+from font_registry import FONT_REGISTRY
+from text_layout import get_advance_cache
+
+FONT_CANDIDATES = ['DejaVuSans.ttf', 'simsun.ttc', 'msyh.ttc', 'arial.ttf', 'Arial.ttf', 'PingFang.ttc']
+TEXT = '　　Kerning AV To Wa ffi 中文，测试。「引号」（括号）…… fj /// ___'
+
+
+def load_test_font(size=37):
+    for name in FONT_CANDIDATES:
+        path = FONT_REGISTRY.resolve(name)
+        if path is not None:
+            return ImageFont.truetype(path, size, layout_engine=ImageFont.Layout.BASIC)
+    pytest.skip("没有找到测试字体")
+
+
+def render(draw_text, font, text, x=3.3):
+    image = Image.new('L', (1600, 80), 0)
+    draw_text(ImageDraw.Draw(image), (x, 10), text, font, 255)
+    return image.tobytes()
+
+
+def test_atlas_matches_imagedraw():
+    font = load_test_font()
+    atlas = glyph_atlas.GlyphAtlas()
+    for x in (0, 3.3, 7.75):
+        assert render(atlas.draw_text, font, TEXT, x) == render(glyph_atlas._draw_text_with_imagedraw, font, TEXT, x)
+
+
+def test_cache_is_bounded():
+    font = load_test_font()
+    atlas = glyph_atlas.GlyphAtlas(max_glyphs=8)
+    expected = render(glyph_atlas._draw_text_with_imagedraw, font, TEXT)
+    for _ in range(2):
+        assert render(atlas.draw_text, font, TEXT) == expected
+    stats = atlas.stats()
+    assert stats['glyphs'] <= 8
+    assert stats['evictions'] > 0
+
+    atlas.resize(2)
+    assert atlas.stats()['glyphs'] <= 2
+
+
+def test_kerning_pairs_have_their_own_capacity():
+    font = load_test_font()
+    if not get_advance_cache(font).has_kerning:
+        pytest.skip("测试字体没有字距调整")
+    atlas = glyph_atlas.GlyphAtlas(max_glyphs=1000)
+    text = make_cjk_prose(3000, random.Random(1)).replace('\n', '')
+    lines = [text[i:i + 30] for i in range(0, len(text), 30)]
+    for _ in range(2):
+        for line in lines:
+            render(atlas.draw_text, font, line)
+
+    # 中文正文中不同的相邻字符对远多于字形，字距对不占用字形缓存的容量，也不会互相淘汰
+    stats = atlas.stats()
+    assert stats['kerning_pairs'] > stats['glyphs']
+    assert stats['evictions'] == 0
+    assert stats['kerning_evictions'] == 0
+    assert stats['kerning_hits'] >= stats['kerning_misses']
+    assert '字距对' in glyph_atlas.format_atlas_stats(stats)
+
+    atlas.resize(max_kerning_pairs=10)
+    stats = atlas.stats()
+    assert stats['kerning_pairs'] == 10
+    assert stats['kerning_evictions'] > 0
+    assert stats['evictions'] == 0
+
+
+def test_blend_without_numpy_matches(monkeypatch):
+    if glyph_atlas.np is None:
+        pytest.skip("没有安装NumPy")
+    region = Image.frombytes('L', (256, 16), bytes(range(256)) * 16)
+    mask = Image.frombytes('L', (256, 16), bytes(sum(([value] * 256 for value in range(0, 256, 16)), [])))
+    expected = glyph_atlas._blend_overlap(region, mask).tobytes()
+    monkeypatch.setattr(glyph_atlas, 'np', None)
+    assert glyph_atlas._blend_overlap(region, mask).tobytes() == expected
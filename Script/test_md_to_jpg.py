@@ -0,0 +1,229 @@
+"""
+md_to_jpg 的测试：固定当前支持的语法子集的解析结果，换行后每行的绘制宽度不超过可用宽度；
+整篇文档只排版（换行）一次，画布尺寸取自排版结果；长文档按块分页，每页不超过最大页高；
+只排版（dry run）报告的页面尺寸与实际生成的图片相同
+
+用法：python -m pytest test_md_to_jpg.py
+"""
+import random
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+import md_to_jpg
+from font_registry import FONT_REGISTRY
+from md_to_jpg import (STYLE_BOLD, STYLE_CODE, STYLE_ITALIC, STYLE_LINK, STYLE_NORMAL, calculate_optimal_width,
+                       convert_file, draw_formatted_line, iter_markdown_blocks, layout_document, layout_file,
+                       parse_markdown, split_boxes_into_pages, style_fonts, styled_line_width, styled_runs,
+                       wrap_styled_runs)
+
+N, B, I, C, L = STYLE_NORMAL, STYLE_BOLD, STYLE_ITALIC, STYLE_CODE, STYLE_LINK
+INDENT = '　　'
+
+
+@pytest.mark.parametrize('text, expected', [
+    # 标题（只支持1到4级，标题块中后续的行并入标题）
+    ("# 一级标题\n\n## 二级 标题 \n\n### 三级\n\n#### 四级\n\n##### 五级不识别", [
+        ('h1', '一级标题'), ('h2', '二级 标题'), ('h3', '三级'), ('h4', '四级'),
+        ('p', ((N, INDENT + '##### 五级不识别'),)),
+    ]),
+    ("# 标题\n接着的一行", [('h1', '标题\n接着的一行')]),
+    # 无序列表：每个列表块之后有一个 list_end
+    ("- 第一项\n* 第二项\n\n  \n- 单独的列表", [
+        ('li', '第一项', 'ul', 1), ('li', '第二项', 'ul', 1), ('list_end', ''),
+        ('empty', ''), ('p', ((N, INDENT + '- 单独的列表'),)),
+    ]),
+    # 有序列表：重新从1编号
+    ("1. 第一\n2.  第二\n10. 第十\n\n3. 另一个列表", [
+        ('li', '第一', 'ol', 1), ('li', '第二', 'ol', 2), ('li', '第十', 'ol', 3), ('list_end', ''),
+        ('li', '另一个列表', 'ol', 1), ('list_end', ''),
+    ]),
+    # 水平线
+    ("---\n\n***\n\n___\n\n--", [('hr', ''), ('hr', ''), ('hr', ''), ('p', ((N, '--'),))]),
+    # 代码块（缩进4个空格或制表符）
+    ("    def f():\n        return 1\n\n\tx = 2", [
+        ('code', 'def f():'), ('code', 'return 1'), ('code', 'x = 2'),
+    ]),
+    # 连续的空行
+    ("第一段\n\n\n\n第二段\n\n\n", [
+        ('p', ((N, INDENT + '第一段'),)), ('empty', ''), ('p', ((N, INDENT + '第二段'),)), ('empty', ''),
+    ]),
+    ("\n\n开头有空行", [('empty', ''), ('p', ((N, INDENT + '开头有空行'),))]),
+    # 段落逐行处理，只有含中文的行加段首缩进
+    ("第一行\n\n   \nEnglish line\n中文 line", [
+        ('p', ((N, INDENT + '第一行'),)), ('empty', ''), ('p', ((N, 'English line'),)),
+        ('p', ((N, INDENT + '中文 line'),)),
+    ]),
+])
+def test_parse_markdown_blocks(text, expected):
+    assert parse_markdown(text) == expected
+
+
+@pytest.mark.parametrize('line, expected', [
+    ("看[这里](https://example.com)和[空]()", ((N, '看'), (L, '这里'), (N, '和'), (L, '空'))),
+    ("调用`print()`函数", ((N, '调用'), (C, 'print()'), (N, '函数'))),
+    ("这是**粗体**和__也是粗体__", ((N, '这是'), (B, '粗体'), (N, '和'), (B, '也是粗体'))),
+    ("这是*斜体*和_也是斜体_", ((N, '这是'), (I, '斜体'), (N, '和'), (I, '也是斜体'))),
+    # 嵌套的格式只保留最外层样式
+    ("[**粗体链接**](u)", ((L, '粗体链接'),)),
+    ("*斜体里有**粗体**文字*", ((I, '斜体里有粗体文字'),)),
+    ("**粗体`代码`**", ((B, '粗体代码'),)),
+    # 无法配对的标记按普通文字处理
+    ("单个*星号和`反引号以及[方括号", ((N, '单个*星号和`反引号以及[方括号'),)),
+    ("a**b", ((N, 'ab'),)),
+    ("**a****b**", ((B, 'ab'),)),
+    ("", ()),
+])
+def test_styled_runs(line, expected):
+    assert styled_runs(line) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+    # 与原先按顺序做四次替换的实现不同（交叉的标记本来就没有明确含义）：
+    # 斜体在代码内结束时，代码标记保持原样
+    ("*斜体 `代码* 结束`", [('p', ((N, INDENT), (I, '斜体 `代码'), (N, ' 结束`')))]),
+    ("**粗*体**斜*", [('p', ((N, INDENT), (B, '粗*体'), (N, '斜*')))]),
+    # 链接文字不再跨行
+    ("[链接\n文字](url)", [('p', ((N, INDENT + '[链接'),)), ('p', ((N, INDENT + '文字](url)'),))]),
+])
+def test_documented_divergences(text, expected):
+    assert parse_markdown(text) == expected
+
+
+def test_blocks_match_split_on_blank_lines():
+    rng = random.Random(20240601)
+    for _ in range(2000):
+        text = '\n'.join(rng.choice(['', '', 'a', 'b c', ' ']) for _ in range(rng.randint(0, 12)))
+        blocks = ['\n'.join(block) for block in iter_markdown_blocks(text.split('\n'))]
+        assert blocks == text.split('\n\n'), repr(text)
+
+
+WRAP_SAMPLES = [
+    "调用`print()`函数，然后 `some code span that is long enough` and text continues with **bold words** and *italics*.",
+    "这是一段很长的中文，里面有[链接文字](http://example.com)和`代码片段一二三四五六七八九十`，还有**粗体**内容。",
+    "Kerning: AVAVAV Wa To Ty `Yo VA AV To` LT AY Te Tr WAVE **AVOW** *Typography* VAT.",
+]
+
+
+@pytest.mark.parametrize('font_name', ['DejaVuSansMono.ttf', 'DejaVuSans.ttf'])
+def test_wrapped_lines_fit_drawn_width(font_name):
+    path = FONT_REGISTRY.resolve(font_name)
+    if path is None:
+        pytest.skip(f"没有找到字体 {font_name}")
+    font = ImageFont.truetype(path, 20, layout_engine=ImageFont.Layout.BASIC)
+    fonts = style_fonts(font)
+    draw = ImageDraw.Draw(Image.new('RGB', (600, 40)))
+
+    for line in WRAP_SAMPLES:
+        runs = styled_runs(line)
+        text = ''.join(run_text for _, run_text in runs)
+        for max_width in range(150, 501, 5):
+            wrapped = wrap_styled_runs(runs, fonts, max_width)
+            assert ''.join(run_text for runs_of_line in wrapped for _, run_text in runs_of_line) == text
+            for wrapped_line in wrapped:
+                drawn_width = draw_formatted_line(draw, wrapped_line, 0, 0, font, font, font, (0, 0, 0))
+                assert drawn_width == styled_line_width(wrapped_line, fonts)
+                if sum(len(run_text) for _, run_text in wrapped_line) > 1:
+                    assert drawn_width <= max_width, (max_width, wrapped_line)
+
+
+DOCUMENT = "# 标题\n\n" + (
+    "正文段落，有**粗体**、*斜体*、`代码`和[链接](http://example.com)。" * 6 + "\n\n"
+    + "- 列表项，" * 3 + "\n" + "- 很长的列表项" * 12 + "\n\n"
+    + "1. 第一\n2. 第二\n\n    code line\n\n---\n\n"
+) * 3
+
+
+@pytest.fixture
+def truetype_fonts(monkeypatch):
+    """没有中文字体时默认字体不会换行，改用 DejaVuSans 排版"""
+    path = FONT_REGISTRY.resolve('DejaVuSans.ttf')
+    if path is None:
+        pytest.skip("没有找到字体 DejaVuSans.ttf")
+    monkeypatch.setattr(md_to_jpg, 'load_fonts', lambda size: (ImageFont.truetype(path, size),) * 3)
+
+
+def layout_options(font_size=26):
+    """与 md_to_jpg 相同的排版参数：(正文字体, 粗体, 斜体, 可用宽度, 行高)"""
+    hd_font_size = font_size * 2
+    img_width = calculate_optimal_width(font_size, 2)
+    font, bold_font, italic_font = md_to_jpg.load_fonts(hd_font_size)
+    return font, bold_font, italic_font, img_width - 2 * int(img_width * 0.08), int(hd_font_size * 1.6)
+
+
+def test_document_is_wrapped_once(tmp_path, monkeypatch, truetype_fonts):
+    path = tmp_path / 'doc.md'
+    path.write_text(DOCUMENT, encoding='utf-8')
+    wrapped = []
+    wrap = md_to_jpg.wrap_styled_runs
+
+    def counting_wrap(runs, fonts, max_width):
+        wrapped.append(runs)
+        return wrap(runs, fonts, max_width)
+
+    monkeypatch.setattr(md_to_jpg, 'wrap_styled_runs', counting_wrap)
+    results = convert_file(str(path), str(tmp_path), verbose=False)
+
+    # 每个段落和列表项各换行一次，没有先估算高度再重新排版
+    assert len(wrapped) == sum(1 for line in parse_markdown(DOCUMENT) if line[0] in ('p', 'li'))
+
+    font, bold_font, italic_font, usable_width, line_height = layout_options()
+    _, _, final_y = layout_document(DOCUMENT, 'doc.md', font, usable_width, line_height, 8000, bold_font, italic_font)
+    (name, width, height), = results
+    assert height == max(1000, final_y - 40 + 80)
+    with Image.open(tmp_path / name) as image:
+        assert image.size == (width, height)
+
+
+def test_long_document_is_paginated_by_blocks(tmp_path, truetype_fonts):
+    path = tmp_path / 'long.md'
+    path.write_text(DOCUMENT * 2, encoding='utf-8')
+    max_page_height = 1200
+
+    results = convert_file(str(path), str(tmp_path), verbose=False, max_page_height=max_page_height)
+    assert [name for name, _, _ in results] == [f'long_页{page_num}.jpg' for page_num in range(1, len(results) + 1)]
+    assert len(results) > 3
+    for name, width, height in results:
+        assert height <= max_page_height
+        with Image.open(tmp_path / name) as image:
+            assert image.size == (width, height)
+
+    # 每个块（如多行的列表项）完整地出现在一页中，所有行盒按顺序各出现一次
+    font, bold_font, italic_font, usable_width, line_height = layout_options()
+    boxes, final_y = md_to_jpg.layout_markdown(parse_markdown(DOCUMENT * 2), font, usable_width, line_height, 40,
+                                               bold_font, italic_font)
+    pages = split_boxes_into_pages(boxes, 40, final_y, max_page_height - 80)
+    assert len(pages) == len(results)
+    assert [box for page_boxes, _, _ in pages for box in page_boxes] == boxes
+    page_of_block = {}
+    for page_num, (page_boxes, page_top, page_bottom) in enumerate(pages):
+        assert page_bottom - page_top <= max_page_height - 80
+        for box in page_boxes:
+            assert page_of_block.setdefault(box[4], page_num) == page_num
+    assert any(len([box for box in boxes if box[4] == block]) > 1 for block in page_of_block)
+
+
+def test_oversized_block_gets_its_own_page():
+    boxes = [('text', 40, 100, ((STYLE_NORMAL, 'x'),), 0),
+             ('text', 140, 100, ((STYLE_NORMAL, 'a'),), 1), ('text', 240, 100, ((STYLE_NORMAL, 'b'),), 1),
+             ('text', 340, 100, ((STYLE_NORMAL, 'c'),), 1),
+             ('text', 440, 100, ((STYLE_NORMAL, 'y'),), 4)]
+    pages = split_boxes_into_pages(boxes, 40, 600, 250)
+    assert [[box[4] for box in page_boxes] for page_boxes, _, _ in pages] == [[0], [1, 1, 1], [4]]
+    assert [(top, bottom) for _, top, bottom in pages] == [(40, 140), (140, 440), (440, 600)]
+
+
+@pytest.mark.parametrize('name, text', [('long.md', DOCUMENT * 2), ('plain.txt', "没有标记的纯文本。\n" * 200)])
+def test_dry_run_matches_rendered_pages(tmp_path, truetype_fonts, name, text):
+    path = tmp_path / name
+    path.write_text(text, encoding='utf-8')
+
+    report = layout_file(str(path), max_page_height=1200)
+    results = convert_file(str(path), str(tmp_path), verbose=False, max_page_height=1200)
+    assert report['encoding'] == 'utf-8'
+    assert report['pages'] == len(results) > 1
+    sizes = []
+    for output_name, _, _ in results:
+        with Image.open(tmp_path / output_name) as image:
+            sizes.append(list(image.size))
+    assert report['page_sizes'] == sizes
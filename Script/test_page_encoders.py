@@ -0,0 +1,48 @@
+"""
+page_encoders 的测试：JPEG按目标大小搜索质量
+
+用法：python -m pytest test_page_encoders.py
+"""
+import io
+
+from PIL import Image
+
+from page_encoders import JpegEncoder
+from pipeline_metrics import FileMetrics
+
+
+def make_page():
+    return Image.effect_noise((300, 300), 60).convert('RGB')
+
+
+def jpeg_size(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, **JpegEncoder().save_args(quality))
+    return len(buffer.getvalue())
+
+
+def test_search_picks_highest_quality_within_budget():
+    image = make_page()
+    target_size = jpeg_size(image, 60)
+    data, stats = JpegEncoder(quality=95, target_size=target_size, min_quality=10).encode(image)
+    assert len(data) <= target_size
+    assert not stats['over_budget']
+    assert stats['quality'] >= 60
+    assert jpeg_size(image, stats['quality'] + 1) > target_size
+
+
+def test_single_quality_encodes_once():
+    data, stats = JpegEncoder(quality=50, target_size=100, min_quality=50).encode(make_page())
+    assert stats['attempts'] == 1
+    assert stats['quality'] == 50
+    assert stats['over_budget']
+
+
+def test_stats_are_kept_in_file_metrics():
+    metrics = FileMetrics('a.txt')
+    _, stats = JpegEncoder(quality=95, target_size=10 ** 9).encode(make_page())
+    metrics.add_encode_stats('a_页1.jpg', stats)
+    _, stats = JpegEncoder().encode(make_page())
+    metrics.add_encode_stats('a_页2.jpg', stats)
+    assert [output for output, _ in metrics.encode_stats] == ['a_页1.jpg']
+    assert metrics.to_dict()['encode_stats'][0]['attempts'] == 1
@@ -0,0 +1,70 @@
+"""
+pipeline_metrics 的测试：CSV中的测量次数和编码汇总列，并行转换时工作进程的测量次数汇入主进程
+
+用法：python -m pytest test_pipeline_metrics.py
+"""
+import csv
+
+import pytest
+
+import txt_to_jpg
+from text_layout import MEASURE_CACHE
+
+TEXTS = {
+    'a.txt': "第一章，测试统计信息的汇总。Some English words here.\n" * 40,
+    'b.txt': "短文件，只有一页。\n",
+}
+
+
+@pytest.fixture
+def input_dir(tmp_path):
+    directory = tmp_path / 'input'
+    directory.mkdir()
+    for name, text in TEXTS.items():
+        (directory / name).write_text(text, encoding='utf-8')
+    return directory
+
+
+def run_batch(input_dir, tmp_path, name, **options):
+    """转换一次并返回CSV中 文件名 -> 行"""
+    metrics_file = tmp_path / f'{name}.csv'
+    options.setdefault('encoder_options', {'target_size': 10 ** 9})
+    txt_to_jpg.txt_to_jpg_batch(str(input_dir), str(tmp_path / name), str(tmp_path / 'backup'),
+                                max_lines_per_page=10, move_to_backup=False,
+                                metrics_file=str(metrics_file), **options)
+    with open(metrics_file, encoding='utf-8-sig', newline='') as file:
+        return {row['file']: row for row in csv.DictReader(file)}
+
+
+def test_worker_processes_count_measurements(input_dir, tmp_path):
+    # 先在本进程转换一次预热缓存：fork出的工作进程不能因此把测量次数记成0
+    run_batch(input_dir, tmp_path, 'warm')
+    warm = run_batch(input_dir, tmp_path, 'serial')
+    assert warm['(合计)']['measure_calls'] == '0'
+
+    rows = run_batch(input_dir, tmp_path, 'workers', workers=2)
+    for file in TEXTS:
+        assert int(rows[file]['measure_calls']) > 0
+    assert int(rows['(合计)']['measure_calls']) == sum(int(rows[file]['measure_calls']) for file in TEXTS)
+
+
+def test_page_processes_count_measurements(input_dir, tmp_path):
+    # 渲染进程中的测量（图集后端绘制时）要汇入文件的计数
+    MEASURE_CACHE.clear()
+    serial = run_batch(input_dir, tmp_path, 'serial', render_backend='atlas')
+    MEASURE_CACHE.clear()
+    rows = run_batch(input_dir, tmp_path, 'pages', render_backend='atlas', page_workers=2, page_executor='process')
+    assert int(rows['a.txt']['measure_calls']) > int(serial['a.txt']['measure_calls'])
+
+
+def test_csv_encode_columns(input_dir, tmp_path):
+    rows = run_batch(input_dir, tmp_path, 'serial')
+    assert rows['a.txt']['encode_attempts'] == rows['a.txt']['rendered_pages'] == '5'
+    assert rows['a.txt']['min_quality'] == '100'
+    assert rows['b.txt']['encode_attempts'] == '1'
+    assert rows['(合计)']['encode_attempts'] == '6'
+    assert rows['(合计)']['over_budget_pages'] == '0'
+
+    # 不按目标大小编码时汇总列为空
+    rows = run_batch(input_dir, tmp_path, 'plain', encoder_options={})
+    assert rows['a.txt']['encode_attempts'] == rows['(合计)']['min_quality'] == ''
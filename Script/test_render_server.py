@@ -0,0 +1,128 @@
+"""
+render_server 的测试：在随机端口上启动服务，检查 /health、/render 的zip和单页响应、计时响应头、
+请求数已满时的503和超时的504，以及内存中渲染的结果与转换同样内容的文件相同
+
+用法：python -m pytest test_render_server.py
+"""
+import io
+import json
+import threading
+import urllib.error
+import urllib.request
+import zipfile
+from urllib.parse import quote
+
+import pytest
+
+import md_to_jpg
+import render_server
+import txt_to_jpg
+
+TIMING_HEADERS = ['X-Page-Count', 'X-Queue-Time-Ms', 'X-Render-Time-Ms', 'X-Total-Time-Ms', 'Server-Timing']
+TEXT = "第一段，测试渲染服务。\n" * 12
+MARKDOWN = "# 标题\n\n正文有**粗体**和`代码`。\n\n- 列表项\n"
+
+
+@pytest.fixture(scope='module')
+def server():
+    render_server.CONFIG['access_log'] = False
+    server = render_server.RenderServer(('127.0.0.1', 0), workers=1, max_queue=1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def request(server, path, body=None):
+    """发送请求，返回 (状态码, 响应头, 响应内容)；错误状态码同样返回"""
+    url = f"http://127.0.0.1:{server.server_address[1]}{path}"
+    data = None if body is None else body.encode('utf-8')
+    headers = {'Content-Type': 'text/plain; charset=utf-8'} if body is not None else {}
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data, headers), timeout=60) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def test_health(server):
+    status, headers, body = request(server, '/health')
+    assert status == 200
+    assert headers['Content-Type'].startswith('application/json')
+    health = json.loads(body)
+    assert health['status'] == 'ok'
+    assert health['workers'] == 1
+    assert health['capacity'] == 2
+
+
+def test_render_zip_matches_file_conversion(server, tmp_path):
+    status, headers, body = request(server, f"/render?max_lines_per_page=5&name={quote('测试')}", TEXT)
+    assert status == 200
+    assert headers['Content-Type'] == 'application/zip'
+    for header in TIMING_HEADERS:
+        assert header in headers
+    assert float(headers['X-Total-Time-Ms']) >= float(headers['X-Render-Time-Ms'])
+
+    with zipfile.ZipFile(io.BytesIO(body)) as archive:
+        pages = {name: archive.read(name) for name in archive.namelist()}
+    assert int(headers['X-Page-Count']) == len(pages) > 1
+
+    # 与把同样内容写入文件再用脚本转换的结果逐字节相同
+    input_path = tmp_path / '测试.txt'
+    input_path.write_text(TEXT, encoding='utf-8')
+    options = render_server.CONFIG
+    txt_to_jpg.convert_txt_file(str(input_path), str(tmp_path), options['font_size'], options['bg_color'],
+                                options['text_color'], 5, False, render_backend=options['render_backend'])
+    assert pages == {name: (tmp_path / name).read_bytes() for name in pages}
+
+
+def test_render_single_page(server, tmp_path):
+    status, headers, body = request(server, '/render?kind=md&page=1&name=doc', MARKDOWN)
+    assert status == 200
+    assert headers['Content-Type'] == 'image/jpeg'
+    assert headers['X-Page-Count'] == '1'
+    for header in TIMING_HEADERS:
+        assert header in headers
+
+    input_path = tmp_path / 'doc.md'
+    input_path.write_text(MARKDOWN, encoding='utf-8')
+    options = render_server.CONFIG
+    md_to_jpg.convert_file(str(input_path), str(tmp_path), options['font_size'], options['bg_color'],
+                           options['text_color'], False, options['max_page_height'], options['render_backend'])
+    assert body == (tmp_path / 'doc.jpg').read_bytes()
+
+    status, _, _ = request(server, '/render?kind=md&page=2', MARKDOWN)
+    assert status == 404
+
+
+def test_bad_requests(server):
+    assert request(server, '/render?kind=pdf', TEXT)[0] == 400
+    assert request(server, '/render?font_size=1000', TEXT)[0] == 400
+    assert request(server, '/unknown')[0] == 404
+
+
+def test_full_server_returns_503(server):
+    # 占满所有名额（渲染中 + 排队中），之后的请求立即被拒绝
+    for _ in range(server.capacity):
+        assert server.slots.acquire(blocking=False)
+    try:
+        rejected = server.rejected
+        status, headers, body = request(server, '/render', TEXT)
+        assert status == 503
+        assert headers['Retry-After'] == '1'
+        assert 'error' in json.loads(body)
+        assert server.rejected == rejected + 1
+    finally:
+        for _ in range(server.capacity):
+            server.slots.release()
+
+    assert request(server, '/render', TEXT)[0] == 200
+
+
+def test_timeout_returns_504(server, monkeypatch):
+    monkeypatch.setitem(render_server.CONFIG, 'request_timeout', 0.001)
+    status, _, body = request(server, '/render?max_lines_per_page=2', TEXT * 4)
+    assert status == 504
+    assert 'error' in json.loads(body)
@@ -0,0 +1,52 @@
+"""
+text_encoding 的测试：常见中文编码（含没有BOM的 utf-16）都能正确识别
+
+用法：python -m pytest test_text_encoding.py
+"""
+import random
+
+import pytest
+
+from benchmark import make_cjk_prose, make_english_text
+from text_encoding import detect_encoding, read_text
+
+# 繁体常用字（big5 无法编码的简体字不能出现）
+TRADITIONAL_CHARS = '這個們來為國說時會對於著過發後裡種經麼學現當沒動還進樣實從開與無問關點長的一是不了在人有我他中上大和地到以要就出可也你，。、！？：；「」'
+
+
+@pytest.mark.parametrize('encoding', ['utf-16-le', 'utf-16-be'])
+def test_pure_cjk_utf16_without_bom(encoding, tmp_path):
+    data = '中文的测试，我们'.encode(encoding)
+    assert detect_encoding(data).encoding == encoding
+
+    path = tmp_path / 'utf16.txt'
+    path.write_bytes(make_cjk_prose(3000, random.Random(1)).encode(encoding))
+    text, guess = read_text(str(path))
+    assert guess.encoding == encoding
+    assert text == path.read_bytes().decode(encoding)
+
+
+@pytest.mark.parametrize('encoding', ['utf-16-le', 'utf-16-be'])
+def test_english_utf16_without_bom(encoding):
+    text = make_english_text(500, random.Random(2))
+    assert detect_encoding(text.encode(encoding)).encoding == encoding
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_common_encodings(seed):
+    rng = random.Random(seed)
+    length = rng.choice([20, 200, 3000])
+    simplified = make_cjk_prose(length, rng)
+    traditional = ''.join(rng.choice(TRADITIONAL_CHARS) for _ in range(length))
+    mixed = simplified[:length // 2] + make_english_text(length // 2, rng)
+
+    for text, encodings in ((simplified, ['utf-8', 'gbk', 'utf-16-le', 'utf-16-be']),
+                            (traditional, ['utf-8', 'big5', 'utf-16-le', 'utf-16-be']),
+                            (mixed, ['utf-8', 'gbk', 'utf-16-le', 'utf-16-be'])):
+        for encoding in encodings:
+            assert detect_encoding(text.encode(encoding)).encoding == encoding, (encoding, text[:20])
+
+
+def test_bom():
+    assert detect_encoding('中文'.encode('utf-16')).encoding == 'utf-16'
+    assert detect_encoding('中文'.encode('utf-8-sig')).encoding == 'utf-8-sig'
@@ -0,0 +1,227 @@
+"""
+text_layout 的测试：断行结果与逐字符测量的贪心换行一致，并且在大段中文语料上明显更快；
+文本宽度缓存按最久未使用的顺序淘汰，条目数不超过容量
+
+用法：python -m pytest test_text_layout.py
+"""
+import random
+import time
+
+import pytest
+from PIL import ImageFont
+
+import text_layout
+from benchmark import make_cjk_prose, make_english_text
+from font_registry import FONT_REGISTRY
+from txt_to_jpg import FORBIDDEN_END_CHARS, FORBIDDEN_START_CHARS, wrap_text_with_indent
+
+# 候选测试字体：按是否带字距调整分别取第一个可用的
+FONT_CANDIDATES = [
+    'DejaVuSansMono.ttf', 'simsun.ttc', 'msyh.ttc', 'DejaVuSans.ttf', 'DejaVuSerif.ttf',
+    'arial.ttf', 'LiberationSans-Regular.ttf', 'Arial.ttf', 'PingFang.ttc',
+]
+FONT_SIZE = 40
+MAX_WIDTH = 600
+
+
+def find_font(kerning):
+    """返回第一个（基础布局下）是否带字距调整与 kerning 相符的字体，找不到时跳过测试"""
+    for name in FONT_CANDIDATES:
+        path = FONT_REGISTRY.resolve(name)
+        if path is None:
+            continue
+        try:
+            font = ImageFont.truetype(path, FONT_SIZE, layout_engine=ImageFont.Layout.BASIC)
+        except OSError:
+            continue
+        if text_layout.font_has_kerning(font) == kerning:
+            return font
+    pytest.skip(f"没有找到{'带' if kerning else '不带'}字距调整的字体")
+
+
+def reference_wrap(text, font, max_width, forbidden_start=(), forbidden_end=()):
+    """
+    参照实现：逐字符调用 font.getlength(当前行 + 字符) 的贪心换行（每行至少一个字符），
+    放不下时回退到行内最靠后的合法断点（避头尾），行内没有合法断点时强制断行
+    """
+    lines = []
+    start = 0
+    n = len(text)
+    while start < n:
+        line = text[start]
+        end = start + 1
+        while end < n and font.getlength(line + text[end]) <= max_width:
+            line += text[end]
+            end += 1
+
+        if end < n:
+            legal = end
+            while legal > start and (text[legal] in forbidden_start or text[legal - 1] in forbidden_end):
+                legal -= 1
+            if legal > start:
+                end = legal
+        lines.append(text[start:end])
+        start = end
+    return lines
+
+
+def reference_wrap_with_indent(text, font, max_width, indent_chars="　　"):
+    """参照实现：与 wrap_text_with_indent 相同的分段和缩进，每段用 reference_wrap 换行"""
+    lines = []
+    for paragraph in text.split('\n'):
+        if not paragraph.strip():
+            lines.append("")
+            continue
+        lines.extend(reference_wrap(indent_chars + paragraph.strip(), font, max_width,
+                                    FORBIDDEN_START_CHARS, FORBIDDEN_END_CHARS))
+    return lines
+
+
+def make_corpus(char_count, seed=20240601):
+    """中文长文夹杂英文段落（英文用于触发字距调整），包含长于向量化阈值的段落"""
+    rng = random.Random(seed)
+    parts = []
+    while sum(map(len, parts)) < char_count:
+        parts.append(make_cjk_prose(rng.randint(50, 2000), rng))
+        if rng.random() < 0.3:
+            parts.append(make_english_text(rng.randint(50, 600), rng))
+        parts.append('\n\n')
+    return ''.join(parts)
+
+
+def reset_caches():
+    """清空字形宽度缓存和文本宽度缓存，计时从冷缓存开始"""
+    text_layout._advance_caches.clear()
+    text_layout.MEASURE_CACHE.clear()
+
+
+@pytest.mark.parametrize('kerning', [False, True])
+def test_break_text_matches_reference(kerning):
+    font = find_font(kerning)
+    reset_caches()
+    for paragraph in make_corpus(20000).split('\n'):
+        if not paragraph:
+            continue
+        assert text_layout.break_text(paragraph, font, MAX_WIDTH) == reference_wrap(paragraph, font, MAX_WIDTH)
+        assert (text_layout.break_text(paragraph, font, MAX_WIDTH, FORBIDDEN_START_CHARS, FORBIDDEN_END_CHARS) ==
+                reference_wrap(paragraph, font, MAX_WIDTH, FORBIDDEN_START_CHARS, FORBIDDEN_END_CHARS))
+
+
+@pytest.mark.parametrize('kerning', [False, True])
+def test_wrap_text_with_indent_matches_reference(kerning):
+    font = find_font(kerning)
+    reset_caches()
+    text = make_corpus(20000, seed=7)
+    assert wrap_text_with_indent(text, font, MAX_WIDTH) == reference_wrap_with_indent(text, font, MAX_WIDTH)
+
+
+def test_narrow_width_forces_single_characters():
+    font = find_font(False)
+    reset_caches()
+    text = '中文，测试。' * 50
+    assert text_layout.break_text(text, font, 1) == list(text)
+    assert text_layout.break_text(text, font, 1, FORBIDDEN_START_CHARS, FORBIDDEN_END_CHARS) == list(text)
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_pure_python_path_matches_numpy(monkeypatch, use_numpy):
+    if use_numpy and text_layout.np is None:
+        pytest.skip("没有安装NumPy")
+    if not use_numpy:
+        monkeypatch.setattr(text_layout, 'np', None)
+    font = find_font(False)
+    reset_caches()
+    text = make_corpus(5000, seed=3).replace('\n', '')
+    assert text_layout.break_text(text, font, MAX_WIDTH) == reference_wrap(text, font, MAX_WIDTH)
+
+
+def test_prefix_array_with_high_code_points():
+    if text_layout.np is None:
+        pytest.skip("没有安装NumPy")
+    font = find_font(False)
+    reset_caches()
+    cache = text_layout.get_advance_cache(font)
+    text = make_corpus(2000, seed=5).replace('\n', '') + '😀\U0010fffd'
+    assert cache.prefix_array(text).tolist() == cache.prefix_widths(text)
+    assert text_layout.break_text(text, font, MAX_WIDTH) == reference_wrap(text, font, MAX_WIDTH)
+
+
+def test_speedup_on_large_cjk_corpus():
+    font = find_font(False)
+    text = make_corpus(60000, seed=11)
+
+    reset_caches()
+    start = time.perf_counter()
+    expected = reference_wrap_with_indent(text, font, MAX_WIDTH)
+    reference_seconds = time.perf_counter() - start
+
+    reset_caches()
+    start = time.perf_counter()
+    lines = wrap_text_with_indent(text, font, MAX_WIDTH)
+    seconds = time.perf_counter() - start
+
+    assert lines == expected
+    print(f"\n逐字符测量 {reference_seconds:.3f}s, 前缀和断行 {seconds:.3f}s, "
+          f"加速 {reference_seconds / seconds:.1f}x")
+    assert seconds * 5 < reference_seconds
+
+
+class CountingFont:
+    """记录 getlength 调用次数的假字体（宽度为字符数）"""
+
+    def __init__(self):
+        self.calls = []
+
+    def getlength(self, text):
+        self.calls.append(text)
+        return float(len(text))
+
+
+def test_measure_cache_is_bounded_lru():
+    font = CountingFont()
+    cache = text_layout.MeasureCache(max_entries=3)
+    for text in ['a', 'bb', 'ccc', 'a', 'dddd']:
+        assert cache.length(font, text) == len(text)
+    # 'a' 刚被使用过，容量满时淘汰最久未使用的 'bb'
+    assert font.calls == ['a', 'bb', 'ccc', 'dddd']
+    assert cache.length(font, 'a') == 1
+    assert cache.length(font, 'bb') == 2
+    assert font.calls[-1] == 'bb'
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (2, 5, 2)
+    assert stats['entries'] == stats['max_entries'] == 3
+
+    # 缩小容量时按最久未使用的顺序淘汰
+    cache.resize(1)
+    assert cache.stats()['entries'] == 1
+    cache.length(font, 'bb')
+    assert cache.stats()['hits'] == 3
+
+
+def test_measure_cache_keys_include_font():
+    first, second = CountingFont(), CountingFont()
+    cache = text_layout.MeasureCache()
+    cache.length(first, 'text')
+    cache.length(second, 'text')
+    cache.length(first, 'text')
+    assert (first.calls, second.calls) == (['text'], ['text'])
+
+
+def test_zero_capacity_only_counts():
+    font = CountingFont()
+    cache = text_layout.MeasureCache(max_entries=0)
+    for _ in range(3):
+        cache.length(font, 'abc')
+    assert len(font.calls) == 3
+    assert cache.stats()['entries'] == 0
+    assert cache.stats()['misses'] == 3
+
+
+def test_text_length_goes_through_shared_cache():
+    font = CountingFont()
+    before = text_layout.measure_count()
+    assert text_layout.text_length(font, '共享缓存') == 4
+    assert text_layout.text_length(font, '共享缓存') == 4
+    assert len(font.calls) == 1
+    assert text_layout.measure_count() == before + 1
@@ -0,0 +1,221 @@
+"""
+txt_to_jpg 的测试：章节的字节范围与整篇读取的段落一致，章节标题变化后旧的子目录被清理；
+大文件流式转换时第一页在读完文件之前写出，内存占用不随文件大小增长；
+灰度蒙版加调色板上色的页面与直接在RGB画布上绘制的结果逐像素相同；
+页面并行渲染的输出与逐页渲染相同；只排版（dry run）报告的页面尺寸与实际生成的图片相同
+
+用法：python -m pytest test_txt_to_jpg.py
+"""
+import codecs
+import os
+import random
+import shutil
+import tracemalloc
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+import txt_to_jpg
+from benchmark import write_stress_file
+from build_manifest import write_file_atomic
+from font_registry import FONT_REGISTRY
+from text_layout import MEASURE_CACHE, set_measure_cache_size
+from txt_to_jpg import (CONFIG, convert_txt_file, create_image_from_lines, iter_text_paragraphs, layout_txt_file,
+                        split_chapters, txt_to_jpg_batch)
+
+NOVEL = (
+    "作者的话\n\n"
+    "第一章 初见\n　　正文第一段。\n\n　　正文第二段，「引号」。\n"
+    "第2章 再会\n　　这一章的正文。\n"
+    "第三回 结局\n　　最后一章。\n"
+)
+NOVEL_TRADITIONAL = (
+    "作者的話\n\n"
+    "第一章 初見\n　　正文第一段。\n\n　　正文第二段，「引號」。\n"
+    "第2章 再會\n　　這一章的正文。\n"
+    "第三回 結局\n　　最後一章。\n"
+)
+
+
+def write_novel(path, text, encoding, newline='\n', bom=b''):
+    with open(path, 'wb') as file:
+        file.write(bom + text.replace('\n', newline).encode(encoding))
+
+
+@pytest.mark.parametrize('encoding, bom', [
+    ('utf-8', b''), ('utf-8', codecs.BOM_UTF8), ('gbk', b''), ('big5', b''),
+    ('utf-16-le', b''), ('utf-16-be', b''), ('utf-16-le', codecs.BOM_UTF16_LE), ('utf-16-be', codecs.BOM_UTF16_BE),
+])
+@pytest.mark.parametrize('newline', ['\n', '\r\n', '\r'])
+def test_chapter_ranges_match_whole_file(tmp_path, encoding, bom, newline):
+    text = NOVEL_TRADITIONAL if encoding == 'big5' else NOVEL
+    path = str(tmp_path / 'novel.txt')
+    write_novel(path, text, encoding, newline, bom)
+
+    range_encoding, chapters = split_chapters(path, CONFIG['chapter_pattern'])
+    assert [name.split('_')[0] for name, _, _ in chapters] == ['000', '001', '002', '003']
+
+    paragraphs = []
+    for _, start, end in chapters:
+        paragraphs.extend(iter_text_paragraphs(path, range_encoding, start, end))
+    assert paragraphs == text.split('\n')
+
+
+def test_no_headings(tmp_path):
+    path = str(tmp_path / 'plain.txt')
+    write_novel(path, "没有章节标题的文字\n第二行\n", 'utf-8')
+    assert split_chapters(path, CONFIG['chapter_pattern'])[1] == []
+
+
+def test_blank_preface_is_dropped(tmp_path):
+    path = str(tmp_path / 'novel.txt')
+    write_novel(path, "\n\n第一章 开始\n正文\n", 'utf-8')
+    encoding, chapters = split_chapters(path, CONFIG['chapter_pattern'])
+    assert [name for name, _, _ in chapters] == ['001_第一章 开始']
+    assert list(iter_text_paragraphs(path, encoding, *chapters[0][1:])) == ['第一章 开始', '正文', '']
+
+
+def test_stale_chapter_dirs_are_removed(tmp_path):
+    input_dir = tmp_path / 'in'
+    output_dir = tmp_path / 'out'
+    input_dir.mkdir()
+    options = dict(incremental=True, move_to_backup=False, chapter_pattern=CONFIG['chapter_pattern'])
+
+    write_novel(str(input_dir / 'novel.txt'), NOVEL, 'utf-8')
+    txt_to_jpg_batch(str(input_dir), str(output_dir), str(tmp_path / 'bak'), **options)
+    assert sorted(os.listdir(output_dir / 'novel')) == ['000_开头', '001_第一章 初见', '002_第2章 再会', '003_第三回 结局']
+
+    write_novel(str(input_dir / 'novel.txt'), NOVEL.replace('第2章 再会', '第2章 重逢'), 'utf-8')
+    txt_to_jpg_batch(str(input_dir), str(output_dir), str(tmp_path / 'bak'), **options)
+    assert sorted(os.listdir(output_dir / 'novel')) == ['000_开头', '001_第一章 初见', '002_第2章 重逢', '003_第三回 结局']
+
+    options['chapter_pattern'] = None
+    txt_to_jpg_batch(str(input_dir), str(output_dir), str(tmp_path / 'bak'), **options)
+    assert not (output_dir / 'novel').exists()
+
+
+def test_streaming_conversion(tmp_path, monkeypatch):
+    # 光栅化和编码换成写空文件：这里只检查流水线是否逐页进行，与页面内容无关
+    def fake_render_page(page_lines, output_path, *args):
+        write_file_atomic(b'', output_path)
+        return 0, {'timings': {}}
+    monkeypatch.setattr(txt_to_jpg, 'render_page', fake_render_page)
+
+    # 记录第一页写出时已经读出的段落数
+    progress = {}
+    read_paragraphs = txt_to_jpg.iter_text_paragraphs
+
+    def tracked_paragraphs(input_path, *args):
+        first_page = os.path.join(os.path.dirname(input_path), 'out', 'large_页1.jpg')
+        for count, paragraph in enumerate(read_paragraphs(input_path, *args), 1):
+            if 'first_page' not in progress and os.path.exists(first_page):
+                progress['first_page'] = count
+            progress['total'] = count
+            yield paragraph
+    monkeypatch.setattr(txt_to_jpg, 'iter_text_paragraphs', tracked_paragraphs)
+
+    def convert(byte_count):
+        path = tmp_path / 'large.txt'
+        write_stress_file(str(path), byte_count, random.Random(byte_count))
+        output_dir = tmp_path / 'out'
+        shutil.rmtree(output_dir, ignore_errors=True)
+        output_dir.mkdir()
+        progress.clear()
+        MEASURE_CACHE.clear()
+        tracemalloc.start()
+        try:
+            pages = convert_txt_file(str(path), str(output_dir), verbose=False)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert len(pages) > 20
+        # 第一页在读完文件的前10%之前就已写出
+        assert progress['first_page'] < progress['total'] / 10
+        return peak
+
+    # 文本宽度缓存是有界的LRU，用较小的容量让它在小文件中就已经填满
+    MEASURE_CACHE.resize(500)
+    try:
+        small_peak = convert(256 << 10)
+        large_peak = convert(1 << 20)
+    finally:
+        set_measure_cache_size(None)
+    # 内存占用不随文件大小增长
+    assert large_peak < (1 << 20) / 2
+    assert large_peak < small_peak * 1.5
+
+
+PAGE_LINES = ['　　第一段，测试「引号」和标点。', 'Kerning AV To Wa ffi gjpqy', '', '　　……（括号）ÅÉÎ 最后一行。']
+COLOR_PAIRS = [
+    ((255, 255, 255), (0, 0, 0)),
+    ((20, 20, 20), (230, 230, 230)),
+    ((250, 240, 220), (200, 30, 60)),
+    ('navy', 'yellow'),
+]
+
+
+@pytest.mark.parametrize('font_name', [None, 'DejaVuSans.ttf'])
+@pytest.mark.parametrize('bg_color, text_color', COLOR_PAIRS)
+def test_palette_page_matches_rgb_draw(font_name, bg_color, text_color):
+    size = 52
+    if font_name is None:
+        font = txt_to_jpg.load_font(size)
+    else:
+        path = FONT_REGISTRY.resolve(font_name)
+        if path is None:
+            pytest.skip(f"没有找到字体 {font_name}")
+        font = ImageFont.truetype(path, size)
+    ascent, descent = font.getmetrics()
+    margin, width, height = 30, 900, 400
+
+    # 行高足够时走蒙版加调色板；行高小于字形高度时相邻行重叠，走RGB直接绘制
+    for line_height in (int(size * 1.6), ascent + descent, ascent + descent - 1, max(ascent // 2, 1)):
+        expected = Image.new('RGB', (width, height), bg_color)
+        draw = ImageDraw.Draw(expected)
+        for i, line in enumerate(PAGE_LINES):
+            if line.strip():
+                draw.text((margin, 40 + i * line_height), line, font=font, fill=text_color)
+
+        for render_backend in ('draw', 'atlas'):
+            for color_mode in ('RGB', 'P'):
+                image = create_image_from_lines(PAGE_LINES, font, width, height, margin, bg_color, text_color,
+                                                line_height, render_backend, color_mode)
+                assert image.convert('RGB').tobytes() == expected.tobytes(), (line_height, render_backend, color_mode)
+
+
+def read_outputs(directory):
+    return {name: (directory / name).read_bytes() for name in os.listdir(directory)}
+
+
+@pytest.mark.parametrize('page_executor, render_backend', [('thread', 'draw'), ('thread', 'atlas'), ('process', 'draw')])
+def test_parallel_pages_match_serial(tmp_path, page_executor, render_backend):
+    path = tmp_path / '并行.txt'
+    path.write_text(NOVEL * 20, encoding='utf-8')
+    (tmp_path / 'serial').mkdir()
+    (tmp_path / 'parallel').mkdir()
+
+    serial = convert_txt_file(str(path), str(tmp_path / 'serial'), max_lines_per_page=8, verbose=False,
+                              render_backend=render_backend)
+    parallel = convert_txt_file(str(path), str(tmp_path / 'parallel'), max_lines_per_page=8, verbose=False,
+                                page_workers=3, page_executor=page_executor, render_backend=render_backend)
+    # 文件名按页码顺序排列，内容逐字节相同
+    assert parallel == serial
+    assert [name for name, _ in serial] == [f'并行_页{page_num}.jpg' for page_num in range(1, len(serial) + 1)]
+    assert len(serial) > 3
+    assert read_outputs(tmp_path / 'parallel') == read_outputs(tmp_path / 'serial')
+
+
+def test_dry_run_matches_rendered_pages(tmp_path):
+    path = tmp_path / '排版.txt'
+    path.write_text(NOVEL * 10 + "很长的一段" * 200 + "\n", encoding='gbk')
+
+    report = layout_txt_file(str(path), max_lines_per_page=12)
+    results = convert_txt_file(str(path), str(tmp_path), max_lines_per_page=12, verbose=False)
+    assert report['encoding'] == 'gbk'
+    assert report['pages'] == len(results)
+    sizes = []
+    for name, _ in results:
+        with Image.open(tmp_path / name) as image:
+            sizes.append(list(image.size))
+    assert report['page_sizes'] == sizes
+    assert report['max_page_height'] == max(height for _, height in sizes)
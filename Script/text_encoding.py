@@ -0,0 +1,163 @@
+"""
+文本编码检测：只读一次文件，先检查BOM，再在有限长度的样本上给候选编码打分
+
+原来的做法是按 utf-8、gbk、gb2312、big5、utf-16 的顺序反复打开并完整解码文件，
+直到某个编码不报错为止，错误的解码结果也会被静默接受。
+这里只对文件开头的样本做尝试解码和打分，选出编码后整个文件只解码一次。
+"""
+import codecs
+import mmap
+import os
+import unicodedata
+from collections import namedtuple
+
+# 参与打分的样本大小（字节）
+SAMPLE_SIZE = 64 * 1024
+
+# 超过该大小的文件用内存映射读取
+MMAP_THRESHOLD = 1024 * 1024
+
+# 候选编码，按原脚本的尝试顺序排列（分数相同时靠前的优先；gb2312 是 gbk 的子集，不再单独尝试）
+CANDIDATE_ENCODINGS = ['utf-8', 'gbk', 'big5', 'utf-16-le', 'utf-16-be']
+
+# BOM -> 编码（utf-32 的BOM以utf-16的BOM开头，需要先检查）
+BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# 简体、繁体中文里最常用的字，用来区分 gbk 与 big5（用错编码时几乎不会出现这些字）
+COMMON_CHARS = set(
+    '的一是不了在人有我他这个们中来上大为和国地到以说时要就出会可也你对生能而子那得于着下自之年过发后作里用道行所然家种事成方多经么去法学如都同现当没动面起看定天分还进好小部其些主样理心她本前开但因只从想实日'
+    '這個們來為國說時會對於著過發後裡種經麼學現當沒動還進樣實從開與無問關點長'
+    '，。、！？：；“”‘’（）《》「」『』…—'
+)
+
+EncodingGuess = namedtuple('EncodingGuess', ['encoding', 'confidence', 'candidates'])
+
+
+def _decode_sample(sample, encoding):
+    """
+    严格解码样本；样本末尾可能截断在多字节字符中间，因此不要求最后一个字符完整
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='strict')
+    try:
+        return decoder.decode(sample, final=False)
+    except UnicodeDecodeError:
+        return None
+
+
+def _score_text(text):
+    """
+    给解码结果打分：常用汉字和标点越多越高，控制字符、私用区、未分配码位越多越低
+    """
+    non_ascii = 0
+    common = 0
+    bad = 0
+    for char in text:
+        if char < '\x80':
+            if char < ' ' and char not in '\t\n\r\f':
+                bad += 1
+            continue
+        non_ascii += 1
+        if char in COMMON_CHARS:
+            common += 1
+        elif unicodedata.category(char) in ('Cc', 'Co', 'Cn', 'Cs') or char == '\ufffd':
+            bad += 1
+
+    if non_ascii == 0:
+        return 1.0 if bad == 0 else 0.0
+    return max(0.0, 1.0 + 4.0 * common / non_ascii - 10.0 * bad / max(len(text), 1))
+
+
+def detect_encoding(data):
+    """
+    检测字节数据的编码
+
+    Returns:
+        EncodingGuess(encoding, confidence, candidates)：
+        candidates 为样本能解码的所有候选编码（按可能性从高到低），
+        整个文件在首选编码下解码失败时可依次改用后面的编码
+    """
+    sample = bytes(data[:SAMPLE_SIZE])
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return EncodingGuess(encoding, 1.0, [encoding])
+
+    # 零字节多说明很可能是没有BOM的 utf-16（西文为主的文本），零字节在偶数位置为大端、奇数位置为小端；
+    # 纯中文的 utf-16 文本几乎没有零字节，只能靠打分识别，所以 utf-16 始终参与尝试
+    nul_counts = {'utf-16-le': sample[1::2].count(0), 'utf-16-be': sample[0::2].count(0)}
+    nul_endian = max(nul_counts, key=nul_counts.get)
+    if nul_counts[nul_endian] <= len(sample) // 20 or len(set(nul_counts.values())) == 1:
+        nul_endian = None
+
+    scored = []
+    for order, encoding in enumerate(CANDIDATE_ENCODINGS):
+        text = _decode_sample(sample, encoding)
+        if text is None:
+            continue
+        score = _score_text(text)
+        # 含非ASCII字符又能按utf-8严格解码的文本几乎一定是utf-8
+        if encoding == 'utf-8' and not sample.isascii():
+            score += 2.0
+        if encoding == nul_endian:
+            score += 1.0
+        scored.append((score, -order, encoding, text))
+
+    if not scored:
+        return EncodingGuess(None, 0.0, [])
+
+    scored.sort(reverse=True)
+    best, _, best_encoding, best_text = scored[0]
+    # 解码结果相同的编码（如纯ASCII样本）不算竞争者
+    second = max((score for score, _, _, text in scored[1:] if text != best_text), default=0.0)
+    confidence = best / (best + second) if best > 0 else 0.0
+    return EncodingGuess(best_encoding, round(confidence, 3), [encoding for _, _, encoding, _ in scored])
+
+
+def sniff_file_encoding(path):
+    """
+    只读取文件开头的样本来检测编码（用于流式读取的场景）
+    """
+    with open(path, 'rb') as file:
+        return detect_encoding(file.read(SAMPLE_SIZE))
+
+
+def read_text(path):
+    """
+    读取并解码文本文件：文件只读取一次（大文件使用内存映射），按检测出的编码只解码一次
+
+    Returns:
+        (文本, EncodingGuess)；无法解码时抛出异常
+    """
+    file_size = os.path.getsize(path)
+    if file_size == 0:
+        raise Exception("无法解码文件")
+
+    with open(path, 'rb') as file:
+        if file_size > MMAP_THRESHOLD:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            data = file.read()
+
+        try:
+            guess = detect_encoding(data)
+            for encoding in guess.candidates:
+                try:
+                    text = codecs.decode(data, encoding)
+                except UnicodeDecodeError:
+                    # 样本之后的内容不符合该编码，改用下一个候选
+                    continue
+                if not text:
+                    break
+                if encoding != guess.encoding:
+                    guess = EncodingGuess(encoding, 0.0, guess.candidates)
+                return text, guess
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+    raise Exception("无法解码文件")
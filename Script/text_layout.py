@@ -0,0 +1,403 @@
+"""
+文本排版引擎：字形宽度缓存与基于前缀和的断行
+
+每个字体（路径、字号、索引）只测量一次每个不同的字符，
+断行时用前缀和直接定位断点，避免逐字符调用 font.getlength 造成的 O(n²) 开销。
+安装了NumPy时，长段落整段向量化计算断点（searchsorted），否则回退到纯Python实现。
+避头尾规则在断行的同一遍中处理：先标出所有合法断点，每行在放得下的范围内取最靠后的合法断点，
+因此不会产生超宽的行。
+所有文本宽度测量都经过一个有界的LRU缓存（按字体和文本），换行、高度计算和绘制中重复的测量只做一次。
+"""
+import bisect
+import functools
+import itertools
+import re
+import struct
+import threading
+from collections import OrderedDict
+
+from PIL import ImageFont
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 按字体缓存的字形宽度表
+_advance_caches = {}
+
+# 段落长度达到该字符数时才使用NumPy批量断行（短文本的数组开销不划算）
+VECTORIZE_MIN_CHARS = 256
+
+# 文本宽度缓存默认最多保存的条目数（约每条百余字节加上文本本身）
+DEFAULT_MEASURE_CACHE_SIZE = 65536
+
+
+class MeasureCache:
+    """
+    有界的文本宽度缓存（LRU）：键为 (字体对象, 文本)，超过容量时淘汰最久未使用的条目
+
+    线程安全；每个进程各有一份。max_entries 为0时不缓存（只统计测量次数）。
+    """
+
+    def __init__(self, max_entries=DEFAULT_MEASURE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def length(self, font, text):
+        """返回文本宽度，未缓存时调用 font.getlength 测量"""
+        key = (font, text)
+        with self._lock:
+            width = self._entries.get(key)
+            if width is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return width
+            self.misses += 1
+
+        width = font.getlength(text)
+        with self._lock:
+            if self.max_entries > 0:
+                self._entries[key] = width
+                self._trim()
+        return width
+
+    def _trim(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def resize(self, max_entries):
+        """修改容量，多出的条目按最久未使用的顺序淘汰"""
+        with self._lock:
+            self.max_entries = max_entries
+            self._trim()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """返回条目数、容量、命中、测量、淘汰次数和命中率"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+# 进程内共享的文本宽度缓存
+MEASURE_CACHE = MeasureCache()
+
+
+def text_length(font, text):
+    """
+    测量文本宽度（经过 MEASURE_CACHE，相同字体和文本只调用一次 font.getlength）
+    """
+    return MEASURE_CACHE.length(font, text)
+
+
+def measure_count():
+    """返回本进程中实际调用 font.getlength 的累计次数（缓存未命中的次数）"""
+    return MEASURE_CACHE.misses
+
+
+def set_measure_cache_size(max_entries):
+    """设置文本宽度缓存的容量（None 表示使用默认值）"""
+    MEASURE_CACHE.resize(DEFAULT_MEASURE_CACHE_SIZE if max_entries is None else max_entries)
+
+
+def init_worker(font_loaders, hd_font_size, measure_cache_size=None):
+    """
+    进程池工作进程初始化：设置文本宽度缓存容量，并用 font_loaders 中的每个函数预先加载该字号的字体
+
+    fork 出的进程会继承主进程已预热的宽度缓存，先清空，使每个进程统计到的测量次数
+    与 spawn 启动（Windows）时一致，不会因为主进程先转换过文件而变成0。
+    """
+    MEASURE_CACHE.clear()
+    _advance_caches.clear()
+    set_measure_cache_size(measure_cache_size)
+    for load_font in font_loaders:
+        load_font(hd_font_size)
+
+
+def format_measure_stats(stats):
+    """文本宽度缓存统计的单行描述"""
+    return (f"测量缓存: 命中率 {stats['hit_rate']:.1%}, 命中 {stats['hits']} 次, 测量 {stats['misses']} 次, "
+            f"淘汰 {stats['evictions']} 次, {stats['entries']}/{stats['max_entries']} 项")
+
+
+def _read_font_tables(path, index=0):
+    """
+    读取TrueType/OpenType字体的表目录，返回表名集合；无法解析时返回None
+    """
+    try:
+        with open(path, 'rb') as file:
+            header = file.read(12)
+            if header[:4] == b'ttcf':
+                # TTC字体集合：先定位到第index个字体
+                num_fonts = struct.unpack('>I', header[8:12])[0]
+                if index >= num_fonts:
+                    return None
+                file.seek(12 + 4 * index)
+                offset = struct.unpack('>I', file.read(4))[0]
+                file.seek(offset)
+                header = file.read(12)
+            num_tables = struct.unpack('>H', header[4:6])[0]
+            directory = file.read(16 * num_tables)
+    except (OSError, struct.error):
+        return None
+
+    return {directory[i * 16:i * 16 + 4] for i in range(num_tables)}
+
+
+def font_has_kerning(font):
+    """
+    判断字体测量结果是否可能受字距调整影响（此时不能简单地累加单字宽度）
+    """
+    # Raqm布局会做字形整形，保守处理
+    if getattr(font, 'layout_engine', None) != ImageFont.Layout.BASIC:
+        return True
+
+    path = getattr(font, 'path', None)
+    if not isinstance(path, str):
+        return True
+
+    # 基础布局只使用kern表做字距调整
+    tables = _read_font_tables(path, getattr(font, 'index', 0))
+    return tables is None or b'kern' in tables
+
+
+def font_key(font):
+    """
+    生成字体的缓存键：(路径, 字号, 索引, 布局引擎)
+    """
+    path = getattr(font, 'path', None)
+    if isinstance(path, str):
+        return (path, font.size, getattr(font, 'index', 0), getattr(font, 'layout_engine', None))
+    # 无路径的字体（如默认字体）按对象区分，缓存中持有字体引用保证id不被复用
+    return ('id', id(font))
+
+
+class GlyphAdvanceCache:
+    """
+    单个字体的字形宽度缓存
+    """
+
+    def __init__(self, font):
+        self.font = font
+        self.advances = {}
+        self.has_kerning = font_has_kerning(font)
+
+    def advance(self, char):
+        """获取单个字符的宽度"""
+        width = self.advances.get(char)
+        if width is None:
+            width = text_length(self.font, char)
+            self.advances[char] = width
+        return width
+
+    def prefix_widths(self, text):
+        """
+        计算前缀宽度，返回长度为 len(text)+1 的列表，prefix[i] 为 text[:i] 的宽度
+        """
+        advances = self.advances
+        for char in set(text).difference(advances):
+            advances[char] = text_length(self.font, char)
+        return [0.0] + list(itertools.accumulate(advances[char] for char in text))
+
+    def prefix_array(self, text):
+        """
+        NumPy版前缀宽度：把段落中出现过的不同字符映射到宽度，得到整段的宽度数组，再做累加
+        """
+        codes = np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+
+        # 宽度表只按不同字符的个数分配（不按最大码位，避免一个emoji就分配上百万项）
+        unique_codes, inverse = np.unique(codes, return_inverse=True)
+        table = np.array([self.advance(chr(code)) for code in unique_codes.tolist()], dtype=np.float64)
+
+        prefix = np.empty(len(text) + 1, dtype=np.float64)
+        prefix[0] = 0.0
+        np.cumsum(table[inverse], out=prefix[1:])
+        return prefix
+
+    def line_end(self, text, prefix, start, max_width, min_end=None):
+        """
+        从 start 开始贪心放置字符，返回本行结束位置（不含）
+
+        与逐字符调用 font.getlength(current_line + char) 的结果一致：
+        本行为能放下的最长前缀，但至少包含到 min_end（默认至少一个字符）。
+        """
+        n = len(text)
+        if min_end is None:
+            min_end = start + 1
+
+        # 用前缀和二分定位断点
+        end = bisect.bisect_right(prefix, prefix[start] + max_width, start, n + 1) - 1
+        end = _fit_end(prefix, start, end, max_width, n)
+
+        # 字体带字距调整时，以真实测量结果为准
+        if self.has_kerning:
+            font = self.font
+            end = _measured_end(lambda s, e: text_length(font, text[s:e]), start, end, max_width, n)
+
+        return min(max(end, min_end), n)
+
+
+def _measured_end(line_width, start, end, max_width, n):
+    """
+    以真实测量的行宽修正按前缀和估计的断点：line_width(start, end) 为 [start, end) 这一行的宽度
+    """
+    while end > start and line_width(start, end) > max_width:
+        end -= 1
+    while end < n and line_width(start, end + 1) <= max_width:
+        end += 1
+    return end
+
+
+def _fit_end(prefix, start, end, max_width, n):
+    """
+    按前缀宽度的差值精确修正断点，消除 prefix[start] + max_width 的浮点舍入影响
+    """
+    base = prefix[start]
+    while end < n and prefix[end + 1] - base <= max_width:
+        end += 1
+    while end > start and prefix[end] - base > max_width:
+        end -= 1
+    return end
+
+
+@functools.lru_cache(maxsize=None)
+def _char_class_pattern(chars):
+    # 字符集合对应的正则字符类，用于一次扫描找出所有避头/避尾字符
+    return re.compile('[' + ''.join(re.escape(char) for char in sorted(chars)) + ']')
+
+
+def break_opportunities(text, forbidden_start, forbidden_end):
+    """
+    标出文本中的合法断点（避头尾规则）
+
+    Returns:
+        长度为 len(text)+1 的 bytearray，allowed[i] 为1表示可以在 text[i] 之前断行，
+        即 text[i] 不是避头字符且 text[i-1] 不是避尾字符
+    """
+    allowed = bytearray(b'\x01') * (len(text) + 1)
+    if forbidden_start:
+        for match in _char_class_pattern(frozenset(forbidden_start)).finditer(text):
+            allowed[match.start()] = 0
+    if forbidden_end:
+        for match in _char_class_pattern(frozenset(forbidden_end)).finditer(text):
+            allowed[match.end()] = 0
+    return allowed
+
+
+def _legal_end(allowed, start, end, n):
+    """
+    把断点回退到 (start, end] 中最靠后的合法断点；没有合法断点时保持原位（强制断行）
+    """
+    if end >= n or allowed[end]:
+        return end
+    legal = allowed.rfind(1, start + 1, end)
+    return legal if legal > 0 else end
+
+
+def get_advance_cache(font):
+    """
+    获取字体对应的字形宽度缓存，同一(路径, 字号, 索引)共享一份
+    """
+    key = font_key(font)
+    cache = _advance_caches.get(key)
+    if cache is None:
+        cache = GlyphAdvanceCache(font)
+        _advance_caches[key] = cache
+    return cache
+
+
+def paragraph_breaks(text, font, max_width, allowed=None):
+    """
+    计算整段文本的全部断点，返回 [0, b1, b2, ..., len(text)]，每行至少一个字符
+
+    字体无字距调整且装有NumPy时，一次 searchsorted 求出每个起点能放下的最远终点，
+    之后只需沿断点链逐行跳转；否则逐行二分查找。
+    allowed 为 break_opportunities() 的结果时，每行在放得下的范围内回退到最近的合法断点
+    （行内没有合法断点时仍在最远处强制断行），行宽不会超过 max_width。
+    """
+    cache = get_advance_cache(font)
+    n = len(text)
+    breaks = [0]
+
+    if np is not None and not cache.has_kerning and n >= VECTORIZE_MIN_CHARS:
+        prefix = cache.prefix_array(text)
+        farthest = np.searchsorted(prefix, prefix + max_width, side='right') - 1
+
+        # 按差值精确修正浮点边界（与 _fit_end 相同，整体向量化进行）
+        while True:
+            step = (farthest < n) & (prefix[np.minimum(farthest + 1, n)] - prefix <= max_width)
+            if not step.any():
+                break
+            farthest += step
+        while True:
+            step = prefix[farthest] - prefix > max_width
+            if not step.any():
+                break
+            farthest -= step
+
+        start = 0
+        while start < n:
+            end = min(max(farthest.item(start), start + 1), n)
+            start = end if allowed is None else _legal_end(allowed, start, end, n)
+            breaks.append(start)
+        return breaks
+
+    prefix = cache.prefix_widths(text)
+    start = 0
+    while start < n:
+        end = cache.line_end(text, prefix, start, max_width)
+        start = end if allowed is None else _legal_end(allowed, start, end, n)
+        breaks.append(start)
+    return breaks
+
+
+def prefix_breaks(prefix, max_width, allowed=None, line_width=None):
+    """
+    按已算好的前缀宽度断行（如多种字体混排的文本），返回 [0, b1, ..., n]，每行至少一个字符
+
+    allowed 的含义同 paragraph_breaks。
+    line_width(start, end) 给出时，每行再以它测得的真实宽度修正断点
+    （前缀和无法表示的部分，如字距调整、随行变化的装饰宽度），与 GlyphAdvanceCache.line_end 的复核相同
+    """
+    n = len(prefix) - 1
+    breaks = [0]
+    start = 0
+    while start < n:
+        end = bisect.bisect_right(prefix, prefix[start] + max_width, start, n + 1) - 1
+        end = _fit_end(prefix, start, end, max_width, n)
+        if line_width is not None:
+            end = _measured_end(line_width, start, end, max_width, n)
+        end = min(max(end, start + 1), n)
+        start = end if allowed is None else _legal_end(allowed, start, end, n)
+        breaks.append(start)
+    return breaks
+
+
+def break_text(text, font, max_width, forbidden_start=None, forbidden_end=None):
+    """
+    将一段文本按最大宽度贪心断行，返回行列表（每行至少一个字符）
+
+    给出避头/避尾字符集合时同时应用避头尾规则：避头字符不会出现在行首、避尾字符不会出现在行尾
+    （整行都无法合法断开时除外）
+    """
+    allowed = None
+    if forbidden_start or forbidden_end:
+        allowed = break_opportunities(text, forbidden_start, forbidden_end)
+    breaks = paragraph_breaks(text, font, max_width, allowed)
+    return [text[start:end] for start, end in zip(breaks, breaks[1:])]
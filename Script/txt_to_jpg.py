@@ -1,8 +1,28 @@
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageColor, ImageDraw
 import textwrap
 import os
 import shutil
+import codecs
+import io
+import itertools
 import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from contextlib import nullcontext
+
+from build_manifest import (BuildManifest, config_hash, file_hash, font_identity, page_hash, remove_outputs,
+                            write_file_atomic)
+from directory_watcher import DirectoryWatcher
+from font_registry import FONT_REGISTRY
+from glyph_atlas import GLYPH_ATLAS, format_atlas_stats, get_text_drawer
+from layout_report import file_report, print_layout_summary, write_layout_report
+from page_encoders import JpegEncoder, format_encode_stats, get_encoder
+from pipeline_metrics import BatchMetrics, FileMetrics, run_profiled
+from text_encoding import sniff_file_encoding
+from text_layout import (MEASURE_CACHE, break_text, format_measure_stats, init_worker, measure_count,
+                         set_measure_cache_size)
 
 # 避头尾字符定义
 FORBIDDEN_START_CHARS = set('，,。.、！!？?：:；;”\'）]}》›»〉》〗】〕》」』】〗〞〟〉》›»〗〞〟"\'》›»}])）')
@@ -20,174 +40,83 @@ def get_chinese_font(font_size=20):
         "/System/Library/Fonts/PingFang.ttc",
         "/System/Library/Fonts/STHeiti Light.ttc",
         "/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf",
+        "NotoSansCJK-Regular.ttc",          # 以下按文件名在系统字体目录中查找
+        "wqy-microhei.ttc",
     ]
     
-    for font_path in font_paths:
-        if os.path.exists(font_path):
-            try:
-                return ImageFont.truetype(font_path, font_size)
-            except:
-                continue
+    # 字体注册表只探测一次路径，已加载的字体直接复用
+    font = FONT_REGISTRY.load_first(font_paths, font_size)
+    if font is not None:
+        return font
     
     try:
-        return ImageFont.load_default()
+        return FONT_REGISTRY.load_default()
     except:
         raise Exception("无法找到支持中文的字体")
 
-def is_forbidden_start_char(char):
-    """检查字符是否为避头字符"""
-    return char in FORBIDDEN_START_CHARS
-
-def is_forbidden_end_char(char):
-    """检查字符是否为避尾字符"""
-    return char in FORBIDDEN_END_CHARS
-
-def wrap_text_with_indent_and_kinsoku(text, font, max_width, indent_chars="　　"):
+def wrap_text_with_indent(text, font, max_width, indent_chars="　　"):
     """
-    智能文本换行，支持段首缩进2个全角空格和中文避头尾规则
+    智能文本换行，支持段首缩进2个全角空格和避头尾规则
     """
-    lines = []
-    paragraphs = text.split('\n')
+    return list(iter_wrapped_lines(text.split('\n'), font, max_width, indent_chars))
+
+def iter_wrapped_lines(paragraphs, font, max_width, indent_chars="　　"):
+    """
+    逐段换行，按顺序产出每一行
     
+    避头尾规则在断行时一并处理：每行取放得下的范围内最靠后的合法断点，不会产生超宽的行
+    """
     for paragraph in paragraphs:
         if not paragraph.strip():  # 空行
-            lines.append("")
+            yield ""
             continue
             
         # 段首添加2个全角空格
         current_text = indent_chars + paragraph.strip()
         
-        # 处理避头尾规则的换行
-        current_line = ""
-        char_list = list(current_text)
-        i = 0
-        
-        while i < len(char_list):
-            char = char_list[i]
-            
-            # 测试添加当前字符后的行宽
-            test_line = current_line + char
-            line_width = font.getlength(test_line)
-            
-            if line_width <= max_width:
-                current_line = test_line
-                i += 1
-            else:
-                # 需要换行，检查避头尾规则
-                if current_line:
-                    # 检查当前行尾字符是否为避尾字符
-                    if current_line and is_forbidden_end_char(current_line[-1]):
-                        # 避尾字符不能出现在行尾，需要调整
-                        if i < len(char_list) and not is_forbidden_start_char(char_list[i]):
-                            # 将避尾字符移到下一行
-                            last_char = current_line[-1]
-                            current_line = current_line[:-1]
-                            lines.append(current_line)
-                            current_line = last_char + char
-                            i += 1
-                        else:
-                            # 无法调整，强制换行
-                            lines.append(current_line)
-                            current_line = char
-                            i += 1
-                    else:
-                        # 正常换行
-                        lines.append(current_line)
-                        current_line = char
-                        i += 1
-                else:
-                    # 单个字符就超宽，强制换行
-                    lines.append(char)
-                    current_line = ""
-                    i += 1
-        
-        # 处理剩余内容
-        if current_line:
-            # 检查行首是否为避头字符
-            if current_line and is_forbidden_start_char(current_line[0]):
-                if lines:
-                    # 尝试将避头字符移到上一行
-                    last_line = lines[-1]
-                    if last_line and not is_forbidden_end_char(last_line[-1]):
-                        # 可以移动
-                        lines[-1] = last_line + current_line[0]
-                        current_line = current_line[1:]
-            
-            if current_line:
-                lines.append(current_line)
-    
-    return lines
+        # 每个字符只测量一次，用前缀和定位断点
+        yield from break_text(current_text, font, max_width, FORBIDDEN_START_CHARS, FORBIDDEN_END_CHARS)
 
-def apply_kinsoku_rules(lines):
-    """
-    对已经换行的文本应用避头尾规则进行后处理
-    """
-    adjusted_lines = []
+class _RangeReader(io.RawIOBase):
+    """只读取文件中 [start, end) 字节范围的原始读取器，end 为None时读到文件末尾"""
     
-    for i in range(len(lines)):
-        current_line = lines[i]
-        
-        if not current_line.strip():
-            adjusted_lines.append(current_line)
-            continue
-            
-        # 检查行首避头字符
-        if is_forbidden_start_char(current_line[0]):
-            if i > 0 and adjusted_lines:
-                # 尝试将避头字符移到上一行
-                prev_line = adjusted_lines[-1]
-                if prev_line and not is_forbidden_end_char(prev_line[-1]):
-                    # 可以移动
-                    adjusted_lines[-1] = prev_line + current_line[0]
-                    current_line = current_line[1:]
-        
-        # 检查行尾避尾字符
-        if current_line and is_forbidden_end_char(current_line[-1]):
-            if i < len(lines) - 1 and lines[i + 1]:
-                # 尝试将避尾字符移到下一行
-                next_line = lines[i + 1]
-                if next_line and not is_forbidden_start_char(next_line[0]):
-                    # 可以移动
-                    lines[i + 1] = current_line[-1] + next_line
-                    current_line = current_line[:-1]
-        
-        if current_line:
-            adjusted_lines.append(current_line)
+    def __init__(self, file, start, end):
+        file.seek(start)
+        self._file = file
+        self._remaining = None if end is None else end - start
     
-    return adjusted_lines
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        size = len(buffer) if self._remaining is None else min(len(buffer), self._remaining)
+        data = self._file.read(size)
+        buffer[:len(data)] = data
+        if self._remaining is not None:
+            self._remaining -= len(data)
+        return len(data)
 
-def wrap_text_with_indent(text, font, max_width, indent_chars="　　"):
+def iter_text_paragraphs(input_path, encoding, start=0, end=None):
     """
-    智能文本换行，支持段首缩进2个全角空格和避头尾规则
-    """
-    # 首先进行基本换行
-    lines = []
-    paragraphs = text.split('\n')
+    以指定编码流式读取文本文件，逐段（逐行）产出，结果与 file.read().split('\n') 相同
     
-    for paragraph in paragraphs:
-        if not paragraph.strip():  # 空行
-            lines.append("")
-            continue
+    解码按块增量进行，内存占用与文件大小无关；解码失败时抛出 UnicodeDecodeError。
+    给出字节范围 [start, end) 时只读取这一段（如拆分出的一个章节），范围应在行首处开始和结束
+    """
+    with open(input_path, 'rb') as raw:
+        if start == 0 and end is None:
+            file = io.TextIOWrapper(raw, encoding=encoding)
+        else:
+            file = io.TextIOWrapper(io.BufferedReader(_RangeReader(raw, start, end)), encoding=encoding)
+        with file:
+            ends_with_newline = True  # 空文件 split 的结果为 ['']
+            for line in file:
+                ends_with_newline = line.endswith('\n')
+                yield line[:-1] if ends_with_newline else line
             
-        # 段首添加2个全角空格
-        current_text = indent_chars + paragraph.strip()
-        char_list = list(current_text)
-        
-        current_line = ""
-        for char in char_list:
-            test_line = current_line + char
-            if font.getlength(test_line) <= max_width:
-                current_line = test_line
-            else:
-                if current_line:
-                    lines.append(current_line)
-                current_line = char
-        
-        if current_line:
-            lines.append(current_line)
-    
-    # 应用避头尾规则进行后处理
-    return apply_kinsoku_rules(lines)
+            # split('\n') 在末尾换行符之后还有一个空段（章节范围在下一章的行首结束，不算）
+            if ends_with_newline and end is None:
+                yield ""
 
 def calculate_optimal_width(font_size, scale_factor=2):
     """
@@ -223,26 +152,47 @@ def split_lines_into_pages(lines, max_lines_per_page=50):
     Returns:
         包含多个页面（每个页面是行列表）的列表
     """
-    pages = []
+    return list(iter_pages(lines, max_lines_per_page))
+
+def iter_pages(lines, max_lines_per_page=50):
+    """
+    split_lines_into_pages 的流式版本：每凑满一页就产出，只保留当前页
+    """
     current_page = []
     
     for line in lines:
         if len(current_page) < max_lines_per_page:
             current_page.append(line)
         else:
-            pages.append(current_page)
+            yield current_page
             current_page = [line]
     
-    # 添加最后一页
+    # 最后一页
     if current_page:
-        pages.append(current_page)
+        yield current_page
+
+def blend_palette(bg_color, text_color):
+    """
+    生成256色调色板：第a项为文字颜色以覆盖度a叠加在背景色上的结果
     
-    return pages
+    与Pillow绘制文字时的混合公式完全相同：(bg*(255-a) + fg*a) / 255（四舍五入）
+    """
+    bg_color = ImageColor.getrgb(bg_color) if isinstance(bg_color, str) else bg_color
+    text_color = ImageColor.getrgb(text_color) if isinstance(text_color, str) else text_color
+    palette = []
+    for alpha in range(256):
+        for bg, fg in zip(bg_color[:3], text_color[:3]):
+            tmp = bg * (255 - alpha) + fg * alpha + 128
+            palette.append(((tmp >> 8) + tmp) >> 8)
+    return palette
 
-def create_image_from_lines(lines, font, img_width, img_height, margin, bg_color, text_color, line_height):
+def create_image_from_lines(lines, font, img_width, img_height, margin, bg_color, text_color, line_height, render_backend='draw', color_mode='RGB'):
     """
     从文本行创建图片
     
+    页面只有背景色、文字颜色和两者的抗锯齿混合色：文字先绘制到单通道灰度蒙版上
+    （内存为RGB画布的三分之一），最后按调色板一次性上色，颜色与直接在RGB画布上绘制完全相同。
+    
     Args:
         lines: 文本行列表
         font: 字体对象
@@ -252,24 +202,470 @@ def create_image_from_lines(lines, font, img_width, img_height, margin, bg_color
         bg_color: 背景颜色
         text_color: 文字颜色
         line_height: 行高
+        render_backend: 文字渲染方式，'draw'（ImageDraw.text）或 'atlas'（字形缓存拼接，结果逐像素相同）
+        color_mode: 'RGB' 返回RGB图片；'P' 尽量直接返回调色板图片（供调色板PNG编码器使用，省去量化）
     
     Returns:
         PIL Image对象
     """
-    # 创建图片
-    image = Image.new('RGB', (img_width, img_height), color=bg_color)
+    # 相邻行的字形可能重叠时，重叠处的混合结果与逐行绘制在RGB上有舍入差异，改为直接绘制
+    ascent, descent = font.getmetrics() if hasattr(font, 'getmetrics') else (line_height, line_height)
+    use_mask = ascent + descent <= line_height
+    
+    # 创建图片（灰度蒙版：0为背景，255为文字）
+    if use_mask:
+        image = Image.new('L', (img_width, img_height), color=0)
+        fill = 255
+    else:
+        image = Image.new('RGB', (img_width, img_height), color=bg_color)
+        fill = text_color
     draw = ImageDraw.Draw(image)
+    draw_text = get_text_drawer(render_backend)
     
     # 绘制文本（左对齐）
     y = 40
     for line in lines:
         if line.strip():
-            draw.text((margin, y), line, font=font, fill=text_color)
+            draw_text(draw, (margin, y), line, font, fill)
         y += line_height
     
-    return image
+    if not use_mask:
+        return image
+    
+    # 按覆盖度查调色板上色
+    image.putpalette(blend_palette(bg_color, text_color))
+    return image if color_mode == 'P' else image.convert('RGB')
+
+def load_font(hd_font_size):
+    """
+    获取指定字号的中文字体（由字体注册表缓存，每个进程只加载一次）
+    """
+    return get_chinese_font(hd_font_size)
+
+def calculate_page_height(line_count, line_height):
+    """
+    计算页面高度（考虑缩放的最小高度为800）
+    """
+    return max(800, line_height * line_count + 80)
+
+def render_page(page_lines, output_path, *args):
+    """
+    渲染并保存单个页面（可在线程或进程中并行执行），参数同 encode_page
+    
+    图片先在内存中编码，只把最终结果写入磁盘
+    
+    Returns:
+        (页面高度, 编码统计信息)；统计信息中的 'timings' 为绘制、编码、写入各自的耗时
+    """
+    data, page_height, stats = encode_page(page_lines, *args)
+    start = time.perf_counter()
+    write_file_atomic(data, output_path)
+    stats['timings']['write'] = time.perf_counter() - start
+    return page_height, stats
+
+def encode_page(page_lines, hd_font_size, img_width, margin_px, bg_color, text_color, line_height, render_backend='draw', encoder=None):
+    """
+    在内存中渲染并编码单个页面
+    
+    encoder: 输出图片编码器（默认为最高质量JPEG）
+    
+    Returns:
+        (图片数据, 页面高度, 编码统计信息)；统计信息中的 'timings' 为绘制、编码各自的耗时，
+        'measure_calls' 为绘制时的字宽测量次数
+    """
+    font = load_font(hd_font_size)
+    measure_calls = measure_count()
+    
+    # 计算当前页的高度
+    page_height = calculate_page_height(len(page_lines), line_height)
+    
+    if encoder is None:
+        encoder = JpegEncoder()
+    
+    # 创建高清图片
+    start = time.perf_counter()
+    image = create_image_from_lines(
+        page_lines, font, img_width, page_height, 
+        margin_px, bg_color, text_color, line_height, render_backend,
+        'P' if encoder.palette_input else 'RGB'
+    )
+    rasterized = time.perf_counter()
+    
+    # 编码图片（默认：质量100、不做色度抽样、高质量量化表的JPEG）
+    data, stats = encoder.encode(image)
+    
+    stats['timings'] = {
+        'rasterize': rasterized - start,
+        'encode': time.perf_counter() - rasterized,
+    }
+    stats['measure_calls'] = measure_count() - measure_calls
+    return data, page_height, stats
+
+def render_text_pages(text, base_filename, font_size=26, bg_color=(255, 255, 255), text_color=(0, 0, 0), max_lines_per_page=50, render_backend='draw', encoder=None):
+    """
+    在内存中排版并渲染已解码的文本（不读写文件），页面和文件名与 convert_txt_file 的输出相同
+    
+    Returns:
+        每页的 (输出文件名, 图片数据) 列表
+    """
+    scale_factor = 2
+    hd_font_size = font_size * scale_factor
+    font = load_font(hd_font_size)
+    img_width = calculate_optimal_width(font_size, scale_factor)
+    margin_px = int(img_width * 0.08)
+    line_height = int(hd_font_size * 1.6)
+    if encoder is None:
+        encoder = JpegEncoder()
+    
+    # 与按文本模式读取文件一样统一换行符
+    paragraphs = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    lines = iter_wrapped_lines(paragraphs, font, img_width - 2 * margin_px)
+    pages = [
+        encode_page(page_lines, hd_font_size, img_width, margin_px, bg_color, text_color, line_height,
+                    render_backend, encoder)[0]
+        for page_lines in iter_pages(lines, max_lines_per_page)
+    ]
+    
+    if len(pages) == 1:
+        return [(f"{base_filename}{encoder.extension}", pages[0])]
+    return [(f"{base_filename}_页{page_num}{encoder.extension}", data) for page_num, data in enumerate(pages, 1)]
+
+def convert_txt_file(input_path, output_dir, font_size=26, bg_color=(255, 255, 255), text_color=(0, 0, 0), max_lines_per_page=50, verbose=True, page_workers=1, page_executor='thread', render_backend='draw', previous_pages=None, encoder=None, metrics=None, chapter=None, base_filename=None):
+    """
+    将单个TXT文件转换为高清JPG图片
+    
+    文件按块流式解码，段落逐个换行，每凑满一页立即渲染保存，
+    内存占用与文件大小无关，第一页在读完整个文件之前就已写出。
+    
+    Args:
+        input_path: 输入文件路径
+        output_dir: 输出目录
+        font_size: 基础字体大小
+        bg_color: 背景颜色
+        text_color: 文字颜色
+        max_lines_per_page: 每页最大行数
+        verbose: 是否打印每页的生成信息
+        page_workers: 并行渲染页面的线程/进程数（1为逐页顺序渲染）
+        page_executor: 页面并行方式，'thread'（JPEG编码时释放GIL）或 'process'
+        render_backend: 文字渲染方式，'draw' 或 'atlas'
+        previous_pages: 上次生成时记录的 输出文件名 -> 页面哈希；
+                        哈希未变化且文件仍存在的页面不重新生成，原文件保持不变
+        encoder: 输出图片编码器（默认为最高质量JPEG）
+        metrics: 记录各阶段耗时的 pipeline_metrics.FileMetrics（可选）
+        chapter: 拆分出的章节 (编码, 起始字节, 结束字节)；给出时只转换这一段，不再检测编码
+        base_filename: 输出文件名前缀（默认为输入文件名去掉扩展名）
+    
+    Returns:
+        每页的 (输出文件名, 页面哈希) 列表
+    """
+    txt_file = os.path.basename(input_path)
+    if metrics is None:
+        metrics = FileMetrics(txt_file)
+    if base_filename is None:
+        base_filename = os.path.splitext(txt_file)[0]
+    
+    # 高清缩放因子（2倍用于视网膜屏）
+    scale_factor = 2
+    hd_font_size = font_size * scale_factor
+    
+    # 获取中文字体（使用放大后的字体大小）
+    font = load_font(hd_font_size)
+    
+    # 计算适合手机屏幕的宽度（考虑缩放因子）
+    img_width = calculate_optimal_width(font_size, scale_factor)
+    margin_px = int(img_width * 0.08)  # 8%的边距
+    usable_width = img_width - 2 * margin_px
+    
+    # 计算每页的高度
+    line_height = int(hd_font_size * 1.6)  # 1.6倍行距
+    
+    if verbose:
+        chapter_text = f" / {base_filename}" if chapter is not None else ""
+        print(f"处理文件: {txt_file}{chapter_text}, 图片宽度: {img_width}px, 高清模式: {scale_factor}x")
+    
+    if encoder is None:
+        encoder = JpegEncoder()
+    extension = encoder.extension
+    
+    page_args = (hd_font_size, img_width, margin_px, bg_color, text_color, line_height, render_backend, encoder)
+    
+    # 每页的哈希由排版后的行和渲染参数决定（渲染后端不影响输出，不计入）
+    render_params = {
+        'font': font_identity(font),
+        'font_size': hd_font_size,
+        'img_width': img_width,
+        'margin': margin_px,
+        'bg_color': bg_color,
+        'text_color': text_color,
+        'line_height': line_height,
+        'encoder': encoder.describe(),
+    }
+    previous_pages = previous_pages or {}
+    failed_outputs = set()  # 解码失败的尝试中已写出的图片（内容不可信）
+    
+    def render_stream(paragraphs, executor, written):
+        """把段落流排版并渲染，返回每页的 (输出文件名, 页面哈希)"""
+        results = []
+        pending = deque()  # 已提交到并行执行器、尚未完成的页面
+        skipped = 0
+        
+        def report(page_num, output_filename, result):
+            page_height, stats = result
+            metrics.rendered_pages += 1
+            for stage, seconds in stats.get('timings', {}).items():
+                metrics.add(stage, seconds)
+            metrics.add_encode_stats(output_filename, stats)
+            # 渲染进程中的测量不在本进程的计数里（渲染线程的已经计入）
+            if isinstance(executor, ProcessPoolExecutor):
+                metrics.add_measure_calls(stats['measure_calls'])
+            if verbose:
+                stats_text = format_encode_stats(stats)
+                print(f"  ✓ 生成页面 {page_num}: {output_filename} ({img_width}x{page_height}"
+                      f"{', ' + stats_text if stats_text else ''})")
+        
+        def collect_oldest():
+            page_num, output_filename, future = pending.popleft()
+            report(page_num, output_filename, future.result())
+        
+        def submit(page_num, page_lines, output_filename):
+            nonlocal skipped
+            with metrics.stage('paginate'):
+                current_hash = page_hash(page_lines, render_params)
+            results.append((output_filename, current_hash))
+            output_path = os.path.join(output_dir, output_filename)
+            
+            # 只重新生成哈希有变化或文件缺失的页面
+            if (previous_pages.get(output_filename) == current_hash
+                    and output_filename not in failed_outputs
+                    and os.path.exists(output_path)):
+                skipped += 1
+                return
+            
+            written.append(output_filename)
+            if executor is None:
+                report(page_num, output_filename, render_page(page_lines, output_path, *page_args))
+                return
+            
+            # 限制同时在途的页面数，保证内存占用不随文件大小增长
+            pending.append((page_num, output_filename, executor.submit(render_page, page_lines, output_path, *page_args)))
+            while len(pending) >= page_workers * 2:
+                collect_oldest()
+        
+        try:
+            # 每个流式环节单独计时（外层环节不包含从内层取数据的时间）
+            source = metrics.timed_iter(paragraphs, 'decode')
+            lines = metrics.timed_iter(iter_wrapped_lines(source, font, usable_width), 'wrap')
+            pages = metrics.timed_iter(iter_pages(lines, max_lines_per_page), 'paginate')
+            
+            # 只有一页时文件名不带页码，因此第一页要等到第二页出现（或文件读完）才能确定文件名
+            first_page = next(pages)
+            second_page = next(pages, None)
+            if second_page is None:
+                submit(1, first_page, f"{base_filename}{extension}")
+            else:
+                submit(1, first_page, f"{base_filename}_页1{extension}")
+                submit(2, second_page, f"{base_filename}_页2{extension}")
+                del first_page, second_page
+                for page_num, page_lines in enumerate(pages, 3):
+                    submit(page_num, page_lines, f"{base_filename}_页{page_num}{extension}")
+            
+            while pending:
+                collect_oldest()
+        finally:
+            # 出错时也要等在途页面写完，避免与下一次尝试同时写同一文件
+            wait([future for _, _, future in pending])
+        
+        if verbose and skipped:
+            print(f"  - {skipped} 页内容未变化，保留原图片")
+        return results
+    
+    executor = None
+    if page_workers > 1:
+        if page_executor == 'process':
+            executor = ProcessPoolExecutor(max_workers=page_workers, initializer=init_worker,
+                                           initargs=((load_font,), hd_font_size, MEASURE_CACHE.max_entries))
+        else:
+            executor = ThreadPoolExecutor(max_workers=page_workers)
+    
+    try:
+        # 章节任务：编码已在拆分时确定，只读取该章节的字节范围
+        if chapter is not None:
+            encoding, start, end = chapter
+            results = render_stream(iter_text_paragraphs(input_path, encoding, start, end), executor, [])
+            metrics.pages = len(results)
+            return results
+        
+        # 按文件开头样本检测编码；样本之后出现解码错误时换下一个候选编码重新开始
+        with metrics.stage('decode'):
+            guess = sniff_file_encoding(input_path)
+        
+        for encoding in guess.candidates:
+            # 先从段落流中取出开头两段：开头就无法解码时直接换下一个编码，空文件（只有一个空段）不转换
+            paragraphs = iter_text_paragraphs(input_path, encoding)
+            try:
+                with metrics.stage('decode'):
+                    head = list(itertools.islice(paragraphs, 2))
+            except UnicodeDecodeError:
+                continue
+            if head == [""]:
+                raise Exception("无法解码文件")
+            
+            if verbose:
+                if encoding == guess.encoding:
+                    print(f"  检测到编码: {encoding} (置信度: {guess.confidence:.0%})")
+                else:
+                    print(f"  改用编码: {encoding}")
+            
+            written = []
+            try:
+                results = render_stream(itertools.chain(head, paragraphs), executor, written)
+            except UnicodeDecodeError:
+                failed_outputs.update(written)
+                continue
+            
+            # 删除之前错误解码时写出、这次没有再生成的图片
+            remove_outputs(output_dir, failed_outputs.difference(name for name, _ in results))
+            metrics.pages = len(results)
+            return results
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    
+    raise Exception("无法解码文件")
+
+def convert_txt_file_with_metrics(input_path, *args):
+    """
+    转换单个文件并统计各阶段耗时（可在进程池中执行）
+    
+    Returns:
+        (convert_txt_file 的结果, FileMetrics)
+    """
+    metrics = FileMetrics(os.path.basename(input_path))
+    metrics.start()
+    pages = convert_txt_file(input_path, *args, metrics=metrics)
+    metrics.finish()
+    return pages, metrics
+
+def chapter_dir_name(index, title):
+    """
+    章节输出子目录名：三位序号加标题（去掉文件名中不允许的字符），如 001_第一章 初见
+    """
+    title = re.sub(r'[\\/:*?"<>|\s]+', ' ', title).strip(' .')[:40].rstrip(' .')
+    return f"{index:03d}_{title}" if title else f"{index:03d}"
+
+def chapter_range_encoding(input_path, encoding):
+    """
+    按字节范围读取章节时使用的编码和BOM长度：带BOM的编码换成不带BOM的具体编码
+    （从文件中间开始解码时没有BOM可用来判断字节序）
+    
+    Returns:
+        (编码, 文件开头BOM的字节数)
+    """
+    if encoding not in ('utf-8-sig', 'utf-16', 'utf-32'):
+        return encoding, 0
+    with open(input_path, 'rb') as file:
+        head = file.read(4)
+    if encoding == 'utf-8-sig':
+        return 'utf-8', len(codecs.BOM_UTF8) if head.startswith(codecs.BOM_UTF8) else 0
+    if encoding == 'utf-32':
+        return ('utf-32-le' if head.startswith(codecs.BOM_UTF32_LE) else 'utf-32-be'), 4
+    return ('utf-16-le' if head.startswith(codecs.BOM_UTF16_LE) else 'utf-16-be'), 2
 
-def txt_to_jpg_batch(input_dir, output_dir, backup_dir, font_size=26, bg_color=(255, 255, 255), text_color=(0, 0, 0), max_lines_per_page=50):
+def split_chapters(input_path, chapter_pattern):
+    """
+    章节预扫描：逐行流式读取文件，按章节标题找出每章的字节范围（不在内存中保存正文）
+    
+    chapter_pattern 为匹配章节标题行的正则（从行首匹配），标题行作为该章的第一段；
+    第一个标题之前有内容时作为序号为000的一章。
+    
+    Returns:
+        (编码, [(章节目录名, 起始字节, 结束字节), ...])，最后一章的结束字节为None（读到文件末尾）；
+        没有匹配到标题时章节列表为空
+    """
+    pattern = re.compile(chapter_pattern)
+    guess = sniff_file_encoding(input_path)
+    
+    for encoding in guess.candidates:
+        range_encoding, offset = chapter_range_encoding(input_path, encoding)
+        content_start = offset
+        headings = []  # (标题, 起始字节)
+        has_preface = False
+        try:
+            # newline='' 保留原始换行符，才能按编码后的长度累加字节位置
+            with open(input_path, 'r', encoding=encoding, newline='') as file:
+                for line in file:
+                    paragraph = line.rstrip('\r\n')
+                    if pattern.match(paragraph):
+                        headings.append((paragraph.strip(), offset))
+                    elif not headings and paragraph.strip():
+                        has_preface = True
+                    offset += len(line.encode(range_encoding))
+        except UnicodeDecodeError:
+            continue
+        
+        # 重新编码的长度与原文件不符时（编码不能往返）无法按字节定位，整个文件照常转换
+        if not headings or offset != os.path.getsize(input_path):
+            return range_encoding, []
+        
+        chapters = []
+        if has_preface:
+            chapters.append((chapter_dir_name(0, '开头'), content_start, headings[0][1]))
+        for number, (title, start) in enumerate(headings, 1):
+            end = headings[number][1] if number < len(headings) else None
+            chapters.append((chapter_dir_name(number, title), start, end))
+        return range_encoding, chapters
+    
+    raise Exception("无法解码文件")
+
+def convert_txt_chapter_with_metrics(input_path, output_dir, chapter_name, encoding, start, end, *args):
+    """
+    转换拆分出的一个章节（可在进程池中执行），输出到 output_dir 下与章节同名的子目录，页码从1开始
+    
+    只传递章节的字节范围，工作进程自己流式读取该段文字
+    
+    Returns:
+        (convert_txt_file 的结果, FileMetrics)
+    """
+    metrics = FileMetrics(f"{os.path.basename(input_path)}/{chapter_name}")
+    metrics.start()
+    chapter_dir = os.path.join(output_dir, chapter_name)
+    os.makedirs(chapter_dir, exist_ok=True)
+    pages = convert_txt_file(input_path, chapter_dir, *args, metrics=metrics,
+                             chapter=(encoding, start, end), base_filename=chapter_name)
+    metrics.finish()
+    return pages, metrics
+
+def layout_txt_file(input_path, font_size=26, max_lines_per_page=50):
+    """
+    只排版不渲染：解码、换行、避头尾处理和分页，返回行数、页数和每页尺寸
+    
+    Returns:
+        layout_report.file_report() 的结果
+    """
+    scale_factor = 2
+    hd_font_size = font_size * scale_factor
+    font = load_font(hd_font_size)
+    img_width = calculate_optimal_width(font_size, scale_factor)
+    margin_px = int(img_width * 0.08)
+    line_height = int(hd_font_size * 1.6)
+    
+    guess = sniff_file_encoding(input_path)
+    for encoding in guess.candidates:
+        line_count = 0
+        page_sizes = []
+        try:
+            paragraphs = iter_text_paragraphs(input_path, encoding)
+            lines = iter_wrapped_lines(paragraphs, font, img_width - 2 * margin_px)
+            for page_lines in iter_pages(lines, max_lines_per_page):
+                line_count += len(page_lines)
+                page_sizes.append((img_width, calculate_page_height(len(page_lines), line_height)))
+        except UnicodeDecodeError:
+            continue
+        return file_report(os.path.basename(input_path), encoding, line_count, page_sizes)
+    
+    raise Exception("无法解码文件")
+
+def txt_to_jpg_batch(input_dir, output_dir, backup_dir, font_size=26, bg_color=(255, 255, 255), text_color=(0, 0, 0), max_lines_per_page=50, workers=1, page_workers=1, page_executor='thread', render_backend='draw', incremental=False, move_to_backup=True, output_format='jpeg', encoder_options=None, selected_files=None, executor=None, dry_run=False, metrics_file=None, measure_cache_size=None, chapter_pattern=None):
     """
     批量将TXT文件转换为高清JPG图片（支持中文避头尾规则和分页功能）
     
@@ -281,15 +677,107 @@ def txt_to_jpg_batch(input_dir, output_dir, backup_dir, font_size=26, bg_color=(
         bg_color: 背景颜色
         text_color: 文字颜色
         max_lines_per_page: 每页最大行数
+        workers: 并行转换的进程数（1为单进程顺序转换）
+        page_workers: 单个文件内并行渲染页面的线程/进程数
+        page_executor: 页面并行方式，'thread' 或 'process'
+        render_backend: 文字渲染方式，'draw' 或 'atlas'
+        incremental: 增量模式，跳过内容和参数都未变化的文件，并清理过期的输出图片
+        move_to_backup: 转换成功后是否把原文件移到备份目录（关闭时原文件留在输入目录）
+        output_format: 输出格式，'jpeg'（默认）、'png'（调色板）、'webp' 或 'avif'
+        encoder_options: 编码器参数，如 {'quality': 90}；不指定时使用各格式的默认值；
+                         JPEG 可指定 {'target_size': 字节数}，每页自动搜索不超过该大小的最高质量
+        selected_files: 只转换输入目录中的这些文件（默认为全部TXT文件）
+        executor: 复用已有的进程池（监视模式下常驻，字体和缓存保持加载）；默认 workers 大于1时临时创建
+        dry_run: 预演模式，只排版不渲染，把每个文件的行数、页数和页面尺寸写入输出目录中的JSON报告
+        metrics_file: 性能统计文件（.json 或 .csv，相对路径保存在输出目录中），
+                      记录每个文件和整批各阶段的耗时、字宽测量次数和峰值内存
+        measure_cache_size: 文本宽度缓存最多保存的条目数（默认65536，并行时每个进程各一份）
+        chapter_pattern: 章节标题的正则；指定时按章节把每个文件拆成独立的转换任务，
+                         输出到 输出目录/文件名/序号_章节标题/ 中，每章的页码从1开始
+                         （没有匹配到章节标题的文件照常整体转换）
     """
     
+    if measure_cache_size is not None:
+        set_measure_cache_size(measure_cache_size)
+    
+    # 先创建编码器，格式不可用时在转换开始前报错
+    encoder = get_encoder(output_format, **(encoder_options or {}))
+    
     os.makedirs(output_dir, exist_ok=True)
-    os.makedirs(backup_dir, exist_ok=True)
+    if move_to_backup and not dry_run:
+        os.makedirs(backup_dir, exist_ok=True)
     
-    txt_files = [f for f in os.listdir(input_dir) if f.lower().endswith('.txt')]
+    all_txt_files = [f for f in os.listdir(input_dir) if f.lower().endswith('.txt')]
+    if selected_files is None:
+        txt_files = all_txt_files
+    else:
+        txt_files = [f for f in all_txt_files if f in set(selected_files)]
+    
+    # 预演模式：只排版并输出报告，不生成图片、不移动原文件
+    if dry_run:
+        reports = []
+        failures = {}
+        for txt_file in sorted(txt_files):
+            try:
+                reports.append(layout_txt_file(os.path.join(input_dir, txt_file), font_size, max_lines_per_page))
+            except Exception as e:
+                print(f"✗ 排版失败: {txt_file} - 错误: {str(e)}")
+                failures[txt_file] = str(e)
+        
+        report_path = os.path.join(output_dir, LAYOUT_REPORT_FILENAME)
+        report = write_layout_report(report_path, {
+            'script': 'txt_to_jpg',
+            'font_size': font_size,
+            'max_lines_per_page': max_lines_per_page,
+        }, reports, failures)
+        print_layout_summary(report)
+        print(f"排版报告保存在: {report_path}")
+        return
+    
+    # 增量模式：对比构建清单，只转换内容或参数有变化的文件
+    batch_metrics = BatchMetrics('txt_to_jpg')
+    manifest = None
+    input_hashes = {}
+    skip_count = 0
+    if incremental:
+        manifest = BuildManifest(os.path.join(output_dir, MANIFEST_FILENAME))
+        render_settings = {
+            'script': 'txt_to_jpg',
+            'font': font_identity(load_font(font_size * 2)),
+            'font_size': font_size,
+            'bg_color': bg_color,
+            'text_color': text_color,
+            'max_lines_per_page': max_lines_per_page,
+            'encoder': encoder.describe(),
+        }
+        if chapter_pattern:
+            render_settings['chapter_pattern'] = chapter_pattern
+        render_hash = config_hash(render_settings)
+        
+        # 原文件保留在输入目录时，输入目录中已删除的文件其输出也应删除
+        if not move_to_backup:
+            for txt_file in manifest.forget_missing(all_txt_files, output_dir):
+                print(f"- 源文件已删除，清理输出: {txt_file}")
+        
+        for txt_file in txt_files:
+            with batch_metrics.batch.stage('hash'):
+                input_hash = file_hash(os.path.join(input_dir, txt_file))
+            if manifest.is_up_to_date(txt_file, input_hash, render_hash, output_dir):
+                skip_count += 1
+                if move_to_backup:
+                    shutil.move(os.path.join(input_dir, txt_file), os.path.join(backup_dir, txt_file))
+            else:
+                input_hashes[txt_file] = input_hash
+        
+        print(f"增量模式: {skip_count} 个文件未变化，已跳过")
+        txt_files = [txt_file for txt_file in txt_files if txt_file in input_hashes]
+        manifest.save()
     
     if not txt_files:
-        print(f"在目录 {input_dir} 中没有找到TXT文件")
+        if skip_count:
+            print("所有文件均未变化，无需转换")
+        else:
+            print(f"在目录 {input_dir} 中没有找到TXT文件")
         return
     
     print(f"找到 {len(txt_files)} 个TXT文件，开始高清转换...")
@@ -301,100 +789,211 @@ def txt_to_jpg_batch(input_dir, output_dir, backup_dir, font_size=26, bg_color=(
     fail_count = 0
     total_pages = 0
     
+    def previous_pages(txt_file, prefix=''):
+        # 增量模式下传入上次的页面哈希，只重新生成有变化的页面；
+        # 章节任务只取该章节子目录中的页面（去掉子目录前缀）
+        if manifest is None:
+            return None
+        return {output[len(prefix):]: page for output, page in manifest.page_hashes(txt_file).items()
+                if output.startswith(prefix)}
+    
+    def finish(txt_file, pages, file_metrics_list, chapter_count=0):
+        # 输出已全部写入，再更新构建清单、移动原文件到备份目录
+        nonlocal success_count, total_pages
+        page_count = len(pages)
+        if manifest is not None:
+            outputs = [output_filename for output_filename, _ in pages]
+            for stale_output in manifest.record(txt_file, input_hashes[txt_file], render_hash,
+                                                outputs, output_dir, dict(pages)):
+                print(f"  - 删除过期输出: {stale_output}")
+        if move_to_backup:
+            with file_metrics_list[-1].stage('backup'):
+                shutil.move(os.path.join(input_dir, txt_file), os.path.join(backup_dir, txt_file))
+        for file_metrics in file_metrics_list:
+            batch_metrics.add_file(file_metrics)
+        chapter_text = f" ({chapter_count} 章)" if chapter_count else ""
+        print(f"✓ 成功转换: {txt_file} -> {page_count} 张图片{chapter_text}")
+        if workers > 1:
+            # 并行转换时工作进程不打印每页的信息，按目标大小搜索质量的统计在这里打印
+            for file_metrics in file_metrics_list:
+                for output_filename, stats in file_metrics.encode_stats:
+                    print(f"  ✓ {output_filename}: {format_encode_stats(stats)}")
+        success_count += 1
+        total_pages += page_count
+    
+    def fail(txt_file, e):
+        nonlocal fail_count
+        print(f"✗ 转换失败: {txt_file} - 错误: {str(e)}")
+        import traceback
+        traceback.print_exception(type(e), e, e.__traceback__)
+        fail_count += 1
+    
+    # 每个文件拆成一个或多个任务：(文件名, 章节目录名, 转换函数, 参数)；
+    # 整体转换的文件章节目录名为None
+    jobs = []
     for txt_file in txt_files:
         input_path = os.path.join(input_dir, txt_file)
-        base_filename = os.path.splitext(txt_file)[0]
-        backup_path = os.path.join(backup_dir, txt_file)
+        chapters = []
+        if chapter_pattern:
+            try:
+                encoding, chapters = split_chapters(input_path, chapter_pattern)
+            except Exception as e:
+                fail(txt_file, e)
+                continue
+        
+        if not chapters:
+            jobs.append((txt_file, None, convert_txt_file_with_metrics, (
+                input_path, output_dir, font_size, bg_color, text_color, max_lines_per_page,
+                workers <= 1, page_workers, page_executor, render_backend,
+                previous_pages(txt_file), encoder
+            )))
+            continue
+        
+        print(f"拆分章节: {txt_file} -> {len(chapters)} 章 (编码 {encoding})")
+        file_dir = os.path.join(output_dir, os.path.splitext(txt_file)[0])
+        for chapter_name, start, end in chapters:
+            prefix = f"{os.path.splitext(txt_file)[0]}/{chapter_name}/"
+            jobs.append((txt_file, chapter_name, convert_txt_chapter_with_metrics, (
+                input_path, file_dir, chapter_name, encoding, start, end,
+                font_size, bg_color, text_color, max_lines_per_page,
+                workers <= 1, page_workers, page_executor, render_backend,
+                previous_pages(txt_file, prefix), encoder
+            )))
+    
+    # 同一文件的任务全部完成后才算该文件转换完成；章节的输出文件名加上子目录前缀
+    remaining = {}
+    for txt_file, _, _, _ in jobs:
+        remaining[txt_file] = remaining.get(txt_file, 0) + 1
+    file_pages = {txt_file: [] for txt_file in remaining}
+    file_metrics_lists = {txt_file: [] for txt_file in remaining}
+    file_errors = {}
+    
+    def job_done(txt_file, chapter_name, result=None, error=None):
+        if error is not None:
+            file_errors.setdefault(txt_file, error)
+        else:
+            pages, metrics = result
+            if chapter_name is not None:
+                prefix = f"{os.path.splitext(txt_file)[0]}/{chapter_name}/"
+                pages = [(prefix + output_filename, page) for output_filename, page in pages]
+            file_pages[txt_file].extend(pages)
+            file_metrics_lists[txt_file].append(metrics)
         
+        remaining[txt_file] -= 1
+        if remaining[txt_file]:
+            return
+        if txt_file in file_errors:
+            fail(txt_file, file_errors[txt_file])
+            return
+        chapter_count = len(file_metrics_lists[txt_file]) if chapter_name is not None else 0
         try:
-            # 读取文本文件
-            text = ""
-            encodings = ['utf-8', 'gbk', 'gb2312', 'big5', 'utf-16']
+            # 章节按完成顺序到达，清单中按输出路径排序
+            finish(txt_file, sorted(file_pages[txt_file]), file_metrics_lists[txt_file], chapter_count)
+        except Exception as e:
+            fail(txt_file, e)
+    
+    if workers > 1 and jobs:
+        print(f"使用 {workers} 个进程并行转换（共 {len(jobs)} 个任务）")
+        if executor is None:
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                       initargs=((load_font,), font_size * 2, MEASURE_CACHE.max_entries))
+        else:
+            pool = nullcontext(executor)
+        with pool as executor:
+            futures = {
+                executor.submit(function, *args): (txt_file, chapter_name)
+                for txt_file, chapter_name, function, args in jobs
+            }
             
-            for encoding in encodings:
+            for done, future in enumerate(as_completed(futures), 1):
+                txt_file, chapter_name = futures[future]
+                if not remaining[txt_file] - 1:
+                    print(f"[{done}/{len(jobs)}] ", end="")
                 try:
-                    with open(input_path, 'r', encoding=encoding) as file:
-                        text = file.read()
-                    break
-                except UnicodeDecodeError:
-                    continue
-            
-            if not text:
-                raise Exception("无法解码文件")
-            
-            # 高清缩放因子（2倍用于视网膜屏）
-            scale_factor = 2
-            hd_font_size = font_size * scale_factor
-            
-            # 获取中文字体（使用放大后的字体大小）
-            font = get_chinese_font(hd_font_size)
-            
-            # 计算适合手机屏幕的宽度（考虑缩放因子）
-            img_width = calculate_optimal_width(font_size, scale_factor)
-            margin_px = int(img_width * 0.08)  # 8%的边距
-            usable_width = img_width - 2 * margin_px
-            
-            print(f"处理文件: {txt_file}, 图片宽度: {img_width}px, 高清模式: {scale_factor}x")
-            
-            # 智能换行（支持段首缩进和避头尾规则）
-            all_lines = wrap_text_with_indent(text, font, usable_width)
-            
-            # 将文本行分割成多个页面
-            pages = split_lines_into_pages(all_lines, max_lines_per_page)
-            
-            # 计算每页的高度
-            line_height = int(hd_font_size * 1.6)  # 1.6倍行距
-            min_height = 800  # 最小高度（考虑缩放）
-            
-            # 为每个页面创建图片
-            for page_num, page_lines in enumerate(pages, 1):
-                # 计算当前页的高度
-                page_height = line_height * len(page_lines) + 80
-                if page_height < min_height:
-                    page_height = min_height
-                
-                # 创建高清图片
-                image = create_image_from_lines(
-                    page_lines, font, img_width, page_height, 
-                    margin_px, bg_color, text_color, line_height
-                )
-                
-                # 生成带页码的输出文件名
-                if len(pages) > 1:
-                    output_filename = f"{base_filename}_页{page_num}.jpg"
+                    result = future.result()
+                except Exception as e:
+                    job_done(txt_file, chapter_name, error=e)
                 else:
-                    output_filename = f"{base_filename}.jpg"
-                
-                output_path = os.path.join(output_dir, output_filename)
-                
-                # 保存超高质量图片
-                image.save(
-                    output_path, 
-                    'JPEG', 
-                    quality=100,           # 最高质量
-                    optimize=True,         # 优化压缩
-                    subsampling=0,         # 不进行色度抽样（保持最高色彩质量）
-                    qtables='web_high'     # 使用高质量量化表
-                )
-                
-                print(f"  ✓ 生成页面 {page_num}/{len(pages)}: {output_filename} ({img_width}x{page_height})")
-            
-            # 移动原文件到备份目录
-            shutil.move(input_path, backup_path)
-            
-            print(f"✓ 成功转换: {txt_file} -> {len(pages)} 张图片")
-            success_count += 1
-            total_pages += len(pages)
-            
-        except Exception as e:
-            print(f"✗ 转换失败: {txt_file} - 错误: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            fail_count += 1
+                    job_done(txt_file, chapter_name, result)
+    else:
+        for txt_file, chapter_name, function, args in jobs:
+            try:
+                result = function(*args)
+            except Exception as e:
+                job_done(txt_file, chapter_name, error=e)
+            else:
+                job_done(txt_file, chapter_name, result)
+    
+    if manifest is not None:
+        manifest.save()
     
     print(f"\n高清转换完成！成功: {success_count}, 失败: {fail_count}, 总页数: {total_pages}")
+    if incremental:
+        print(f"未变化跳过: {skip_count}")
+    font_stats = FONT_REGISTRY.stats()
+    print(f"字体缓存: 命中 {font_stats['hits']} 次, 加载 {font_stats['misses']} 次")
+    if render_backend == 'atlas' and workers <= 1 and (page_workers <= 1 or page_executor == 'thread'):
+        print(format_atlas_stats(GLYPH_ATLAS.stats()))
+    if workers <= 1:
+        print(format_measure_stats(MEASURE_CACHE.stats()))
+    if metrics_file:
+        metrics_path = os.path.join(output_dir, metrics_file)
+        batch_metrics.write(metrics_path)
+        batch_metrics.print_summary()
+        print(f"性能统计保存在: {metrics_path}")
     print(f"高清图片保存在: {output_dir}")
-    print(f"原文件备份在: {backup_dir}")
+    if move_to_backup:
+        print(f"原文件备份在: {backup_dir}")
+
+def txt_to_jpg_watch(input_dir, output_dir, backup_dir, poll_interval=0.5, settle_time=0.3, **batch_options):
+    """
+    监视模式：常驻进程，先转换目录中已有的TXT文件，之后每当有新的（或修改过的）文件写完就立即转换
+    
+    进程只启动一次：字体注册表、字形缓存和进程池（workers 大于1时）在整个监视期间保持加载，
+    新文件从写完到生成图片只需要排版和编码的时间。按 Ctrl+C 退出。
+    
+    Args:
+        poll_interval: 没有安装 watchdog 时轮询目录的间隔（秒）
+        settle_time: 文件大小和修改时间保持不变多久才认为已经写完（秒）
+        batch_options: 传给 txt_to_jpg_batch 的其余参数
+    """
+    if not batch_options.get('move_to_backup', True) and not batch_options.get('incremental', False):
+        print("提示: 原文件不移走时建议同时开启增量模式，修改文件后只重新生成变化的页面")
+    
+    workers = batch_options.get('workers', 1)
+    font_size = batch_options.get('font_size', 26)
+    set_measure_cache_size(batch_options.get('measure_cache_size'))
+    watcher = DirectoryWatcher(input_dir, ['.txt'], poll_interval, settle_time)
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                       initargs=((load_font,), font_size * 2, MEASURE_CACHE.max_entries))
+    else:
+        load_font(font_size * 2)  # 预先加载字体
+    
+    # 先记录目录状态再转换已有文件，转换期间新放入的文件不会漏掉
+    watcher.start()
+    try:
+        txt_to_jpg_batch(input_dir, output_dir, backup_dir, executor=executor, **batch_options)
+        print(f"\n监视模式: 正在监视 {input_dir}（{watcher.backend}），按 Ctrl+C 退出")
+        while True:
+            ready = watcher.wait_for_files()
+            start = time.perf_counter()
+            print(f"\n发现 {len(ready)} 个新文件: {', '.join(ready)}")
+            txt_to_jpg_batch(input_dir, output_dir, backup_dir, selected_files=ready, executor=executor, **batch_options)
+            print(f"用时 {time.perf_counter() - start:.2f} 秒，继续监视...")
+    except KeyboardInterrupt:
+        print("\n监视已停止")
+    finally:
+        watcher.stop()
+        if executor is not None:
+            executor.shutdown()
+
+# 增量构建清单文件名（保存在输出目录中）
+MANIFEST_FILENAME = '.txt_to_jpg_manifest.json'
+
+# 预演模式的排版报告文件名（保存在输出目录中）
+LAYOUT_REPORT_FILENAME = 'txt_to_jpg_layout.json'
 
 # 高清配置参数
 CONFIG = {
@@ -405,6 +1004,23 @@ CONFIG = {
     'jpeg_quality': 100,       # JPEG质量（100%最高）
     'indent_chars': "　　",     # 段首缩进
     'max_lines_per_page': 50,  # 每页最大行数
+    'workers': 1,              # 并行转换的进程数（1为单进程）
+    'page_workers': 1,         # 单个文件内并行渲染页面的线程/进程数
+    'page_executor': 'thread', # 页面并行方式：'thread' 或 'process'
+    'render_backend': 'draw',  # 文字渲染方式：'draw'（ImageDraw）或 'atlas'（字形缓存，输出相同）
+    'measure_cache_size': 65536,  # 文本宽度缓存的条目上限（LRU淘汰），控制大批量转换时的内存
+    'output_format': 'jpeg',   # 输出格式：'jpeg'、'png'（调色板）、'webp'、'avif'
+    'encoder_options': {},     # 编码器参数，如 {'quality': 90} 或 {'lossless': True}；
+                               # JPEG按目标大小自动选质量：{'target_size': 500 * 1024, 'min_quality': 10}
+    'incremental': False,      # 增量模式：跳过未变化的文件，清理过期输出
+    'move_to_backup': True,    # 转换成功后是否把原文件移到备份目录
+    'split_chapters': False,   # 按章节拆分长篇小说，每章单独转换到子目录中（也可用命令行参数 --chapters）
+    'chapter_pattern': r'^\s*第[0-9０-９零〇一二三四五六七八九十百千万两]+[章回节卷集部篇]',  # 章节标题的正则
+    'watch': False,            # 监视模式：常驻运行，新文件放入输入目录后自动转换（也可用命令行参数 --watch）
+    'poll_interval': 0.5,      # 监视模式下没有 watchdog 时轮询目录的间隔（秒）
+    'dry_run': False,          # 预演模式：只排版，输出页数和页面尺寸报告（也可用命令行参数 --dry-run）
+    'metrics_file': None,      # 性能统计文件，如 'metrics.json' 或 'metrics.csv'（保存在输出目录中）
+    'profile': False,          # 是否用 cProfile 分析整个批量转换，结果保存为输出目录中的 txt_to_jpg.prof
 }
 
 if __name__ == "__main__":
@@ -418,13 +1034,35 @@ if __name__ == "__main__":
         print(f"错误: 输入目录不存在: {input_directory}")
         print("请创建目录或修改脚本中的路径")
     else:
-        # 执行高清批量转换
-        txt_to_jpg_batch(
-            input_dir=input_directory,
-            output_dir=output_directory,
-            backup_dir=backup_directory,
+        batch_options = dict(
             font_size=CONFIG['font_size'],
             bg_color=(244, 238, 235),
             text_color=(59, 4, 0),
-            max_lines_per_page=CONFIG['max_lines_per_page']
-        )
\ No newline at end of file
+            max_lines_per_page=CONFIG['max_lines_per_page'],
+            workers=CONFIG['workers'],
+            page_workers=CONFIG['page_workers'],
+            page_executor=CONFIG['page_executor'],
+            render_backend=CONFIG['render_backend'],
+            measure_cache_size=CONFIG['measure_cache_size'],
+            output_format=CONFIG['output_format'],
+            encoder_options=CONFIG['encoder_options'],
+            incremental=CONFIG['incremental'],
+            move_to_backup=CONFIG['move_to_backup'],
+            dry_run=CONFIG['dry_run'] or '--dry-run' in sys.argv,
+            metrics_file=CONFIG['metrics_file']
+        )
+        if CONFIG['split_chapters'] or '--chapters' in sys.argv:
+            batch_options['chapter_pattern'] = CONFIG['chapter_pattern']
+        
+        if CONFIG['watch'] or '--watch' in sys.argv:
+            # 监视模式：常驻运行，字体和缓存保持加载
+            txt_to_jpg_watch(input_directory, output_directory, backup_directory,
+                             poll_interval=CONFIG['poll_interval'], **batch_options)
+        elif CONFIG['profile'] or '--profile' in sys.argv:
+            # 在 cProfile 下执行批量转换（只分析主进程）
+            os.makedirs(output_directory, exist_ok=True)
+            run_profiled(os.path.join(output_directory, 'txt_to_jpg.prof'), txt_to_jpg_batch,
+                         input_directory, output_directory, backup_directory, **batch_options)
+        else:
+            # 执行高清批量转换
+            txt_to_jpg_batch(input_directory, output_directory, backup_directory, **batch_options)
\ No newline at end of file